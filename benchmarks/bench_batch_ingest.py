@@ -0,0 +1,91 @@
+"""
+Throughput benchmark: single-sample update_database vs update_database_batch.
+
+Runs against a throwaway SQLite database so it needs no MySQL server:
+
+    python benchmarks/bench_batch_ingest.py --samples 2000 --devices 50 --batch-size 500
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+import uuid
+import warnings
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_db_dir = tempfile.mkdtemp(prefix="sysmonitor-bench-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_db_dir, 'bench.db')}")
+
+from sqlalchemy.exc import SAWarning
+
+from dto import MetricsDTO
+from models import Metric, ThirdPartyType, DeviceMetric, ThirdParty, create_tables
+from lib_database.engine import configure_engine, create_session
+import lib_database.update_database as update_db
+
+LOCATIONS = [("Dublin", 53.349804, -6.260310), ("Cork", 51.898514, -8.475604)]
+
+def seed():
+    """Creates the metric and third-party type rows update_database expects."""
+    with create_session() as session:
+        for name in update_db.DEVICE_METRIC_FIELDS:
+            session.add(Metric(uuid=str(uuid.uuid4()), name=name))
+        for location, lat, lon in LOCATIONS:
+            for name in update_db.THIRD_PARTY_METRIC_FIELDS:
+                session.add(ThirdPartyType(uuid=str(uuid.uuid4()), name=name, latitude=lat, longitude=lon, location_name=location))
+        session.commit()
+
+def make_samples(count, devices, with_weather_every):
+    samples = []
+    for i in range(count):
+        weather = []
+        if with_weather_every and i % with_weather_every == 0:
+            weather = [{
+                "name": location, "temperature": 11.5, "humidity": 80, "wind_speed": 4.2, "pressure": 1012,
+                "air_quality_index": 2, "precipitation": 0.1, "uv_index": 1, "latitude": lat, "longitude": lon
+            } for location, lat, lon in LOCATIONS]
+        samples.append(MetricsDTO(None, f"bench-device-{i % devices}", 12.5, 48.0, weather))
+    return samples
+
+def clear():
+    with create_session() as session:
+        session.query(DeviceMetric).delete()
+        session.query(ThirdParty).delete()
+        session.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--weather-every", type=int, default=20, help="attach weather data to every Nth sample (0 = never)")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    warnings.filterwarnings("ignore", category=SAWarning)
+    create_tables(configure_engine(os.environ["DATABASE_URL"]))
+    seed()
+
+    samples = make_samples(args.samples, args.devices, args.weather_every)
+
+    start = time.perf_counter()
+    for sample in samples:
+        update_db.update_database(sample)
+    single_seconds = time.perf_counter() - start
+    clear()
+
+    start = time.perf_counter()
+    for offset in range(0, len(samples), args.batch_size):
+        update_db.update_database_batch(samples[offset:offset + args.batch_size])
+    batch_seconds = time.perf_counter() - start
+
+    print(f"samples={args.samples} devices={args.devices} batch_size={args.batch_size} db={os.environ['DATABASE_URL']}")
+    print(f"single-sample path: {single_seconds:.3f}s  ({args.samples / single_seconds:,.0f} samples/s)")
+    print(f"batch path:         {batch_seconds:.3f}s  ({args.samples / batch_seconds:,.0f} samples/s)")
+    print(f"speedup:            {single_seconds / batch_seconds:.1f}x")
+
+if __name__ == "__main__":
+    main()
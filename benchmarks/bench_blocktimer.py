@@ -0,0 +1,76 @@
+"""
+Per-block overhead of BlockTimer's histogram recording (lib_utils/blocktimer.py).
+
+Times `--iterations` empty blocks for each variant and reports the cost per block
+over an empty loop, plus what /metrics and /api/stats/block_timers cost to render:
+
+    python benchmarks/bench_blocktimer.py --iterations 1000000
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib_utils.blocktimer import BlockTimer, block_timings
+
+
+class Empty:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return None
+
+
+def per_block_ns(make_block, iterations):
+    start = time.perf_counter_ns()
+    for _ in range(iterations):
+        with make_block():
+            pass
+    return (time.perf_counter_ns() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=500_000)
+    parser.add_argument("--series", type=int, default=50, help="distinct block names registered before timing")
+    args = parser.parse_args()
+
+    logger = logging.getLogger("bench")
+    logger.setLevel(logging.WARNING)  # INFO lines are filtered, as when logging is turned down in production
+    for i in range(args.series):
+        with BlockTimer(f"warm {i}", logger):
+            pass
+
+    labels = {"collector": "host"}
+    variants = (
+        ("empty context manager", lambda: Empty()),
+        ("BlockTimer, not logged", lambda: BlockTimer("bench block", logger)),
+        ("BlockTimer with labels", lambda: BlockTimer("bench labelled", logger, labels=labels)),
+    )
+    for log_every in (0, 1):
+        block_timings.log_every = log_every
+        baseline = None
+        print(f"log_every={log_every}:")
+        for name, make_block in variants:
+            per_block_ns(make_block, args.iterations // 10)  # Warm up
+            cost = per_block_ns(make_block, args.iterations)
+            if baseline is None:
+                baseline = cost
+            print(f"  {name:<24} {cost:8.0f} ns/block  ({cost - baseline:+6.0f} ns over an empty block)")
+
+    start = time.perf_counter()
+    text = block_timings.render_prometheus()
+    rendered = time.perf_counter() - start
+    start = time.perf_counter()
+    block_timings.stats()
+    stats = time.perf_counter() - start
+    print(f"/metrics for {args.series + 2} series: {len(text) / 1024:.0f} KiB in {rendered * 1e3:.2f} ms; "
+          f"stats in {stats * 1e3:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
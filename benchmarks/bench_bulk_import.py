@@ -0,0 +1,106 @@
+"""
+Bulk import throughput vs replaying samples through /api/update_metrics.
+
+Generates `--rows` device metric rows (a year of CPU and RAM samples every minute is
+about 1M rows), writes them as CSV and columnar export files, imports each into a
+throwaway SQLite database, then times replaying `--replay` samples through the Flask
+endpoint and extrapolates to the same row count:
+
+    python benchmarks/bench_bulk_import.py --rows 1000000 --replay 500
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_db_dir = tempfile.mkdtemp(prefix="sysmonitor-bench-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_db_dir, 'bench.db')}")
+
+from models import DeviceMetric, create_tables
+from lib_database.engine import configure_engine, create_session
+from lib_database.bulk_io import CHUNK_SIZE, encode, export_chunks, import_file
+from lib_database.rollups import rebuild_by_day
+
+def generated_chunks(rows, devices):
+    """Export-shaped chunks of CPU/RAM samples, one minute apart per device."""
+    start = datetime(2025, 1, 1)
+    chunk = []
+    for i in range(rows):
+        sample = i // 2
+        chunk.append((
+            str(uuid.uuid4()),
+            f"bench-device-{sample % devices}",
+            "CPU Usage" if i % 2 == 0 else "RAM Usage",
+            float(i % 100),
+            start + timedelta(minutes=sample // devices)
+        ))
+        if len(chunk) == CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def write(path, output_format, rows, devices):
+    with open(path, "wb") as output:
+        for piece in encode("device", generated_chunks(rows, devices), output_format):
+            output.write(piece)
+    return os.path.getsize(path)
+
+def clear():
+    with create_session() as session:
+        session.query(DeviceMetric).delete()
+        session.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--devices", type=int, default=1)
+    parser.add_argument("--replay", type=int, default=500, help="samples to replay through /api/update_metrics")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    engine = configure_engine(os.environ["DATABASE_URL"])
+    create_tables(engine)
+
+    print(f"rows={args.rows:,} devices={args.devices} db={os.environ['DATABASE_URL']}")
+    results = {}
+    for output_format in ("csv", "columnar"):
+        path = os.path.join(_db_dir, f"export.{output_format}")
+        size = write(path, output_format, args.rows, args.devices)
+        clear()
+        start = time.perf_counter()
+        # Rollups are timed separately: the replay path defers them to RollupWorker too
+        imported = import_file(path, rebuild_rollups=False)
+        results[output_format] = time.perf_counter() - start
+        print(f"{output_format:<9} file {size / 1e6:8.1f} MB  import {results[output_format]:7.2f}s  "
+              f"({imported['rows'] / results[output_format]:,.0f} rows/s)")
+
+    start = time.perf_counter()
+    rebuild_by_day("device", imported["from"], imported["to"] + timedelta(microseconds=1))
+    print(f"rollups   rebuilt for the imported range in {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    exported = sum(len(chunk) for chunk in export_chunks("device", datetime(2000, 1, 1), datetime(2100, 1, 1)))
+    print(f"export    {exported:,} rows streamed in {time.perf_counter() - start:.2f}s")
+
+    from client.app import appForWSGI
+    appForWSGI.startup()  # Keep the cache warm-up and snapshot load out of the replay timing
+    client = appForWSGI.flask_app.test_client()
+    start = time.perf_counter()
+    for i in range(args.replay):
+        client.post("/api/update_metrics", json={
+            "device_name": "bench-replay", "cpu_usage": 12.5, "ram_usage": 48.0, "weather_and_air_quality_data": [],
+            "timestamp": (datetime(2024, 1, 1) + timedelta(minutes=i)).isoformat()
+        })
+    per_row = (time.perf_counter() - start) / (args.replay * 2)
+    print(f"replay    {per_row * 1e3:.3f} ms/row -> {per_row * args.rows:,.0f}s extrapolated for {args.rows:,} rows")
+    print(f"speedup   {per_row * args.rows / results['columnar']:,.0f}x (columnar import vs replay)")
+
+if __name__ == "__main__":
+    main()
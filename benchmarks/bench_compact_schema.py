@@ -0,0 +1,188 @@
+"""
+Storage and query cost of the old VARCHAR(36) schema vs the compact BINARY(16) schema.
+
+Builds the pre-migration schema in a throwaway SQLite database, fills it with
+`--rows` device metric rows and `--weather-rows` third-party rows, times a few
+representative queries, migrates it with lib_database/migrate_compact_schema.py and
+repeats the measurements on the compact tables:
+
+    python benchmarks/bench_compact_schema.py --rows 500000 --weather-rows 200000
+
+Sizes are table plus index pages from SQLite's dbstat view, after VACUUM.
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import Column, MetaData, String, Table, and_, func, select, text
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_db_dir = tempfile.mkdtemp(prefix="sysmonitor-bench-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_db_dir, 'bench.db')}")
+
+from models import Base, BinaryUUID
+from lib_database.engine import configure_engine
+from lib_database.migrate_compact_schema import copy_tables, swap_tables
+
+START = datetime(2025, 1, 1)
+LOCATIONS = 10
+WEATHER_TYPES = ("Temperature", "Humidity", "AQI")
+FACT_TABLES = ("device_metrics", "third_parties")
+
+
+def legacy_metadata():
+    """The schema before the migration: String(36) keys and a name on every third_parties row."""
+    metadata = MetaData()
+    for table in Base.metadata.sorted_tables:
+        table.to_metadata(metadata)
+    for table in metadata.tables.values():
+        for column in table.columns:
+            if isinstance(column.type, BinaryUUID):
+                column.type = String(36)
+    metadata.tables["third_parties"].append_column(Column("name", String(255), nullable=False))
+    return metadata
+
+
+def fill(engine, tables, rows, weather_rows, devices):
+    device_ids = [str(uuid.uuid4()) for _ in range(devices)]
+    metric_ids = [str(uuid.uuid4()), str(uuid.uuid4())]
+    type_ids = [(str(uuid.uuid4()), location, data_type) for location in range(LOCATIONS) for data_type in WEATHER_TYPES]
+    with engine.begin() as connection:
+        connection.execute(tables["devices"].insert(), [
+            {"uuid": device_id, "name": f"bench-device-{i}", "date_registered": START} for i, device_id in enumerate(device_ids)
+        ])
+        connection.execute(tables["metrics"].insert(), [
+            {"uuid": metric_ids[0], "name": "CPU Usage"}, {"uuid": metric_ids[1], "name": "RAM Usage"}
+        ])
+        connection.execute(tables["third_party_types"].insert(), [
+            {"uuid": type_id, "name": data_type, "latitude": 50 + location, "longitude": -6 - location,
+             "location_name": f"Location {location}"}
+            for type_id, location, data_type in type_ids
+        ])
+
+    for offset in range(0, rows, 50000):
+        with engine.begin() as connection:
+            connection.execute(tables["device_metrics"].insert(), [{
+                "uuid": str(uuid.uuid4()),
+                "device_id": device_ids[(i // 2) % devices],
+                "metric_id": metric_ids[i % 2],
+                "value": float(i % 100),
+                "timestamp": START + timedelta(minutes=i // (2 * devices))
+            } for i in range(offset, min(rows, offset + 50000))])
+    for offset in range(0, weather_rows, 50000):
+        with engine.begin() as connection:
+            connection.execute(tables["third_parties"].insert(), [{
+                "uuid": str(uuid.uuid4()),
+                "thirdparty_id": type_ids[i % len(type_ids)][0],
+                "name": f"Location {type_ids[i % len(type_ids)][1]} {type_ids[i % len(type_ids)][2]}",
+                "value": float(i % 40),
+                "timestamp": START + timedelta(minutes=10 * (i // len(type_ids)))
+            } for i in range(offset, min(weather_rows, offset + 50000))])
+    return device_ids[0], metric_ids[0]
+
+
+def sizes(engine):
+    """Bytes of table plus index pages per fact table."""
+    with engine.connect() as connection:
+        connection.execute(text("VACUUM"))
+        rows = connection.execute(text(
+            "SELECT m.tbl_name, SUM(d.pgsize) FROM dbstat d JOIN sqlite_master m ON m.name = d.name "
+            "GROUP BY m.tbl_name"
+        )).all()
+    return {name: size for name, size in rows if name in FACT_TABLES}
+
+
+def queries(tables, device_id, metric_id, rows, devices):
+    device_metrics, third_parties = tables["device_metrics"], tables["third_parties"]
+    middle = START + timedelta(minutes=rows // (4 * devices))
+    latest = select(
+        device_metrics.c.device_id, device_metrics.c.metric_id, func.max(device_metrics.c.timestamp).label("timestamp")
+    ).group_by(device_metrics.c.device_id, device_metrics.c.metric_id).subquery()
+    return {
+        # /api/device_metrics: newest page joined to names, then a deep keyset page
+        "newest page": select(device_metrics, tables["devices"].c.name, tables["metrics"].c.name).join(
+            tables["devices"], device_metrics.c.device_id == tables["devices"].c.uuid
+        ).join(tables["metrics"], device_metrics.c.metric_id == tables["metrics"].c.uuid).order_by(
+            device_metrics.c.timestamp.desc(), device_metrics.c.uuid.desc()
+        ).limit(50),
+        "keyset page": select(device_metrics).where(
+            device_metrics.c.timestamp <= middle,
+            (device_metrics.c.timestamp < middle) | (device_metrics.c.uuid < "80000000-0000-0000-0000-000000000000")
+        ).order_by(device_metrics.c.timestamp.desc(), device_metrics.c.uuid.desc()).limit(50),
+        # One series over a day: raw chart range
+        "series day": select(device_metrics.c.value, device_metrics.c.timestamp).where(
+            device_metrics.c.device_id == device_id, device_metrics.c.metric_id == metric_id,
+            device_metrics.c.timestamp >= middle, device_metrics.c.timestamp < middle + timedelta(days=1)
+        ),
+        # Snapshot rebuild: latest row per series
+        "latest per series": select(device_metrics.c.value).join(latest, and_(
+            device_metrics.c.device_id == latest.c.device_id, device_metrics.c.metric_id == latest.c.metric_id,
+            device_metrics.c.timestamp == latest.c.timestamp
+        )),
+        # /api/weather_data for one type (name derived from the type after the migration)
+        "weather type": select(third_parties.c.value, third_parties.c.timestamp, tables["third_party_types"].c.location_name).join(
+            tables["third_party_types"], third_parties.c.thirdparty_id == tables["third_party_types"].c.uuid
+        ).where(tables["third_party_types"].c.name == "Temperature").order_by(third_parties.c.timestamp.desc())
+    }
+
+
+def time_queries(engine, statements, repeats):
+    results = {}
+    with engine.connect() as connection:
+        for name, statement in statements.items():
+            connection.execute(statement).all()  # Warm the page cache and statement cache
+            timings = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                connection.execute(statement).all()
+                timings.append(time.perf_counter() - start)
+            results[name] = statistics.median(timings)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--weather-rows", type=int, default=200_000)
+    parser.add_argument("--devices", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    engine = configure_engine(os.environ["DATABASE_URL"])
+    legacy = legacy_metadata()
+    legacy.create_all(engine)
+    device_id, metric_id = fill(engine, legacy.tables, args.rows, args.weather_rows, args.devices)
+
+    print(f"rows={args.rows:,} weather_rows={args.weather_rows:,} devices={args.devices} db={os.environ['DATABASE_URL']}")
+    before_sizes = sizes(engine)
+    before = time_queries(engine, queries(legacy.tables, device_id, metric_id, args.rows, args.devices), args.repeats)
+
+    start = time.perf_counter()
+    copy_tables()
+    swap_tables()
+    migrated = time.perf_counter() - start
+    with engine.begin() as connection:
+        for table in reversed(legacy.sorted_tables):
+            connection.execute(text(f"DROP TABLE {table.name}_legacy"))
+
+    after_sizes = sizes(engine)
+    after = time_queries(engine, queries(Base.metadata.tables, device_id, metric_id, args.rows, args.devices), args.repeats)
+
+    print(f"migration {migrated:.2f}s ({(args.rows + args.weather_rows) / migrated:,.0f} rows/s)")
+    for name in FACT_TABLES:
+        print(f"{name:<18} {before_sizes[name] / 1e6:8.1f} MB -> {after_sizes[name] / 1e6:8.1f} MB "
+              f"({after_sizes[name] / before_sizes[name]:.0%})")
+    for name in before:
+        print(f"{name:<18} {before[name] * 1e3:8.2f} ms -> {after[name] * 1e3:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
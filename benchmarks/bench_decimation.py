@@ -0,0 +1,115 @@
+"""
+Long-range series through /api/device_metrics with and without max_points decimation.
+
+Fills a fresh SQLite database (or --database-url) with `--series` CPU series sampled
+every `--step` seconds for `--days` days, builds its rollups and, through the Flask
+test client, times each request end to end and reports the points and bytes it returns:
+
+    python benchmarks/bench_decimation.py --days 7 --step 5 --max-points 1000
+
+The hot tier is off, so every query reads the database.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+import warnings
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def fill(args, end):
+    from lib_database.engine import create_session
+    from lib_database.rollups import rebuild_range
+    from models import Device, DeviceMetric, Metric
+
+    rng = random.Random(1)
+    metric_id = str(uuid.uuid4())
+    devices = {f"device-{i:03d}": str(uuid.uuid4()) for i in range(args.series)}
+    with create_session() as session:
+        session.add_all(Device(uuid=device_id, name=name, date_registered=end) for name, device_id in devices.items())
+        session.add(Metric(uuid=metric_id, name="cpu_percent"))
+        session.commit()
+        steps = int(args.days * 86400 / args.step)
+        for device_id in devices.values():
+            rows, value = [], 50.0
+            for step in range(steps):
+                value = min(100.0, max(0.0, value + rng.gauss(0, 2)))
+                rows.append({"uuid": str(uuid.uuid4()), "device_id": device_id, "metric_id": metric_id,
+                             "value": value + (40 if rng.random() < 0.0005 else 0),
+                             "timestamp": end - timedelta(seconds=(steps - step) * args.step)})
+                if len(rows) >= 20000:
+                    session.execute(DeviceMetric.__table__.insert(), rows)
+                    rows = []
+            if rows:
+                session.execute(DeviceMetric.__table__.insert(), rows)
+        session.commit()
+    rebuild_range("device", end - timedelta(days=args.days + 1), end + timedelta(minutes=1))
+    return devices
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--series", type=int, default=2)
+    parser.add_argument("--days", type=float, default=7)
+    parser.add_argument("--step", type=int, default=5, help="seconds between samples of a series")
+    parser.add_argument("--max-points", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--database-url", help="database to fill (default: a temporary SQLite file)")
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore")
+
+    path = None
+    if not args.database_url:
+        path = os.path.join(tempfile.mkdtemp(prefix="bench_decimation_"), "bench.db")
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{path}"
+    os.environ["HOT_TIER_ENABLED"] = "0"
+    from lib_database.engine import get_engine
+    from models import Base
+    from client.app import appForWSGI
+    Base.metadata.create_all(get_engine())
+
+    end = datetime.utcnow().replace(microsecond=0)
+    start = time.perf_counter()
+    fill(args, end)
+    rows = args.series * int(args.days * 86400 / args.step)
+    print(f"{args.series} series, {rows} rows in {time.perf_counter() - start:.1f}s")
+
+    appForWSGI.startup()  # Keep the cache warm-up and snapshot load out of the first timed request
+    client = appForWSGI.flask_app.test_client()
+    week = f"from={(end - timedelta(days=args.days)).isoformat()}&to={end.isoformat()}"
+    day = f"from={(end - timedelta(days=1)).isoformat()}&to={end.isoformat()}"
+    queries = (
+        ("raw, whole range", f"{week}&resolution=raw"),
+        ("raw -> lttb", f"{week}&resolution=raw&max_points={args.max_points}"),
+        ("raw -> minmax", f"{week}&resolution=raw&max_points={args.max_points}&decimation=minmax"),
+        ("auto -> lttb", f"{week}&max_points={args.max_points}"),
+        ("last day, raw -> lttb", f"{day}&resolution=raw&max_points={args.max_points}"),
+    )
+    print(f"{'query':<24} {'time':>10} {'points/series':>14} {'payload':>11}  resolution read")
+    for name, query in queries:
+        timings = []
+        for _ in range(args.repeat):
+            began = time.perf_counter()
+            response = client.get(f"/api/device_metrics?{query}")
+            timings.append(time.perf_counter() - began)
+        payload = response.get_json()
+        if response.status_code != 200:
+            print(f"{name:<24} failed: {payload}")
+            continue
+        per_series = len(payload["device_metrics"]) / args.series
+        print(f"{name:<24} {statistics.median(timings) * 1e3:7.0f} ms {per_series:14.0f} "
+              f"{len(response.data) / 1024:8.0f} KiB  {payload['resolution']}")
+
+    appForWSGI.shutdown()
+    if path:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Query-count check and latency benchmark for /api/device_metrics.
+
+Loads a throwaway SQLite database, then requests pages of increasing size through
+the Flask test client while counting the SQL statements each request runs. A page
+must cost the same number of queries whatever its size; the script exits non-zero
+if it does not, so an N+1 relationship load in the serializer cannot come back
+unnoticed:
+
+    python benchmarks/bench_device_metrics_queries.py --samples 2000
+
+tests/test_device_metrics_queries.py asserts the same on every pytest run.
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_db_dir = tempfile.mkdtemp(prefix="sysmonitor-bench-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_db_dir, 'bench.db')}")
+
+from sqlalchemy import event
+
+from dto import MetricsDTO
+from models import create_tables
+from lib_database.engine import configure_engine
+import lib_database.update_database as update_db
+
+PAGE_SIZES = (5, 50, 500)
+
+class QueryCounter:
+    """Counts statements run on the calling thread only, ignoring background workers."""
+
+    def __init__(self, engine):
+        self.thread_id = threading.get_ident()
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        if threading.get_ident() == self.thread_id:
+            self.count += 1
+
+    def measure(self, function):
+        """Runs `function` and returns (queries, milliseconds)."""
+        self.count = 0
+        start = time.perf_counter()
+        function()
+        return self.count, (time.perf_counter() - start) * 1000
+
+def seed(samples, devices):
+    start = datetime.utcnow() - timedelta(seconds=samples)
+    dtos = [
+        MetricsDTO(None, f"bench-device-{i % devices}", 12.5, 48.0, [], timestamp=(start + timedelta(seconds=i)).isoformat())
+        for i in range(samples)
+    ]
+    for offset in range(0, samples, update_db.MAX_BATCH_SIZE):
+        update_db.update_database_batch(dtos[offset:offset + update_db.MAX_BATCH_SIZE])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--devices", type=int, default=20)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    engine = configure_engine(os.environ["DATABASE_URL"])
+    create_tables(engine)
+    seed(args.samples, args.devices)
+
+    from client.app import appForWSGI
+    appForWSGI.startup()  # Keep the cache warm-up and snapshot load out of the first counted request
+    client = appForWSGI.flask_app.test_client()
+    counter = QueryCounter(engine)
+
+    print(f"samples={args.samples} devices={args.devices} db={os.environ['DATABASE_URL']}")
+    print(f"{'request':<60} {'queries':>8} {'ms':>8}")
+    failures = []
+    for query_string in ("", "&device=bench-device-1", "&device=bench-device-1&metric=CPU%20Usage"):
+        counts = []
+        for limit in PAGE_SIZES:
+            url = f"/api/device_metrics?limit={limit}{query_string}"
+            queries, milliseconds = counter.measure(lambda: client.get(url).get_json())
+            counts.append(queries)
+            print(f"{url:<60} {queries:>8} {milliseconds:>8.2f}")
+        if len(set(counts)) != 1 or counts[0] > 1:
+            failures.append(f"{query_string or 'unfiltered'}: {counts} queries for page sizes {PAGE_SIZES}")
+
+    if failures:
+        print("FAIL: page cost depends on page size (N+1 load?)")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print("OK: one query per page at every page size")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Recent-window series queries: the hot tier (lib_database/hot_tier.py) vs rollups/SQL.
+
+Fills a fresh SQLite database (or --database-url) with `--devices` x 5 metrics
+sampled every `--step` seconds over the last `--hours` hours, builds its rollups,
+warms the hot tier and times the dashboard's typical series queries both ways, plus
+what feeding the tier adds to ingest:
+
+    python benchmarks/bench_hot_tier.py --devices 50 --hours 4 --step 10
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+import warnings
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib_database.engine import configure_engine, create_session, get_engine
+from lib_database.hot_tier import hot_tier
+from lib_database.rollups import rebuild_range, query_series
+from models import Base, Device, DeviceMetric, Metric
+
+METRICS = ("cpu_percent", "memory_percent", "disk_percent", "load_1m", "temperature")
+
+
+def fill(args):
+    """Inserts the synthetic history; returns {device name: device id} and {metric name: metric id}."""
+    rng = random.Random(1)
+    now = datetime.utcnow()
+    devices = {f"device-{i:03d}": str(uuid.uuid4()) for i in range(args.devices)}
+    metrics = {name: str(uuid.uuid4()) for name in METRICS}
+    with create_session() as session:
+        session.add_all(Device(uuid=device_id, name=name, date_registered=now) for name, device_id in devices.items())
+        session.add_all(Metric(uuid=metric_id, name=name) for name, metric_id in metrics.items())
+        session.commit()
+        rows = []
+        steps = int(args.hours * 3600 / args.step)
+        for step in range(steps):
+            timestamp = now - timedelta(seconds=(steps - step) * args.step)
+            for device_id in devices.values():
+                for metric_id in metrics.values():
+                    rows.append({"uuid": str(uuid.uuid4()), "device_id": device_id, "metric_id": metric_id,
+                                 "value": rng.random() * 100, "timestamp": timestamp})
+            if len(rows) >= 20000:
+                session.execute(DeviceMetric.__table__.insert(), rows)
+                rows = []
+        if rows:
+            session.execute(DeviceMetric.__table__.insert(), rows)
+        session.commit()
+    rebuild_range("device", now - timedelta(hours=args.hours + 1), now + timedelta(minutes=1))
+    return devices, metrics
+
+
+def time_query(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--hours", type=float, default=4)
+    parser.add_argument("--step", type=int, default=10, help="seconds between samples of a series")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--database-url", help="database to fill (default: a temporary SQLite file)")
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore")
+
+    path = None
+    if args.database_url:
+        configure_engine(args.database_url)
+    else:
+        path = os.path.join(tempfile.mkdtemp(prefix="bench_hot_tier_"), "bench.db")
+        configure_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(get_engine())
+
+    start = time.perf_counter()
+    devices, metrics = fill(args)
+    series = len(devices) * len(metrics)
+    print(f"{series} series, {series * int(args.hours * 3600 / args.step)} rows in {time.perf_counter() - start:.1f}s")
+
+    hot_tier.configure({"enabled": True, "window_hours": args.hours, "points_per_series": int(args.hours * 3600 / args.step) + 100,
+                        "max_series": series + 100})
+    start = time.perf_counter()
+    with create_session() as session:
+        hot_tier.warm(session)
+    stats = hot_tier.stats()
+    print(f"hot tier warmed in {time.perf_counter() - start:.2f}s: {stats['points']} points, "
+          f"{stats['memory_bytes'] / 2**20:.1f} MiB held (limit {stats['memory_limit_bytes'] / 2**20:.1f} MiB)")
+
+    now = datetime.utcnow()
+    one_device = {"device_id": [next(iter(devices.values()))]}
+    one_series = {"device_id": one_device["device_id"], "metric_id": [metrics["cpu_percent"]]}
+    queries = (
+        ("1 series, last hour, raw", timedelta(hours=1), None, one_series),
+        ("1 device, last hour, 1m", timedelta(hours=1), 60, one_device),
+        ("1 device, window, 5m", timedelta(hours=args.hours - 0.1), 300, one_device),
+        ("all series, last hour, 5m", timedelta(hours=1), 300, None),
+        ("all series, last 2 hours, 1h", timedelta(hours=2), 3600, None),
+    )
+    print(f"{'query':<28} {'rollups/SQL':>12} {'hot tier':>10} {'+p50,p95,p99':>13} {'speed-up':>9}  points")
+    for name, span, resolution, series_filter in queries:
+        begin = now - span
+        cold, cold_points = time_query(lambda: query_series("device", begin, now, resolution, series_filter), args.repeat)
+        hot, hot_points = time_query(lambda: hot_tier.query_series("device", begin, now, resolution, series_filter), args.repeat)
+        if hot_points is None:
+            # Widened to whole buckets, the range starts before the warmed window
+            print(f"{name:<28} {cold * 1e3:9.2f} ms  not covered: falls back to rollups")
+            continue
+        with_percentiles, _ = time_query(
+            lambda: hot_tier.query_series("device", begin, now, resolution, series_filter, (50, 95, 99)), args.repeat
+        )
+        if len(hot_points) != len(cold_points):
+            print(f"  warning: {name} returned {len(hot_points)} points from the hot tier, {len(cold_points)} from SQL")
+        print(f"{name:<28} {cold * 1e3:9.2f} ms {hot * 1e3:7.2f} ms {with_percentiles * 1e3:10.2f} ms "
+              f"{cold / hot:8.1f}x  {len(hot_points)}")
+
+    # Ingest cost: one host sample (5 metric rows) per device, appended to warm buffers
+    rows = [{"device_id": device_id, "metric_id": metric_id, "value": 1.0, "timestamp": datetime.utcnow()}
+            for device_id in devices.values() for metric_id in metrics.values()]
+    start = time.perf_counter()
+    for _ in range(20):
+        for row in rows:
+            row["timestamp"] += timedelta(seconds=1)
+        hot_tier.add(rows, [])
+    print(f"hot_tier.add: {(time.perf_counter() - start) / (20 * len(rows)) * 1e6:.2f} us per row")
+
+    if path:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Page latency benchmark for /api/device_metrics: OFFSET paging vs keyset (cursor) paging.
+
+Fills a throwaway SQLite database with `--rows` device metric rows (10M by default,
+which takes a few minutes to load) and times fetching one page at increasing depths
+with both strategies, using the same newest-first query and indexes as the endpoint:
+
+    python benchmarks/bench_keyset_pagination.py --rows 10000000 --limit 50
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_db_dir = tempfile.mkdtemp(prefix="sysmonitor-bench-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_db_dir, 'bench.db')}")
+
+from sqlalchemy import or_
+
+from models import Device, Metric, DeviceMetric, create_tables
+from lib_database.engine import configure_engine, create_session
+
+INSERT_CHUNK = 50000
+
+def seed(engine, rows, devices, metrics):
+    """Inserts `rows` samples spread over `devices` x `metrics` series, one second apart."""
+    device_ids = [str(uuid.uuid4()) for _ in range(devices)]
+    metric_ids = [str(uuid.uuid4()) for _ in range(metrics)]
+    now = datetime.utcnow()
+    with create_session() as session:
+        session.add_all(Device(uuid=device_id, name=f"bench-device-{i}", date_registered=now) for i, device_id in enumerate(device_ids))
+        session.add_all(Metric(uuid=metric_id, name=f"bench-metric-{i}") for i, metric_id in enumerate(metric_ids))
+        session.commit()
+
+    start_time = now - timedelta(seconds=rows)
+    table = DeviceMetric.__table__
+    with engine.begin() as connection:
+        for offset in range(0, rows, INSERT_CHUNK):
+            connection.execute(table.insert(), [{
+                "uuid": str(uuid.uuid4()),
+                "device_id": device_ids[i % devices],
+                "metric_id": metric_ids[(i // devices) % metrics],
+                "value": random.random() * 100,
+                "timestamp": start_time + timedelta(seconds=i)
+            } for i in range(offset, min(offset + INSERT_CHUNK, rows))])
+
+def newest_first(session):
+    return session.query(DeviceMetric).order_by(DeviceMetric.timestamp.desc(), DeviceMetric.uuid.desc())
+
+def offset_page(session, depth, limit):
+    return newest_first(session).offset(depth).limit(limit + 1).all()
+
+def keyset_page(session, cursor, limit):
+    timestamp, row_id = cursor
+    return newest_first(session).filter(
+        DeviceMetric.timestamp <= timestamp,
+        or_(DeviceMetric.timestamp < timestamp, DeviceMetric.uuid < row_id)
+    ).limit(limit + 1).all()
+
+def cursor_at(session, depth):
+    """The (timestamp, uuid) keyset cursor for the row just before `depth`."""
+    return newest_first(session).with_entities(DeviceMetric.timestamp, DeviceMetric.uuid).offset(depth - 1).limit(1).one()
+
+def timed(function, repeats):
+    """Median wall time of `repeats` calls, in milliseconds."""
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - start) * 1000)
+    return sorted(samples)[len(samples) // 2]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--metrics", type=int, default=10)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    engine = configure_engine(os.environ["DATABASE_URL"])
+    create_tables(engine)
+
+    start = time.perf_counter()
+    seed(engine, args.rows, args.devices, args.metrics)
+    print(f"rows={args.rows:,} limit={args.limit} db={os.environ['DATABASE_URL']} (loaded in {time.perf_counter() - start:.1f}s)")
+
+    depths = [depth for depth in (args.limit, 1_000, 10_000, 100_000, 1_000_000, 5_000_000) if depth < args.rows - args.limit]
+    print(f"{'depth':>12} {'offset ms':>12} {'keyset ms':>12}")
+    with create_session() as session:
+        for depth in depths:
+            cursor = cursor_at(session, depth)
+            offset_ms = timed(lambda: offset_page(session, depth, args.limit), args.repeats)
+            keyset_ms = timed(lambda: keyset_page(session, cursor, args.limit), args.repeats)
+            print(f"{depth:>12,} {offset_ms:>12.2f} {keyset_ms:>12.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Period accuracy of the agent's collection loops: `work; stop_event.wait(interval)` vs
+the fixed-rate Scheduler (server/scheduler.py).
+
+Runs a job every `--interval` seconds for `--ticks` ticks whose work takes
+`--work` seconds (plus up to `--work-spread` more at random, and every
+`--overrun-every`th run a stall of `--overrun` seconds) and reports the mean period,
+how far the last run drifted from its ideal start time, and start lateness:
+
+    python benchmarks/bench_scheduler.py --interval 0.1 --work 0.03 --ticks 100
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server"))
+
+from scheduler import Scheduler
+
+
+def make_work(args, starts, done):
+    rng = random.Random(1)
+
+    def work():
+        starts.append(time.monotonic())
+        duration = args.work + rng.random() * args.work_spread
+        if args.overrun_every and len(starts) % args.overrun_every == 0:
+            duration += args.overrun
+        time.sleep(duration)
+        if len(starts) >= args.ticks:
+            done.set()
+    return work
+
+
+def wait_loop(args):
+    """The previous loop: the period is the interval plus however long the work took."""
+    starts, stop_event = [], threading.Event()
+    work = make_work(args, starts, stop_event)
+    while not stop_event.is_set():
+        work()
+        stop_event.wait(args.interval)
+    return starts
+
+
+def fixed_rate(args):
+    starts, stop_event = [], threading.Event()
+    scheduler = Scheduler(stop_event)
+    scheduler.add_job("bench", make_work(args, starts, stop_event), args.interval)
+    scheduler.start()
+    stop_event.wait()
+    scheduler.stop()
+    return starts, scheduler.stats()["bench"]
+
+
+def report(name, starts, interval):
+    periods = [b - a for a, b in zip(starts, starts[1:])]
+    # Drift: how far the last run is from where an exact grid would have put it
+    drift = starts[-1] - (starts[0] + round((starts[-1] - starts[0]) / interval) * interval)
+    behind = (starts[-1] - starts[0]) - (len(starts) - 1) * interval
+    print(f"{name:<12} runs={len(starts):<4} mean period {statistics.mean(periods) * 1e3:8.2f} ms "
+          f"(stdev {statistics.pstdev(periods) * 1e3:6.2f})  grid drift {drift * 1e3:+7.2f} ms  "
+          f"behind schedule {behind * 1e3:+9.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--interval", type=float, default=0.1)
+    parser.add_argument("--work", type=float, default=0.03)
+    parser.add_argument("--work-spread", type=float, default=0.01)
+    parser.add_argument("--ticks", type=int, default=100)
+    parser.add_argument("--overrun-every", type=int, default=25, help="stall every Nth run (0 = never)")
+    parser.add_argument("--overrun", type=float, default=0.25, help="extra seconds a stalled run takes")
+    args = parser.parse_args()
+
+    print(f"interval={args.interval * 1e3:.0f}ms work={args.work * 1e3:.0f}-{(args.work + args.work_spread) * 1e3:.0f}ms "
+          f"ticks={args.ticks} stall={args.overrun * 1e3:.0f}ms every {args.overrun_every or 'never'}")
+    report("wait loop", wait_loop(args), args.interval)
+    starts, stats = fixed_rate(args)
+    report("fixed rate", starts, args.interval)
+    print(f"fixed rate: {stats['overruns']} ticks coalesced during stalls, start lateness "
+          f"p50 {stats['lateness_ms']['p50']} ms, p99 {stats['lateness_ms']['p99']} ms, max {stats['lateness_ms']['max']} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""
+Cold start and ingest throughput of the serving modes with many concurrent agents.
+
+For each server it starts a fresh process on an empty SQLite database (or
+--database-url) and measures:
+
+  * cold start: from spawning the process to the first 200 response;
+  * ingest: `--agents` simulated agents, each on its own keep-alive connection,
+    POSTing batches of `--batch-size` samples to /api/update_metrics/batch for
+    `--duration` seconds (after `--warmup`), waiting `--think` seconds between
+    batches. Reports requests/s, samples/s, latency percentiles and errors.
+
+Servers:
+
+  dev       python client/app.py (Werkzeug development server, the current setup)
+  gunicorn  python client/serve.py           (WSGI, gthread workers)
+  uvicorn   python client/serve.py --asgi    (ASGI, async database driver)
+
+    python benchmarks/bench_serving.py --agents 1000 --duration 20
+    python benchmarks/bench_serving.py --servers gunicorn uvicorn --workers 2
+
+The load generator shares the machine with the server, so on a small host the
+absolute numbers are a lower bound; compare servers within one run.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(REPO_ROOT)
+
+HOST = "127.0.0.1"
+DEV_SERVER_PORT = 5000  # Fixed in client/app.py
+HOST_METRICS = ("cpu_percent", "memory_percent", "disk_percent", "load_1m", "temperature")
+
+
+def server_command(name, port, args):
+    if name == "dev":
+        return [sys.executable, os.path.join(REPO_ROOT, "client", "app.py")]
+    command = [sys.executable, os.path.join(REPO_ROOT, "client", "serve.py"), "--bind", f"{HOST}:{port}",
+               "--workers", str(args.workers), "--threads", str(args.threads), "--connections", str(args.agents + 100)]
+    return command + (["--asgi"] if name == "uvicorn" else [])
+
+
+def available(name):
+    modules = {"dev": (), "gunicorn": ("gunicorn",), "uvicorn": ("uvicorn", "aiosqlite")}[name]
+    for module in modules:
+        try:
+            __import__(module)
+        except ImportError:
+            return False
+    return True
+
+
+def create_database(url):
+    # In a child process, so this one never holds a connection to the database under test
+    subprocess.run(
+        [sys.executable, "-c", "from lib_database.engine import get_engine; from models import Base; "
+                               "Base.metadata.create_all(get_engine())"],
+        env=dict(os.environ, DATABASE_URL=url, PYTHONPATH=REPO_ROOT), cwd=REPO_ROOT, check=True,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def start_server(name, port, url, args, log):
+    env = dict(os.environ, DATABASE_URL=url, PYTHONPATH=REPO_ROOT)
+    started = time.perf_counter()
+    process = subprocess.Popen(server_command(name, port, args), env=env, cwd=REPO_ROOT, stdout=log, stderr=log,
+                               start_new_session=True)
+    probe = f"http://{HOST}:{port}/api/snapshot/device_metrics"
+    while time.perf_counter() - started < args.start_timeout:
+        if process.poll() is not None:
+            raise RuntimeError(f"{name} exited with status {process.returncode}; see {log.name}")
+        try:
+            with urllib.request.urlopen(probe, timeout=1) as response:
+                if response.status == 200:
+                    return process, time.perf_counter() - started
+        except OSError:
+            time.sleep(0.02)
+    stop_server(process)
+    raise RuntimeError(f"{name} did not answer within {args.start_timeout}s; see {log.name}")
+
+
+def stop_server(process):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=15)
+    except (ProcessLookupError, subprocess.TimeoutExpired):
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+
+def batch_request(port, agent, batch_size):
+    timestamp = time.strftime("%Y-%m-%dT%H:%M:%S")
+    samples = [{
+        "device_name": f"agent-{agent:04d}",
+        "timestamp": timestamp,
+        "metrics": [{"name": name, "value": float(i + j), "timestamp": timestamp} for j, name in enumerate(HOST_METRICS)]
+    } for i in range(batch_size)]
+    body = json.dumps({"metrics": samples}).encode("utf-8")
+    head = (f"POST /api/update_metrics/batch HTTP/1.1\r\nHost: {HOST}:{port}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n")
+    return head.encode("latin-1") + body
+
+
+async def read_response(reader):
+    """Reads one response; returns (status, keep_alive)."""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    version, status = status_line.split()[:2]
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip().lower()
+    if "content-length" in headers:
+        await reader.readexactly(int(headers["content-length"]))
+    else:
+        await reader.read()  # HTTP/1.0 style: body ends when the connection closes
+        return int(status), False
+    keep_alive = version == b"HTTP/1.1" and headers.get("connection") != "close"
+    return int(status), keep_alive
+
+
+async def agent(port, index, args, deadline, measure_from, results):
+    request = batch_request(port, index, args.batch_size)
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(HOST, port)
+            writer.write(request)
+            await writer.drain()
+            status, keep_alive = await asyncio.wait_for(read_response(reader), args.request_timeout)
+        except (OSError, asyncio.TimeoutError, ConnectionError, ValueError, asyncio.IncompleteReadError) as e:
+            status, keep_alive = type(e).__name__, False
+        finished = time.perf_counter()
+        if not keep_alive and writer is not None:
+            writer.close()
+            reader = writer = None
+        if measure_from <= finished <= deadline:
+            # Completions inside the window: with seconds of queueing, requests that also
+            # started inside it would undercount throughput
+            results.append((status, finished - started))
+        if status != 200:
+            await asyncio.sleep(0.1)  # Like the agent's backoff, without hammering a failing server
+        elif args.think:
+            await asyncio.sleep(args.think)
+    if writer is not None:
+        writer.close()
+
+
+async def generate_load(port, args):
+    results = []
+    start = time.perf_counter()
+    measure_from = start + args.warmup
+    deadline = measure_from + args.duration
+    await asyncio.gather(*(agent(port, i, args, deadline, measure_from, results) for i in range(args.agents)))
+    return results
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else None
+
+
+def summarise(name, cold_start, results, args):
+    latencies = sorted(elapsed for status, elapsed in results if status == 200)
+    errors = {}
+    for status, _ in results:
+        if status != 200:
+            errors[str(status)] = errors.get(str(status), 0) + 1
+    return {
+        "server": name,
+        "cold_start_ms": round(cold_start * 1e3, 1),
+        "requests_per_second": round(len(latencies) / args.duration, 1),
+        "samples_per_second": round(len(latencies) * args.batch_size / args.duration, 1),
+        "latency_ms": {
+            "mean": round(statistics.mean(latencies) * 1e3, 1) if latencies else None,
+            "p50": round(percentile(latencies, 0.5) * 1e3, 1) if latencies else None,
+            "p99": round(percentile(latencies, 0.99) * 1e3, 1) if latencies else None
+        },
+        "errors": errors
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--servers", nargs="+", default=["dev", "gunicorn", "uvicorn"], choices=["dev", "gunicorn", "uvicorn"])
+    parser.add_argument("--agents", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=5)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--warmup", type=float, default=5)
+    parser.add_argument("--think", type=float, default=0.0, help="seconds each agent waits between batches")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--port", type=int, default=8050)
+    parser.add_argument("--database-url", help="database to load (default: a fresh SQLite file per server)")
+    parser.add_argument("--start-timeout", type=float, default=60)
+    parser.add_argument("--request-timeout", type=float, default=30)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_serving_")
+    print(f"{args.agents} agents, batches of {args.batch_size}, {args.duration:.0f}s after {args.warmup:.0f}s warmup, "
+          f"{os.cpu_count()} CPU(s); server logs in {workdir}")
+    summaries = []
+    try:
+        for index, name in enumerate(args.servers):
+            if not available(name):
+                print(f"{name:<9} skipped: not installed")
+                continue
+            url = args.database_url or f"sqlite:///{os.path.join(workdir, name + '.db')}"
+            if not args.database_url:
+                create_database(url)
+            port = DEV_SERVER_PORT if name == "dev" else args.port + index
+            with open(os.path.join(workdir, f"{name}.log"), "w") as log:
+                process, cold_start = start_server(name, port, url, args, log)
+                try:
+                    results = asyncio.run(generate_load(port, args))
+                finally:
+                    stop_server(process)
+            summary = summarise(name, cold_start, results, args)
+            summaries.append(summary)
+            latency = summary["latency_ms"]
+            print(f"{name:<9} cold start {summary['cold_start_ms']:7.0f} ms  {summary['requests_per_second']:7.1f} req/s "
+                  f"({summary['samples_per_second']:.0f} samples/s)  p50 {latency['p50']} ms  p99 {latency['p99']} ms  "
+                  f"errors {summary['errors'] or 0}")
+    finally:
+        if not args.database_url:
+            for name in os.listdir(workdir):
+                if name.endswith((".db", ".db-journal", ".db-wal", ".db-shm")):
+                    os.remove(os.path.join(workdir, name))
+    print(json.dumps(summaries, indent=2))
+
+
+if __name__ == "__main__":
+    main()
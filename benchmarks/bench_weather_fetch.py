@@ -0,0 +1,61 @@
+"""
+Wall-clock benchmark: serial per-location fetching vs the concurrent fetch engine
+in collect_metrics, against a local mock OpenWeatherMap server.
+
+    python benchmarks/bench_weather_fetch.py --locations 100 --latency 0.05
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "server"))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from metrics import collect_metrics
+from mock_openweathermap import start_mock_server
+
+def serial_fetch(base_url, locations):
+    """The previous implementation: two fresh-connection GETs per location, one after another."""
+    results = []
+    for name, lat, lon in locations:
+        weather = requests.get(f"{base_url}/weather?lat={lat}&lon={lon}&appid=x&units=metric").json()
+        air_quality = requests.get(f"{base_url}/air_pollution?lat={lat}&lon={lon}&appid=x").json()
+        results.append((name, weather, air_quality))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--locations", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.05, help="mock server delay per request, seconds")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    server, base_url = start_mock_server(latency=args.latency)
+    collect_metrics.OPENWEATHERMAP_API_URL = f"{base_url}/weather"
+    collect_metrics.OPENWEATHERMAP_AIR_API_URL = f"{base_url}/air_pollution"
+    locations = [(f"Location {i}", round(50 + i * 0.01, 6), round(-8 + i * 0.01, 6)) for i in range(args.locations)]
+
+    start = time.perf_counter()
+    serial_fetch(base_url, locations)
+    serial_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = collect_metrics.get_weather_and_air_quality_data(locations)
+    concurrent_seconds = time.perf_counter() - start
+    server.shutdown()
+
+    failed = sum(1 for row in results if row[1] is None)
+    print(f"locations={args.locations} latency={args.latency * 1000:.0f}ms workers={collect_metrics.MAX_FETCH_WORKERS} "
+          f"per_host={collect_metrics.MAX_CONNECTIONS_PER_HOST}")
+    print(f"serial:     {serial_seconds:.3f}s")
+    print(f"concurrent: {concurrent_seconds:.3f}s  ({failed} failed)")
+    print(f"speedup:    {serial_seconds / concurrent_seconds:.1f}x")
+
+if __name__ == "__main__":
+    main()
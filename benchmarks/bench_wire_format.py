@@ -0,0 +1,104 @@
+"""
+Upload size and encode/decode cost of JSON vs binary frames (lib_utils/wire_format.py).
+
+Builds `--batches` spool batches of `--batch-size` samples shaped like the agent's
+(collector samples every few seconds, plus a weather sample for `--locations`
+locations every `--weather-every` samples) and reports bytes per batch and the
+time to encode + compress and decompress + decode them for every format/encoding:
+
+    python benchmarks/bench_wire_format.py --batch-size 500 --locations 10
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server"))
+
+from server import build_payload
+from lib_utils.wire_format import available_encodings, compress, decode_samples, decompress, encode_samples
+
+COLLECTOR_METRICS = ("Disk Usage", "Network Sent", "Network Received", "Load Average")
+
+
+def make_batch(batch_size, locations, weather_every, start):
+    samples = []
+    for i in range(batch_size):
+        moment = start + timedelta(seconds=5 * i)
+        if i % weather_every == 0:
+            weather = [
+                (f"Location {n}", 10 + random.random() * 5, random.randint(40, 95), random.random() * 12,
+                 1000 + random.randint(0, 30), random.randint(1, 5), random.random(), random.randint(0, 8),
+                 51.5 + n / 10, -6.2 - n / 10)
+                for n in range(locations)
+            ]
+            payload = build_payload("bench-laptop", None, None, weather)
+        else:
+            payload = build_payload("bench-laptop", None, None, [], [
+                {"name": name, "value": round(random.random() * 100, 1), "timestamp": moment.isoformat()}
+                for name in COLLECTOR_METRICS
+            ])
+            payload["cpu_usage"] = round(random.random() * 100, 1)
+            payload["ram_usage"] = round(40 + random.random() * 20, 1)
+        payload["timestamp"] = moment.isoformat()
+        samples.append(payload)
+    return samples
+
+
+def encode_json(samples):
+    return json.dumps({"metrics": samples}, separators=(",", ":")).encode("utf-8")
+
+
+def decode_json(body):
+    return json.loads(body)["metrics"]
+
+
+def measure(batches, encode, decode, encoding, repeats):
+    sizes, encode_times, decode_times = [], [], []
+    for batch in batches:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            body = compress(encode(batch), encoding)
+            encode_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            decoded = decode(decompress(body, encoding))
+            decode_times.append(time.perf_counter() - start)
+        assert len(decoded) == len(batch)
+        sizes.append(len(body))
+    return statistics.mean(sizes), statistics.median(encode_times), statistics.median(decode_times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batches", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=500, help="SpoolSender's default batch size")
+    parser.add_argument("--locations", type=int, default=10)
+    parser.add_argument("--weather-every", type=int, default=120, help="one weather sample per this many samples")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    random.seed(1)
+    batches = [
+        make_batch(args.batch_size, args.locations, args.weather_every, datetime(2026, 1, 1) + timedelta(hours=i))
+        for i in range(args.batches)
+    ]
+    print(f"{args.batches} batches x {args.batch_size} samples, {args.locations} locations, "
+          f"encodings available: {', '.join(available_encodings())}")
+
+    baseline = None
+    for name, encode, decode in (("json", encode_json, decode_json), ("frame", encode_samples, decode_samples)):
+        for encoding in available_encodings()[::-1]:
+            size, encode_time, decode_time = measure(batches, encode, decode, encoding, args.repeats)
+            if baseline is None:
+                baseline = size
+            print(f"{name:<6} {encoding:<9} {size / 1024:9.1f} KiB/batch ({size / args.batch_size:6.1f} B/sample, "
+                  f"{size / baseline:5.1%} of json)  encode {encode_time * 1e3:7.2f} ms  decode {decode_time * 1e3:7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
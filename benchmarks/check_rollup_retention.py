@@ -0,0 +1,92 @@
+"""
+Checks that rebuilding rollups past the raw retention window keeps the rollups that outlive raw data.
+
+Fills a temporary SQLite database with 40 days of samples for one series, builds
+every rollup level, prunes with the default retention policy (raw 7 days, minute
+rollups 30 days), then backfills the whole 40 days again as rollups.py
+--backfill-days and a bulk import do. Every minute, hour and day row must still be
+there with the same values, and a sample written since must be rolled up:
+
+    python benchmarks/check_rollup_retention.py
+"""
+import os
+import sys
+import tempfile
+import uuid
+import warnings
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib_database.engine import configure_engine, create_session, get_engine
+from lib_database.retention import RetentionPruner
+from lib_database.rollups import DAY, MINUTE, configure_retention, rebuild_by_day, rebuild_range
+from models import Base, Device, DeviceMetric, DeviceMetricRollup, Metric
+
+DAYS = 40
+STEP = timedelta(minutes=10)
+RETENTION = {"raw_days": 7, "rollup_days": {"60": 30, "3600": 365, "86400": 730}, "interval_seconds": 3600}
+
+
+def rollup_rows():
+    with create_session() as session:
+        return {
+            (row.resolution, row.bucket_start): (row.min_value, row.max_value, row.sum_value, row.sample_count, row.last_value)
+            for row in session.query(DeviceMetricRollup)
+        }
+
+
+def main():
+    warnings.filterwarnings("ignore")
+    path = os.path.join(tempfile.mkdtemp(prefix="check_rollup_retention_"), "check.db")
+    configure_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(get_engine())
+
+    now = datetime.utcnow().replace(microsecond=0)
+    device_id, metric_id = str(uuid.uuid4()), str(uuid.uuid4())
+    with create_session() as session:
+        session.add(Device(uuid=device_id, name="device-000", date_registered=now))
+        session.add(Metric(uuid=metric_id, name="cpu_percent"))
+        session.commit()
+        rows, timestamp = [], now - timedelta(days=DAYS)
+        while timestamp < now:
+            rows.append({"uuid": str(uuid.uuid4()), "device_id": device_id, "metric_id": metric_id,
+                         "value": float(timestamp.hour), "timestamp": timestamp})
+            timestamp += STEP
+        session.execute(DeviceMetric.__table__.insert(), rows)
+        session.commit()
+
+    configure_retention({})
+    rebuild_range("device", now - timedelta(days=DAYS + 1), now + timedelta(minutes=1))
+    RetentionPruner(RETENTION).run(now)
+    before = rollup_rows()
+    minutes = sum(1 for resolution, _ in before if resolution == MINUTE)
+    print(f"after pruning: {len(before)} rollup rows ({minutes} minutes)")
+
+    configure_retention(RETENTION)
+    end = now.replace(hour=0, minute=0, second=0) + timedelta(days=1)
+    rebuild_by_day("device", end - timedelta(days=DAYS + 1), end)
+    after = rollup_rows()
+    lost = [key for key in before if key not in after]
+    changed = [key for key in before if key in after and after[key] != before[key]]
+    assert not lost, f"{len(lost)} rollup rows lost, e.g. {sorted(lost)[:3]}"
+    assert not changed, f"{len(changed)} rollup rows changed, e.g. {sorted(changed)[:3]}"
+
+    # A new sample is still rolled up at every level
+    sample = now + timedelta(seconds=30)
+    with create_session() as session:
+        session.execute(DeviceMetric.__table__.insert(), [{"uuid": str(uuid.uuid4()), "device_id": device_id,
+                                                           "metric_id": metric_id, "value": 1000.0, "timestamp": sample}])
+        session.commit()
+    rebuild_range("device", sample, sample + timedelta(seconds=1))
+    after = rollup_rows()
+    for resolution in (MINUTE, 3600, DAY):
+        key = next(key for key in after if key[0] == resolution and key[1] <= sample < key[1] + timedelta(seconds=resolution))
+        assert after[key][1] == 1000.0, f"{resolution}s bucket missed the new sample"
+
+    print(f"OK: backfilling {DAYS} days kept all {len(before)} rollup rows")
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
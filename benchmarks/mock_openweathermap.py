@@ -0,0 +1,58 @@
+"""
+Minimal local stand-in for the OpenWeatherMap weather and air-pollution APIs.
+
+Answers /data/2.5/weather and /data/2.5/air_pollution with fixed payloads after an
+artificial delay, so collector benchmarks measure our client code rather than the
+real API:
+
+    server, base_url = start_mock_server(latency=0.05)
+    ...
+    server.shutdown()
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+WEATHER_RESPONSE = {
+    "main": {"temp": 11.4, "humidity": 81, "pressure": 1013},
+    "wind": {"speed": 5.1},
+    "rain": {"1h": 0.2}
+}
+AIR_POLLUTION_RESPONSE = {"list": [{"main": {"aqi": 2}}]}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real API
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        self.server.requests_served += 1
+        time.sleep(self.server.latency)
+        if parts.path.endswith("/weather"):
+            body = dict(WEATHER_RESPONSE, coord=parse_qs(parts.query))
+        elif parts.path.endswith("/air_pollution"):
+            body = AIR_POLLUTION_RESPONSE
+        else:
+            self.send_error(404)
+            return
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_mock_server(latency=0.05, port=0):
+    """Starts the mock API on a background thread; returns (server, base_url ending in /data/2.5)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.requests_served = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/data/2.5"
@@ -1,45 +1,190 @@
 import sys
 import os
 import logging
-from flask import Flask, request, jsonify, render_template
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-import requests
-from tenacity import retry, stop_after_attempt, wait_fixed
-from flask_caching import Cache
+from flask import Flask, Response, request, jsonify, render_template
+from sqlalchemy import exists, or_
 import time
+from datetime import datetime, timedelta
+import atexit
+import base64
+import json
+import threading
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-from lib_utils.blocktimer import BlockTimer
-from lib_database.update_database import update_database
+from lib_utils.blocktimer import BlockTimer, block_timings, configure_block_timers
+from lib_utils.json_encoding import dumps
+from lib_utils.decimation import METHODS as DECIMATION_METHODS, MIN_POINTS as DECIMATION_MIN_POINTS, decimate_series
+from lib_utils.wire_format import (
+    FRAME_CONTENT_TYPE, JSON_CONTENT_TYPE, UnsupportedFormatError, available_encodings, decode_samples, decompress
+)
+from lib_database.update_database import update_database, update_database_batch, validate_sample, MAX_BATCH_SIZE
+from lib_database.lookup_cache import lookup_cache
+from lib_database.snapshot import snapshot_store
+from lib_database.hot_tier import hot_tier, percentile_name
+from lib_database.live_feed import live_feed, SubscriberLimitError
+from lib_database.query_cache import query_cache, create_backend
+from lib_database.bulk_io import COLUMNS as EXPORT_COLUMNS, FORMATS as EXPORT_FORMATS, export_chunks, encode as encode_export
+from lib_database.write_behind import WriteBehindQueue, QueueFullError
+from lib_database.engine import get_engine, create_session, pool_stats
+from lib_database.rollups import HOUR, KINDS, RollupWorker, iter_series, parse_resolution, auto_resolution, check_resolution
+from lib_database.retention import RetentionPruner, RetentionWorker
 from dto import MetricsDTO
-from models import DeviceMetric, ThirdParty, Metric, Device, ThirdPartyType
+from models import DeviceMetric, ThirdParty, Metric, Device, ThirdPartyType, check_schema, third_party_name
 
-# Define the cache
-cache = Cache(config={'CACHE_TYPE': 'simple', 'CACHE_DEFAULT_TIMEOUT': 600})  # 600 seconds = 10 minutes
+# Largest page /api/device_metrics will return
+MAX_PAGE_SIZE = 500
+
+# Query parameters that turn /api/device_metrics and /api/weather_data into series queries
+SERIES_ARGS = ('from', 'to', 'resolution', 'max_points')
+# With max_points and no resolution, read the finest level with at most this many source points per output point
+DECIMATION_OVERSAMPLING = 20
+
+# Live stream pacing: fastest push rate per client, and idle keep-alive interval
+MIN_PUSH_INTERVAL_SECONDS = 1.0
+KEEPALIVE_SECONDS = 15
 
 class Application:
     def __init__(self):
-        """Initialize the application with required configuration and logging."""
+        """Initialize the application with required configuration and logging.
+
+        Nothing here touches the database or starts a thread, so importing this module
+        is cheap and safe before a pre-fork server forks; startup() does that work, on
+        the first request or when a serving mode calls it in each worker.
+        """
         self.config = self.load_config()
         self.logger = logging.getLogger(__name__)
+        configure_block_timers(self.config.get('instrumentation', {}))
         self.flask_app = Flask(__name__)
-        cache.init_app(self.flask_app)  # Initialize the cache with the Flask app
+        self.configure_query_cache()
+        self.configure_hot_tier()
         self.setup_routes()
-        self.engine = create_engine(os.getenv('DATABASE_URL'))
-        self.SessionLocal = sessionmaker(bind=self.engine)
+        self.SessionLocal = create_session
+        self.ingest_queue = None
+        self.rollup_worker = None
+        self.retention_worker = None
+        self.started = False
+        self._startup_lock = threading.Lock()
         self.weather_data_cache = {}
         self.device_metrics_cache = []
         self.last_updated_time = None
 
+    @property
+    def engine(self):
+        # Shared with the ingest path: one pool per process, created on first use
+        return get_engine()
+
+    def startup(self):
+        """Warm caches and start the background workers, once per process."""
+        if self.started:
+            return
+        with self._startup_lock:
+            if self.started:
+                return
+            with BlockTimer("Application startup", self.logger):
+                check_schema(self.engine)  # Fatal: these models would corrupt a database on the old schema
+                self.warm_lookup_cache()
+                self.load_snapshot()
+                self.load_hot_tier()
+                snapshot_store.add_listener(live_feed.publish)  # New samples reach /api/stream without a query
+                self.ingest_queue = self.create_ingest_queue()
+                self.rollup_worker = self.create_rollup_worker()
+                self.retention_worker = self.create_retention_worker()
+            self.started = True
+
+    def shutdown(self):
+        """Stop the background workers started by startup()."""
+        for worker in (self.ingest_queue, self.rollup_worker, self.retention_worker):
+            if worker is not None:
+                worker.stop()
+
     def load_config(self):
         """Load configuration from a file."""
-        import json
         config_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../config.json'))
         print(f"Loading configuration from: {config_path}")
         with open(config_path, 'r') as config_file:
             return json.load(config_file)
 
+    def configure_query_cache(self):
+        """Select the query cache backend from `cache` in config.json (default: in-process memory)."""
+        settings = dict(self.config.get('cache', {}))
+        if settings.get('path'):
+            # Relative paths are relative to the repository root, like config.json itself
+            settings['path'] = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', settings['path']))
+        try:
+            query_cache.configure(create_backend(settings), ttl_seconds=settings.get('ttl_seconds', 600))
+        except Exception as e:
+            # Not fatal: fall back to the per-process default backend
+            self.logger.warning("Could not configure %s query cache backend: %s", settings.get('backend'), str(e))
+
+    def configure_hot_tier(self):
+        """Size the in-memory recent-data tier from `hot_tier` in config.json (off by default)."""
+        try:
+            hot_tier.configure(self.config.get('hot_tier', {}))
+        except Exception as e:
+            # Not fatal: series queries read rollups from the database
+            self.logger.warning("Could not enable the hot tier: %s", str(e))
+
+    def warm_lookup_cache(self):
+        """Preload device/metric/third-party-type IDs so steady-state ingest makes no lookup queries."""
+        try:
+            with self.SessionLocal() as session:
+                lookup_cache.warm(session)
+        except Exception as e:
+            # Not fatal: the cache fills itself on first use
+            self.logger.warning("Could not warm lookup cache: %s", str(e))
+
+    def load_snapshot(self):
+        """Load the latest value of every series so snapshot endpoints can answer from memory."""
+        try:
+            with self.SessionLocal() as session:
+                snapshot_store.rebuild(session)
+        except Exception as e:
+            # Not fatal: ingest fills the snapshot as samples arrive
+            self.logger.warning("Could not load latest-value snapshot: %s", str(e))
+
+    def load_hot_tier(self):
+        """Load the last `hot_tier.window_hours` of samples so recent series are served from memory."""
+        try:
+            with self.SessionLocal() as session:
+                hot_tier.warm(session)
+        except Exception as e:
+            # Not fatal: the tier covers samples ingested from now on
+            self.logger.warning("Could not warm the hot tier: %s", str(e))
+
+    def create_ingest_queue(self):
+        """Start the write-behind writer when `write_behind.enabled` is set in config.json."""
+        settings = self.config.get('write_behind', {})
+        if not settings.get('enabled'):
+            return None
+        ingest_queue = WriteBehindQueue(
+            max_queue_size=settings.get('max_queue_size', 10000),
+            max_batch_size=settings.get('max_batch_size', 500),
+            max_delay_seconds=settings.get('max_delay_seconds', 1.0)
+        )
+        ingest_queue.start()
+        atexit.register(ingest_queue.stop)
+        return ingest_queue
+
+    def create_rollup_worker(self):
+        """Start the background rollup refresher unless `rollups.enabled` is false in config.json."""
+        settings = self.config.get('rollups', {})
+        if not settings.get('enabled', True):
+            return None
+        rollup_worker = RollupWorker(interval_seconds=settings.get('interval_seconds', 30))
+        rollup_worker.start()
+        atexit.register(rollup_worker.stop)
+        return rollup_worker
+
+    def create_retention_worker(self):
+        """Start the background pruner when `retention.enabled` is set in config.json."""
+        settings = self.config.get('retention', {})
+        if not settings.get('enabled'):
+            return None
+        retention_worker = RetentionWorker(RetentionPruner(settings), interval_seconds=settings.get('interval_seconds', 3600))
+        retention_worker.start()
+        atexit.register(retention_worker.stop)
+        return retention_worker
+
     def setup_routes(self):
         """Setup the routes for the Flask application."""
         @self.flask_app.route('/')
@@ -56,44 +201,218 @@ class Application:
                 logging.error(f"Error loading data: {str(e)}")
                 return render_template('index.html', weather_data={}, device_metrics=[], last_updated_time="N/A", current_page=1, limit=5)
 
+        @self.flask_app.before_request
+        def start_on_first_request():
+            self.startup()
+
+        @self.flask_app.after_request
+        def advertise_ingest_formats(response):
+            # Agents start with gzip JSON and switch to what ingest responses advertise (RFC 7694)
+            if request.path.startswith('/api/update_metrics'):
+                response.headers['Accept-Post'] = f"{FRAME_CONTENT_TYPE}, {JSON_CONTENT_TYPE}"
+                response.headers['Accept-Encoding'] = ", ".join(available_encodings())
+            return response
+
         @self.flask_app.route('/api/update_metrics', methods=['POST'])
         def update_metrics():
             logging.info("Received request to update metrics")
             try:
-                metrics_data = request.get_json()
+                metrics_data = self.read_body()
+                if isinstance(metrics_data, list):
+                    # Frames always hold a list; this endpoint takes exactly one sample
+                    if len(metrics_data) != 1:
+                        return jsonify({"error": "Expected exactly one sample"}), 400
+                    metrics_data = metrics_data[0]
                 logging.debug(f"Metrics data received: {metrics_data}")
                 metrics_dto = MetricsDTO.from_dict(metrics_data)
                 logging.debug(f"MetricsDTO created: {metrics_dto}")
+                if self.ingest_queue is not None:
+                    payload, status = self.enqueue_sample(metrics_dto)
+                    return jsonify(payload), status
                 update_database(metrics_dto)
                 logging.info("Metrics successfully updated in the database")
                 return jsonify({"message": "Metrics updated successfully!"}), 200
+            except QueueFullError as e:
+                logging.warning(f"Rejecting metrics: {str(e)}")
+                return jsonify({"error": str(e)}), 429, {"Retry-After": "1"}
+            except UnsupportedFormatError as e:
+                return self.unsupported_format_response(e)
             except Exception as e:
                 logging.error(f"Error processing request: {str(e)}")
                 return jsonify({"error": str(e)}), 500
 
+        @self.flask_app.route('/api/update_metrics/batch', methods=['POST'])
+        def update_metrics_batch():
+            logging.info("Received request to update metrics in batch")
+            try:
+                body = self.read_body()
+                items = body.get("metrics") if isinstance(body, dict) else body
+                if not isinstance(items, list):
+                    return jsonify({"error": "Expected a JSON array of metrics or {\"metrics\": [...]}"}), 400
+                if len(items) > MAX_BATCH_SIZE:
+                    return jsonify({"error": f"Batch size {len(items)} exceeds the limit of {MAX_BATCH_SIZE}"}), 413
+
+                metrics_dtos = [MetricsDTO.from_dict(item) if isinstance(item, dict) else None for item in items]
+                if self.ingest_queue is not None:
+                    payload, status = self.enqueue_batch(metrics_dtos)
+                    return jsonify(payload), status
+                results = update_database_batch(metrics_dtos)
+                accepted = sum(1 for result in results if result["status"] == "accepted")
+                logging.info(f"Batch processed: {accepted} accepted, {len(results) - accepted} rejected")
+                return jsonify({
+                    "accepted": accepted,
+                    "rejected": len(results) - accepted,
+                    "results": results
+                }), 200
+            except UnsupportedFormatError as e:
+                return self.unsupported_format_response(e)
+            except Exception as e:
+                logging.error(f"Error processing batch request: {str(e)}")
+                return jsonify({"error": str(e)}), 500
+
+        @self.flask_app.route('/api/stats/lookup_cache', methods=['GET'])
+        def lookup_cache_stats():
+            return jsonify(lookup_cache.stats())
+
+        @self.flask_app.route('/api/stats/ingest_queue', methods=['GET'])
+        def ingest_queue_stats():
+            if self.ingest_queue is None:
+                return jsonify({"enabled": False})
+            return jsonify(dict(self.ingest_queue.stats(), enabled=True))
+
+        @self.flask_app.route('/api/stats/db_pool', methods=['GET'])
+        def db_pool_stats():
+            return jsonify(pool_stats())
+
+        @self.flask_app.route('/api/stats/query_cache', methods=['GET'])
+        def query_cache_stats():
+            return jsonify(query_cache.stats())
+
+        @self.flask_app.route('/api/stats/retention', methods=['GET'])
+        def retention_stats():
+            if self.retention_worker is None:
+                return jsonify({"enabled": False})
+            return jsonify(dict(self.retention_worker.pruner.stats(), enabled=True))
+
+        @self.flask_app.route('/api/stats/hot_tier', methods=['GET'])
+        def hot_tier_stats():
+            return jsonify(hot_tier.stats())
+
+        @self.flask_app.route('/api/stats/snapshot', methods=['GET'])
+        def snapshot_stats():
+            return jsonify(snapshot_store.stats())
+
+        @self.flask_app.route('/api/stats/live_feed', methods=['GET'])
+        def live_feed_stats():
+            return jsonify(live_feed.stats())
+
+        @self.flask_app.route('/api/stats/block_timers', methods=['GET'])
+        def block_timer_stats():
+            return jsonify(block_timings.stats())
+
+        @self.flask_app.route('/metrics', methods=['GET'])
+        def prometheus_metrics():
+            return Response(block_timings.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+        @self.flask_app.route('/api/fleet/agents', methods=['GET'])
+        def fleet_agents():
+            """Devices that sent a sample in the last `active_minutes`; agents shard location fetching over them.
+
+            Read from the database, not this worker's snapshot, so every agent gets the same
+            membership whichever worker answers. `since` is whole minutes, so agents asking
+            within the same minute share one cached query.
+            """
+            active_minutes = request.args.get('active_minutes', 15, type=float)
+            now = datetime.utcnow().replace(second=0, microsecond=0)
+            since = now - timedelta(minutes=active_minutes)
+            agents = query_cache.get(
+                "fleet_agents", f"{active_minutes:g}:{now.isoformat()}", lambda: self.query_active_devices(since)
+            )
+            return jsonify({"agents": agents})
+
+        @self.flask_app.route('/api/stream', methods=['GET'])
+        def stream():
+            """Server-Sent Events: current values first, then every new sample matching the filters."""
+            try:
+                subscription = live_feed.subscribe(
+                    device=request.args.get('device'),
+                    metric=request.args.get('metric'),
+                    weather_type=request.args.get('weather')
+                )
+            except SubscriberLimitError as e:
+                return jsonify({"error": str(e)}), 503, {"Retry-After": "30"}
+            interval = max(request.args.get('interval', MIN_PUSH_INTERVAL_SECONDS, type=float), MIN_PUSH_INTERVAL_SECONDS)
+            response = Response(
+                self.stream_events(subscription, interval),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+            # Runs once the client disconnects, even if streaming never started
+            response.call_on_close(lambda: live_feed.unsubscribe(subscription))
+            return response
+
+        @self.flask_app.route('/api/export', methods=['GET'])
+        def export():
+            """Streams raw rows for a time range as CSV or the columnar format of lib_database.bulk_io."""
+            kind = request.args.get('kind', 'device')
+            output_format = request.args.get('format', 'columnar')
+            if kind not in EXPORT_COLUMNS or output_format not in EXPORT_FORMATS:
+                return jsonify({"error": f"kind must be one of {list(EXPORT_COLUMNS)}, format one of {list(EXPORT_FORMATS)}"}), 400
+            try:
+                start, end, _ = self.parse_series_args()
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+
+            chunks = export_chunks(kind, start, end, request.args.getlist('metric') or None)
+            filename = f"{kind}_{start:%Y%m%dT%H%M%S}_{end:%Y%m%dT%H%M%S}.{'csv' if output_format == 'csv' else 'smcol'}"
+            return Response(
+                encode_export(kind, chunks, output_format),
+                mimetype='text/csv' if output_format == 'csv' else 'application/octet-stream',
+                headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+            )
+
+        @self.flask_app.route('/api/snapshot/device_metrics', methods=['GET'])
+        def get_device_metrics_snapshot():
+            # Latest value per device/metric, from memory
+            return self.json_response({
+                "device_metrics": snapshot_store.device_metrics(request.args.get('device'), request.args.get('metric'))
+            })
+
+        @self.flask_app.route('/api/snapshot/weather_data', methods=['GET'])
+        def get_weather_data_snapshot():
+            # Latest value per location for one data type, from memory
+            data_type = request.args.get('type')
+            if not data_type:
+                return jsonify({"error": "Data type is required"}), 400
+            return self.json_response({"weather_data": snapshot_store.third_parties(data_type)})
+
         @self.flask_app.route('/api/device_metrics', methods=['GET'])
         def get_device_metrics():
+            if self.is_series_request():
+                return self.device_metrics_series()
             session = self.SessionLocal()
             try:
-                page = request.args.get('page', 1, type=int) or 1
-                limit = request.args.get('limit', 5, type=int) or 5
-                offset = (page - 1) * limit
-
-                device_metrics = session.query(DeviceMetric).order_by(DeviceMetric.timestamp.desc()).offset(offset).limit(limit).all()
+                limit = min(request.args.get('limit', 5, type=int) or 5, MAX_PAGE_SIZE)
+                page = request.args.get('page', type=int)
+                device_metrics, next_cursor = self.query_device_metrics(
+                    session, limit,
+                    page=page if 'cursor' not in request.args else None,
+                    cursor=request.args.get('cursor'),
+                    device=request.args.get('device'),
+                    metric=request.args.get('metric')
+                )
 
                 if not device_metrics:
                     logging.warning("No device metrics data found.")
-                    
-                return jsonify({
-                    "device_metrics": [{
-                        "device_name": metric.device.name,
-                        "metric_name": metric.metric.name,
-                        "value": metric.value,
-                        "timestamp": metric.timestamp
-                    } for metric in device_metrics],
-                    "page": page,
+
+                return self.json_response({
+                    "device_metrics": device_metrics,
+                    "next_cursor": next_cursor,
+                    "page": page or 1,
                     "limit": limit
                 })
+            except ValueError as e:
+                return jsonify({"error": f"Invalid cursor: {str(e)}"}), 400
             except Exception as e:
                 logging.error(f"Error fetching device metrics: {str(e)}")
                 return jsonify({"error": str(e)}), 500
@@ -107,18 +426,11 @@ class Application:
             if not data_type:
                 return jsonify({"error": "Data type is required"}), 400
 
+            if self.is_series_request():
+                return self.weather_data_series(data_type)
+
             try:
-                weather_data = self.fetch_cached_weather_data(data_type)
-                return jsonify({
-                    "weather_data": [{
-                        "name": row.name,
-                        "value": row.value,
-                        "latitude": float(row.latitude),
-                        "longitude": float(row.longitude),
-                        "location_name": row.location_name,
-                        "timestamp": row.timestamp.isoformat()
-                    } for row in weather_data]
-                })
+                return self.json_response({"weather_data": self.fetch_cached_weather_data(data_type)})
             except Exception as e:
                 logging.error(f"Error fetching weather data: {str(e)}")
                 return jsonify({"error": "Failed to fetch weather data"}), 500
@@ -126,36 +438,383 @@ class Application:
         @self.flask_app.route('/update_device_metrics')
         def update_device_metrics():
             self.fetch_device_metrics()
-            return jsonify(device_metrics=self.device_metrics_cache, last_updated_time=self.last_updated_time)
+            return self.json_response({"device_metrics": self.device_metrics_cache, "last_updated_time": self.last_updated_time})
+
+    @staticmethod
+    def stream_events(subscription, interval):
+        """Yields SSE frames for `subscription` until the client disconnects."""
+        def event(name, payload):
+            return f"event: {name}\ndata: {dumps(payload)}\n\n"
+
+        # Start from the snapshot so the page renders without a separate request
+        device_entries = [entry for entry in snapshot_store.device_metrics() if subscription.matches_device_metric(entry)]
+        weather_entries = [entry for entry in snapshot_store.third_parties() if subscription.matches_weather(entry)]
+        yield f"retry: {KEEPALIVE_SECONDS * 1000}\n\n"
+        yield event("device_metrics", device_entries)
+        yield event("weather_data", weather_entries)
+
+        while True:
+            sent_at = time.monotonic()
+            device_entries, weather_entries = subscription.wait(KEEPALIVE_SECONDS)
+            if not device_entries and not weather_entries:
+                # Also how a vanished client is noticed: the write fails and the response closes
+                yield ": keep-alive\n\n"
+                continue
+            if device_entries:
+                yield event("device_metrics", device_entries)
+            if weather_entries:
+                yield event("weather_data", weather_entries)
+            # Anything arriving during the pause is coalesced into the next push
+            time.sleep(max(0.0, sent_at + interval - time.monotonic()))
+
+    @staticmethod
+    def query_active_devices(since):
+        """Names of the devices with a device metric sample at or after `since`.
+
+        One index seek on (device_id, metric_id, timestamp) per device and metric,
+        rather than a scan of every recent sample.
+        """
+        recent = exists().where(
+            DeviceMetric.device_id == Device.uuid, DeviceMetric.metric_id == Metric.uuid, DeviceMetric.timestamp >= since
+        ).correlate(Device, Metric)
+        with create_session() as session:
+            rows = session.query(Device.name).filter(session.query(Metric.uuid).filter(recent).exists())
+            return sorted(name for name, in rows)
 
     @staticmethod
-    @retry(stop=stop_after_attempt(3), wait=wait_fixed(2))
-    def fetch_metrics(endpoint, params=None,timeout=30):
-        response = requests.get(endpoint, params=params, timeout=timeout)  # Set a timeout of 10 seconds
-        response.raise_for_status()
-        return response.json()
+    def query_device_metrics(session, limit, page=None, cursor=None, device=None, metric=None):
+        """One page of device metrics, newest first, as flat dicts plus the cursor for the next page.
+
+        Device and metric names come from a join in the same SELECT, so a page costs
+        one query however many rows it holds (plus a lookup per name filter on a cold cache).
+        """
+        query = session.query(
+            DeviceMetric.uuid,
+            Device.name.label('device_name'),
+            Metric.name.label('metric_name'),
+            DeviceMetric.value,
+            DeviceMetric.timestamp
+        ).join(Device, DeviceMetric.device_id == Device.uuid).join(
+            Metric, DeviceMetric.metric_id == Metric.uuid
+        ).order_by(DeviceMetric.timestamp.desc(), DeviceMetric.uuid.desc())
+
+        if device is not None:
+            query = query.filter(DeviceMetric.device_id == lookup_cache.device_id(session, device, create=False))
+        if metric is not None:
+            query = query.filter(DeviceMetric.metric_id == lookup_cache.metric_id(session, metric))
+
+        if page:
+            # Legacy OFFSET paging: cost grows with depth, prefer `cursor`
+            query = query.offset((page - 1) * limit)
+        elif cursor:
+            cursor_timestamp, cursor_uuid = Application.decode_cursor(cursor)
+            # Rows strictly after the cursor in (timestamp DESC, uuid DESC) order; the leading
+            # `timestamp <=` bound lets MySQL and SQLite seek the index instead of scanning it
+            query = query.filter(
+                DeviceMetric.timestamp <= cursor_timestamp,
+                or_(DeviceMetric.timestamp < cursor_timestamp, DeviceMetric.uuid < cursor_uuid)
+            )
+
+        # Fetch one extra row to learn whether there is a next page
+        rows = query.limit(limit + 1).all()
+        next_cursor = Application.encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        return [{
+            "device_name": row.device_name,
+            "metric_name": row.metric_name,
+            "value": row.value,
+            "timestamp": row.timestamp
+        } for row in rows[:limit]], next_cursor
+
+    @staticmethod
+    def json_response(payload, status=200):
+        """Compact JSON response with ISO-8601 timestamps."""
+        return Response(dumps(payload), status=status, mimetype='application/json')
+
+    @staticmethod
+    def encode_cursor(device_metric):
+        """Opaque keyset cursor pointing just past `device_metric` in newest-first order."""
+        raw = f"{device_metric.timestamp.isoformat()}|{device_metric.uuid}"
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """Inverse of encode_cursor(); raises ValueError for anything malformed."""
+        try:
+            timestamp, uuid = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|', 1)
+            # The uuid column is BINARY(16): reject anything that would not convert
+            if len(bytes.fromhex(uuid.replace('-', ''))) != 16:
+                raise ValueError
+        except Exception:
+            raise ValueError("cursor is not a valid page token")
+        return datetime.fromisoformat(timestamp), uuid
+
+    @staticmethod
+    def is_series_request():
+        """True when the caller asked for a time range or resolution rather than a page of raw rows."""
+        return any(name in request.args for name in SERIES_ARGS)
+
+    @staticmethod
+    def parse_series_args(max_points=None):
+        """Parse `from`/`to` (ISO-8601, UTC) and `resolution` ("raw", "5m", "1h", seconds...).
+
+        Defaults to the last 24 hours, and to the finest resolution that keeps a
+        series under the rollup module's point limit, or, when the series will be
+        decimated to `max_points`, under DECIMATION_OVERSAMPLING times that. An explicit
+        resolution may not split the range into more than the rollup module's bucket limit.
+        """
+        end = datetime.fromisoformat(request.args['to']) if 'to' in request.args else datetime.utcnow()
+        start = datetime.fromisoformat(request.args['from']) if 'from' in request.args else end - timedelta(days=1)
+        if start >= end:
+            raise ValueError("'from' must be earlier than 'to'")
+        if 'resolution' in request.args:
+            resolution = parse_resolution(request.args['resolution'])
+            if resolution is not None:
+                check_resolution(start, end, resolution)
+        elif max_points:
+            resolution = auto_resolution(start, end, max_points * DECIMATION_OVERSAMPLING)
+        else:
+            resolution = auto_resolution(start, end)
+        return start, end, resolution
+
+    @staticmethod
+    def parse_decimation():
+        """Parse `max_points` and `decimation` ("lttb" or "minmax"); returns (None, None) when not decimating."""
+        if 'max_points' not in request.args:
+            return None, None
+        method = request.args.get('decimation', 'lttb')
+        if method not in DECIMATION_METHODS:
+            raise ValueError(f"decimation must be one of {list(DECIMATION_METHODS)}")
+        max_points = int(request.args['max_points'])
+        if max_points < DECIMATION_MIN_POINTS[method]:
+            raise ValueError(f"max_points must be at least {DECIMATION_MIN_POINTS[method]} for {method}")
+        return max_points, method
+
+    @staticmethod
+    def parse_percentiles():
+        """Parse `percentiles` ("50,95,99"): the percentiles to add to every point of a series."""
+        if not request.args.get('percentiles'):
+            return []
+        percentiles = [float(q) for q in request.args['percentiles'].split(',')]
+        if any(not 0 <= q <= 100 for q in percentiles):
+            raise ValueError("percentiles must be between 0 and 100")
+        return percentiles
+
+    @staticmethod
+    def recent_series(kind_name, start, end, resolution, series_filter, percentiles, max_points=None, method=None):
+        """Series points from the hot tier when it holds the whole range, else from rollups.
+
+        Returns (points, source); points is an iterator, decimated to at most `max_points`
+        per series when given. Rollups keep no percentiles, so asking for them over
+        a range the hot tier does not cover raises ValueError.
+        """
+        # Hour and day rollups are a few rows per bucket already; the tier wins on raw and finer data
+        if percentiles or resolution is None or resolution < HOUR:
+            points = hot_tier.query_series(kind_name, start, end, resolution, series_filter, percentiles)
+            if points is not None:
+                return Application.decimate(kind_name, points, start, end, max_points, method), "hot_tier"
+        if percentiles:
+            raise ValueError(
+                f"percentiles are only available for the last {hot_tier.window_seconds / HOUR:g} hours" if hot_tier.enabled
+                else "percentiles need the hot tier, which is disabled"
+            )
+        # Streamed: decimated raw samples never sit in memory all at once
+        points = iter_series(kind_name, start, end, resolution, series_filter)
+        return Application.decimate(kind_name, points, start, end, max_points, method), "rollups"
+
+    @staticmethod
+    def decimate(kind_name, points, start, end, max_points, method):
+        if not max_points:
+            return iter(points)
+        return decimate_series(points, KINDS[kind_name].series_columns, start, end, max_points, method)
+
+    def device_metrics_series(self):
+        """Downsampled device metrics for a time range, from the hot tier or rollups where possible."""
+        try:
+            max_points, method = self.parse_decimation()
+            start, end, resolution = self.parse_series_args(max_points)
+            percentiles = self.parse_percentiles()
+        except ValueError as e:
+            return self.json_response({"error": str(e)}, 400)
+
+        session = self.SessionLocal()
+        try:
+            device_names = dict(session.query(Device.uuid, Device.name).all())
+            metric_names = dict(session.query(Metric.uuid, Metric.name).all())
+        finally:
+            session.close()
+
+        series_filter = {}
+        if 'device' in request.args:
+            series_filter['device_id'] = [uuid for uuid, name in device_names.items() if name == request.args['device']]
+        if 'metric' in request.args:
+            series_filter['metric_id'] = [uuid for uuid, name in metric_names.items() if name == request.args['metric']]
+
+        names = [percentile_name(q) for q in percentiles]
+        try:
+            points, source = self.recent_series(
+                'device', start, end, resolution, series_filter, percentiles, max_points, method
+            )
+            return self.json_response({
+                "device_metrics": [dict({
+                    "device_name": device_names.get(point['device_id']),
+                    "metric_name": metric_names.get(point['metric_id']),
+                    "value": point['value'],
+                    "min": point['min'],
+                    "max": point['max'],
+                    "count": point['count'],
+                    "last": point['last'],
+                    "timestamp": point['timestamp'].isoformat()
+                }, **{name: point[name] for name in names}) for point in points],
+                "from": start.isoformat(),
+                "to": end.isoformat(),
+                "resolution": resolution if resolution is not None else "raw",
+                "source": source,
+                "decimation": {"method": method, "max_points": max_points} if max_points else None
+            })
+        except ValueError as e:
+            return self.json_response({"error": str(e)}, 400)
+        except Exception as e:
+            logging.error(f"Error fetching device metric series: {str(e)}")
+            return self.json_response({"error": str(e)}, 500)
+
+    def weather_data_series(self, data_type):
+        """Downsampled weather data of one type for a time range, one series per location."""
+        try:
+            max_points, method = self.parse_decimation()
+            start, end, resolution = self.parse_series_args(max_points)
+            percentiles = self.parse_percentiles()
+        except ValueError as e:
+            return self.json_response({"error": str(e)}, 400)
+
+        session = self.SessionLocal()
+        try:
+            locations = {
+                row.uuid: row for row in session.query(
+                    ThirdPartyType.uuid, ThirdPartyType.latitude, ThirdPartyType.longitude, ThirdPartyType.location_name
+                ).filter(ThirdPartyType.name == data_type)
+            }
+        finally:
+            session.close()
+
+        names = [percentile_name(q) for q in percentiles]
+        try:
+            points, source = self.recent_series(
+                'third_party', start, end, resolution, {'thirdparty_id': list(locations)}, percentiles, max_points, method
+            )
+            return self.json_response({
+                "weather_data": [dict({
+                    "name": third_party_name(locations[point['thirdparty_id']].location_name, data_type),
+                    "value": point['value'],
+                    "min": point['min'],
+                    "max": point['max'],
+                    "count": point['count'],
+                    "last": point['last'],
+                    "latitude": float(locations[point['thirdparty_id']].latitude),
+                    "longitude": float(locations[point['thirdparty_id']].longitude),
+                    "location_name": locations[point['thirdparty_id']].location_name,
+                    "timestamp": point['timestamp'].isoformat()
+                }, **{name: point[name] for name in names}) for point in points],
+                "from": start.isoformat(),
+                "to": end.isoformat(),
+                "resolution": resolution if resolution is not None else "raw",
+                "source": source,
+                "decimation": {"method": method, "max_points": max_points} if max_points else None
+            })
+        except ValueError as e:
+            return self.json_response({"error": str(e)}, 400)
+        except Exception as e:
+            logging.error(f"Error fetching weather data series: {str(e)}")
+            return self.json_response({"error": "Failed to fetch weather data"}, 500)
+
+    @staticmethod
+    def read_body():
+        """Parse the current ingest request body with parse_ingest_body()."""
+        return Application.parse_ingest_body(request.get_data(), request.mimetype, request.headers.get('Content-Encoding'))
+
+    @staticmethod
+    def parse_ingest_body(data, mimetype, content_encoding):
+        """Parse an ingest request body: JSON, or a list of samples from a binary frame.
+
+        The body may be gzip- or zstd-compressed (Content-Encoding). Raises
+        UnsupportedFormatError for a type or encoding this server cannot read.
+        """
+        body = decompress(data, content_encoding)
+        if mimetype == FRAME_CONTENT_TYPE:
+            try:
+                return decode_samples(body)
+            except ValueError as e:
+                raise ValueError(f"Invalid sample frame: {e}")
+        if mimetype != JSON_CONTENT_TYPE:
+            raise UnsupportedFormatError(f"Unsupported Content-Type: {mimetype or 'none'}")
+        return json.loads(body)
+
+    @staticmethod
+    def unsupported_format_response(error):
+        logging.warning(f"Rejecting ingest body: {error}")
+        return jsonify({"error": str(error)}), 415
+
+    def enqueue_sample(self, metrics_dto):
+        """Queue one sample for the write-behind writer. Returns (response payload, status).
+
+        Validated first, so a sample the writer would drop gets a 400 instead of a 202.
+        Raises QueueFullError when the queue is full.
+        """
+        try:
+            with create_session() as session:
+                validate_sample(metrics_dto, session)
+        except (ValueError, KeyError, TypeError) as e:
+            return {"error": str(e)}, 400
+        self.ingest_queue.submit(metrics_dto)
+        return {"message": "Metrics accepted for processing"}, 202
+
+    def enqueue_batch(self, metrics_dtos):
+        """Queue each valid sample of a batch; invalid samples and those that do not fit are rejected individually.
+
+        Returns (response payload, status).
+        """
+        results = []
+        with create_session() as session:
+            for index, dto in enumerate(metrics_dtos):
+                try:
+                    validate_sample(dto, session)
+                except (ValueError, KeyError, TypeError) as e:
+                    results.append({"index": index, "status": "rejected", "error": str(e)})
+                    continue
+                try:
+                    self.ingest_queue.submit(dto)
+                    results.append({"index": index, "status": "queued"})
+                except QueueFullError as e:
+                    # Not the sample's fault: tell the sender to try this one again later
+                    results.append({"index": index, "status": "retry", "error": str(e)})
+        queued = sum(1 for result in results if result["status"] == "queued")
+        status = 202 if queued else 429
+        return {"accepted": queued, "rejected": len(results) - queued, "results": results}, status
 
     def fetch_device_metrics(self, page=1, limit=5):
+        # Reads the database directly rather than calling our own /api/device_metrics over HTTP
+        session = self.SessionLocal()
         try:
-            logging.info("Requesting device metrics from API...")
+            logging.info("Querying device metrics...")
             start_time = time.time()
-            data = self.fetch_metrics(f"{self.config['server_url']}/api/device_metrics", params={'page': page, 'limit': limit})
-            self.device_metrics_cache = data['device_metrics']
+            self.device_metrics_cache, _ = self.query_device_metrics(session, limit, page=page)
             end_time = time.time()
             logging.info(f"Device metrics fetched successfully in {end_time - start_time} seconds.")
         except Exception as e:
             logging.error(f"Error fetching device metrics: {str(e)}")
             self.device_metrics_cache = []
+        finally:
+            session.close()
 
-    @cache.memoize(timeout=600)  # Cache for 10 minutes
     def fetch_cached_weather_data(self, data_type):
-        return self.fetch_weather_data_from_db(data_type)
+        # Shared across workers and invalidated by ingest whenever new weather rows are committed
+        return query_cache.get("weather_data", data_type, lambda: self.fetch_weather_data_from_db(data_type))
 
-    def fetch_weather_data_from_db(self, data_type):
-        session = self.SessionLocal()
+    def fetch_weather_data_from_db(self, data_type, session=None):
+        """Every reading of one data type, newest first; on `session` if given, else a new one."""
+        own_session = session is None
+        session = self.SessionLocal() if own_session else session
         try:
-            return session.query(
-                ThirdParty.name,
+            rows = session.query(
                 ThirdParty.value,
                 ThirdParty.timestamp,
                 ThirdPartyType.latitude,
@@ -165,13 +824,26 @@ class Application:
                 ThirdPartyType.name == data_type
             ).order_by(ThirdParty.timestamp.desc()).all()
         finally:
-            session.close()
+            if own_session:
+                session.close()
+        return [{
+            "name": third_party_name(row.location_name, data_type),
+            "value": row.value,
+            "latitude": float(row.latitude),
+            "longitude": float(row.longitude),
+            "location_name": row.location_name,
+            "timestamp": row.timestamp.isoformat()
+        } for row in rows]
 
     def run(self) -> int:
-        """Main application logic."""
+        """Main application logic: the Werkzeug development server (see client/serve.py for production)."""
         try:
             self.logger.info("Starting Flask application...")
-            self.flask_app.run(debug=True, host='0.0.0.0', port=5000, threaded=True)
+            debug = os.getenv('FLASK_DEBUG') == '1'
+            if not debug or os.getenv('WERKZEUG_RUN_MAIN') == 'true':
+                # The reloader's parent only watches files: only the child serving requests starts the workers
+                self.startup()
+            self.flask_app.run(debug=debug, host='0.0.0.0', port=5000, threaded=True)
             self.logger.info("Application completed successfully")
             return 0
         except Exception as e:
@@ -0,0 +1,361 @@
+"""
+ASGI entry point: the dashboard app with native async ingest and page reads.
+
+    uvicorn client.asgi:app          (or: python client/serve.py --asgi)
+
+The endpoints agents and dashboards hit all the time are served on the event loop:
+ingest (/api/update_metrics, /api/update_metrics/batch) and paged reads
+(/api/device_metrics) use the async database engine (aiomysql/aiosqlite, see
+lib_database/engine.py), so a thousand agents keeping connections open cost
+sockets and coroutines rather than threads. Cached weather data and the in-memory
+snapshot endpoints answer without a query and run in a thread so a lock held by
+a worker never stalls the loop.
+
+Every other route (the dashboard, series queries, exports, /api/stream, stats)
+is the unchanged Flask app, called through a small WSGI bridge on a thread pool
+that streams the response back chunk by chunk, so the Server-Sent Events stream
+works too. Responses are the same in both modes; an ingested sample reaches the
+snapshot, rollups and query cache through the same after_commit().
+"""
+import asyncio
+import io
+import logging
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from client.app import Application, MAX_PAGE_SIZE, SERIES_ARGS, appForWSGI as application
+from lib_utils.blocktimer import BlockTimer
+from lib_utils.json_encoding import dumps
+from lib_utils.wire_format import FRAME_CONTENT_TYPE, JSON_CONTENT_TYPE, UnsupportedFormatError, available_encodings
+from lib_database.engine import create_async_session, dispose_async_engine, get_async_engine
+from lib_database.live_feed import live_feed
+from lib_database.snapshot import snapshot_store
+from lib_database.update_database import MAX_BATCH_SIZE, after_commit, write_batch
+from lib_database.write_behind import QueueFullError
+from dto import MetricsDTO
+
+# Threads running Flask routes; each in-flight bridged request (or open /api/stream) holds one
+WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", 32))
+
+logger = logging.getLogger(__name__)
+_executor = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix="asgi-wsgi")
+live_feed.limit_to_threads(WSGI_THREADS)
+_db_slots = None
+
+
+def db_slots():
+    """Bounds concurrent async transactions to what the database can take.
+
+    Defaults to the pool's size plus overflow, or a single writer for SQLite, so a
+    burst from a thousand agents queues here on the event loop instead of timing out
+    in the pool or failing with "database is locked". ASGI_DB_CONCURRENCY overrides it.
+    """
+    global _db_slots
+    if _db_slots is None:
+        if os.getenv("ASGI_DB_CONCURRENCY"):
+            limit = int(os.getenv("ASGI_DB_CONCURRENCY"))
+        elif get_async_engine().dialect.name == "sqlite":
+            limit = 1
+        else:
+            limit = int(os.getenv("DB_POOL_SIZE", 5)) + int(os.getenv("DB_MAX_OVERFLOW", 10))
+        _db_slots = asyncio.Semaphore(limit)
+    return _db_slots
+
+
+class Request:
+    """The parts of an ASGI HTTP request the native handlers need."""
+
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.args = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+        self.headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"]}
+        self.body = body
+
+    @property
+    def mimetype(self):
+        return self.headers.get("content-type", "").split(";")[0].strip().lower()
+
+    def int_arg(self, name, default=None):
+        # Same leniency as Flask's request.args.get(name, type=int)
+        try:
+            return int(self.args[name])
+        except (KeyError, ValueError):
+            return default
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    body = await _read_body(receive)
+    request = Request(scope, body)
+    handler = ROUTES.get((request.method, request.path))
+    if handler is not None:
+        if not application.started:
+            # Servers without lifespan support start the app on the first request, like Flask does
+            await asyncio.to_thread(application.startup)
+        response = await handler(request)
+        if response is not None:
+            await _send_json(send, *response)
+            return
+    await _call_wsgi(scope, body, receive, send)
+
+
+async def update_metrics(request):
+    logger.info("Received request to update metrics")
+    try:
+        metrics_data = Application.parse_ingest_body(request.body, request.mimetype, request.headers.get("content-encoding"))
+        if isinstance(metrics_data, list):
+            # Frames always hold a list; this endpoint takes exactly one sample
+            if len(metrics_data) != 1:
+                return 400, {"error": "Expected exactly one sample"}, _INGEST_HEADERS
+            metrics_data = metrics_data[0]
+        metrics_dto = MetricsDTO.from_dict(metrics_data)
+        if application.ingest_queue is not None:
+            # Validation may look up an unknown location in the database: not on the loop
+            payload, status = await asyncio.to_thread(application.enqueue_sample, metrics_dto)
+            return status, payload, _INGEST_HEADERS
+        result = (await write_samples([metrics_dto]))[0]
+        if result["status"] != "accepted":
+            return 500, {"error": result["error"]}, _INGEST_HEADERS
+        return 200, {"message": "Metrics updated successfully!"}, _INGEST_HEADERS
+    except QueueFullError as e:
+        logger.warning(f"Rejecting metrics: {str(e)}")
+        return 429, {"error": str(e)}, dict(_INGEST_HEADERS, **{"Retry-After": "1"})
+    except UnsupportedFormatError as e:
+        logger.warning(f"Rejecting ingest body: {e}")
+        return 415, {"error": str(e)}, _INGEST_HEADERS
+    except Exception as e:
+        logger.error(f"Error processing request: {str(e)}")
+        return 500, {"error": str(e)}, _INGEST_HEADERS
+
+
+async def update_metrics_batch(request):
+    logger.info("Received request to update metrics in batch")
+    try:
+        body = Application.parse_ingest_body(request.body, request.mimetype, request.headers.get("content-encoding"))
+        items = body.get("metrics") if isinstance(body, dict) else body
+        if not isinstance(items, list):
+            return 400, {"error": "Expected a JSON array of metrics or {\"metrics\": [...]}"}, _INGEST_HEADERS
+        if len(items) > MAX_BATCH_SIZE:
+            return 413, {"error": f"Batch size {len(items)} exceeds the limit of {MAX_BATCH_SIZE}"}, _INGEST_HEADERS
+
+        metrics_dtos = [MetricsDTO.from_dict(item) if isinstance(item, dict) else None for item in items]
+        if application.ingest_queue is not None:
+            payload, status = await asyncio.to_thread(application.enqueue_batch, metrics_dtos)
+            return status, payload, _INGEST_HEADERS
+        results = await write_samples(metrics_dtos)
+        accepted = sum(1 for result in results if result["status"] == "accepted")
+        logger.info(f"Batch processed: {accepted} accepted, {len(results) - accepted} rejected")
+        return 200, {"accepted": accepted, "rejected": len(results) - accepted, "results": results}, _INGEST_HEADERS
+    except UnsupportedFormatError as e:
+        logger.warning(f"Rejecting ingest body: {e}")
+        return 415, {"error": str(e)}, _INGEST_HEADERS
+    except Exception as e:
+        logger.error(f"Error processing batch request: {str(e)}")
+        return 500, {"error": str(e)}, _INGEST_HEADERS
+
+
+async def write_samples(metrics_dtos):
+    """update_database_batch() on the async engine: one transaction, then after_commit()."""
+    async with db_slots(), create_async_session() as session:
+        with BlockTimer("Async batch write", logger):
+            try:
+                results, device_metric_rows, third_party_rows = await session.run_sync(write_batch, metrics_dtos)
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
+    # The snapshot may look up labels of new series with a blocking query
+    await asyncio.to_thread(after_commit, device_metric_rows, third_party_rows)
+    return results
+
+
+async def device_metrics(request):
+    if any(name in request.args for name in SERIES_ARGS):
+        return None  # Series queries go to Flask
+    limit = min(request.int_arg("limit", 5) or 5, MAX_PAGE_SIZE)
+    page = request.int_arg("page")
+    try:
+        async with db_slots(), create_async_session() as session:
+            rows, next_cursor = await session.run_sync(
+                Application.query_device_metrics, limit,
+                page=page if "cursor" not in request.args else None,
+                cursor=request.args.get("cursor"),
+                device=request.args.get("device"),
+                metric=request.args.get("metric")
+            )
+    except ValueError as e:
+        return 400, {"error": f"Invalid cursor: {str(e)}"}
+    except Exception as e:
+        logger.error(f"Error fetching device metrics: {str(e)}")
+        return 500, {"error": str(e)}
+    if not rows:
+        logger.warning("No device metrics data found.")
+    return 200, {"device_metrics": rows, "next_cursor": next_cursor, "page": page or 1, "limit": limit}
+
+
+async def weather_data(request):
+    data_type = request.args.get("type")
+    if not data_type:
+        return 400, {"error": "Data type is required"}
+    if any(name in request.args for name in SERIES_ARGS):
+        return None
+    try:
+        # Usually a query cache hit; a miss may wait on another request's load, so not on the loop
+        return 200, {"weather_data": await asyncio.to_thread(application.fetch_cached_weather_data, data_type)}
+    except Exception as e:
+        logger.error(f"Error fetching weather data: {str(e)}")
+        return 500, {"error": "Failed to fetch weather data"}
+
+
+async def device_metrics_snapshot(request):
+    entries = await asyncio.to_thread(snapshot_store.device_metrics, request.args.get("device"), request.args.get("metric"))
+    return 200, {"device_metrics": entries}
+
+
+async def weather_data_snapshot(request):
+    data_type = request.args.get("type")
+    if not data_type:
+        return 400, {"error": "Data type is required"}
+    return 200, {"weather_data": await asyncio.to_thread(snapshot_store.third_parties, data_type)}
+
+
+ROUTES = {
+    ("POST", "/api/update_metrics"): update_metrics,
+    ("POST", "/api/update_metrics/batch"): update_metrics_batch,
+    ("GET", "/api/device_metrics"): device_metrics,
+    ("GET", "/api/weather_data"): weather_data,
+    ("GET", "/api/snapshot/device_metrics"): device_metrics_snapshot,
+    ("GET", "/api/snapshot/weather_data"): weather_data_snapshot,
+}
+
+# Agents start with gzip JSON and switch to what ingest responses advertise (RFC 7694)
+_INGEST_HEADERS = {
+    "Accept-Post": f"{FRAME_CONTENT_TYPE}, {JSON_CONTENT_TYPE}",
+    "Accept-Encoding": ", ".join(available_encodings())
+}
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await asyncio.to_thread(application.startup)
+                get_async_engine()  # Fail at startup, not on the first sample, if the async driver is missing
+            except Exception as e:
+                logger.exception("ASGI startup failed")
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await asyncio.to_thread(application.shutdown)
+            await dispose_async_engine()
+            _executor.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    return b"".join(chunks)
+
+
+async def _send_json(send, status, payload, headers=None):
+    body = dumps(payload).encode("utf-8")
+    raw_headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode("latin-1"))]
+    raw_headers.extend((name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in (headers or {}).items())
+    await send({"type": "http.response.start", "status": status, "headers": raw_headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+def _environ(scope, body):
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = f"HTTP_{name}"
+        environ[name] = f"{environ[name]},{value}" if name in environ else value
+    return environ
+
+
+async def _call_wsgi(scope, body, receive, send):
+    """Runs the Flask app for one request on the thread pool, streaming its response back."""
+    loop = asyncio.get_running_loop()
+    disconnected = threading.Event()
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+        return lambda data: send_message({"type": "http.response.body", "body": data, "more_body": True})
+
+    def send_message(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    def respond():
+        result = application.flask_app(_environ(scope, body), start_response)
+        try:
+            sent_start = False
+            for chunk in result:
+                if disconnected.is_set():
+                    break  # Ends /api/stream generators once the client has gone
+                if not sent_start:
+                    send_message({"type": "http.response.start", "status": started["status"], "headers": started["headers"]})
+                    sent_start = True
+                if chunk:
+                    send_message({"type": "http.response.body", "body": chunk, "more_body": True})
+            if not disconnected.is_set():
+                if not sent_start:
+                    send_message({"type": "http.response.start", "status": started["status"], "headers": started["headers"]})
+                send_message({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+
+    async def watch_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        disconnected.set()
+
+    watcher = asyncio.ensure_future(watch_disconnect())
+    try:
+        await loop.run_in_executor(_executor, respond)
+    finally:
+        watcher.cancel()
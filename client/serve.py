@@ -0,0 +1,128 @@
+"""
+Production serving modes for the dashboard and ingest API.
+
+    python client/serve.py                          # gunicorn, WSGI (client/app.py), threaded workers
+    python client/serve.py --asgi                   # uvicorn, ASGI (client/asgi.py), async database driver
+    python client/serve.py --workers 4 --threads 8 --bind 0.0.0.0:5000
+
+`python client/app.py` remains the development server (FLASK_DEBUG=1 for debug mode and auto-reload).
+
+WSGI mode preloads the app in the gunicorn master, which is cheap because importing
+client/app.py makes no database calls and starts no threads, then forks the workers.
+Each worker drops any pooled connections it inherited (dispose_engine) and runs
+Application.startup() itself, so no socket, lock holder or thread crosses a fork.
+Every worker thread handles one request at a time: --threads bounds how many agents
+are served concurrently per worker. A live dashboard stream (/api/stream) keeps its
+thread for as long as it is open, so each worker accepts at most --threads / 4 of
+them (lib_database.live_feed.limit_to_threads) and answers 503 to the next.
+
+ASGI mode runs uvicorn with one event loop per worker process; ingest and page reads
+use the async driver (pip install aiomysql, or aiosqlite for SQLite), so one worker
+keeps thousands of agent connections open. Workers are started fresh, not forked.
+
+The latest-value snapshot and the live feed live in each worker's memory: with
+several workers, /api/snapshot/* and /api/stream only see samples that worker
+ingested since it started. Run one worker (with more threads) when those matter;
+the query cache is shared when it uses the file or redis backend. The hot tier
+would return incomplete series rather than stale ones, so it is turned off
+(HOT_TIER_ENABLED=0) whenever --workers is above 1.
+"""
+import argparse
+import logging
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(REPO_ROOT)
+
+
+def serve_wsgi(bind, workers, threads, connections):
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise RuntimeError("The WSGI serving mode needs gunicorn: pip install gunicorn")
+
+    def post_fork(server, worker):
+        from lib_database.engine import dispose_engine
+        from lib_database.live_feed import live_feed
+        from client.app import appForWSGI
+        dispose_engine()
+        live_feed.limit_to_threads(threads)  # Every open /api/stream holds one of the worker's threads
+        appForWSGI.startup()
+
+    def worker_exit(server, worker):
+        from client.app import appForWSGI
+        appForWSGI.shutdown()  # Flushes the write-behind queue
+
+    class GunicornApplication(BaseApplication):
+        def load_config(self):
+            settings = {
+                "bind": bind,
+                "workers": workers,
+                "threads": threads,
+                "worker_class": "gthread",
+                "worker_connections": connections,
+                "preload_app": True,
+                "post_fork": post_fork,
+                "worker_exit": worker_exit,
+                "accesslog": None,
+            }
+            for key, value in settings.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from client.app import appForWSGI
+            return appForWSGI.flask_app
+
+    GunicornApplication().run()
+
+
+def serve_asgi(bind, workers):
+    try:
+        import uvicorn
+    except ImportError:
+        raise RuntimeError("The ASGI serving mode needs uvicorn: pip install uvicorn")
+    from lib_database.engine import async_url
+
+    # Fail now, with a pip hint, rather than in every worker
+    async_url(os.environ.get("DATABASE_URL", ""))
+    host, _, port = bind.rpartition(":")
+    uvicorn.run(
+        "client.asgi:app", host=host or "0.0.0.0", port=int(port), workers=workers,
+        lifespan="on", access_log=False, app_dir=REPO_ROOT
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--asgi", action="store_true", help="serve client/asgi.py with uvicorn")
+    parser.add_argument("--bind", default=os.getenv("BIND", "0.0.0.0:5000"))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", 1)))
+    parser.add_argument(
+        "--threads", type=int, default=int(os.getenv("WEB_THREADS", 32)),
+        help="WSGI threads per worker; each open /api/stream holds one, so at most a quarter of them "
+             "serve live streams (503 beyond that) and the rest stay free for ingest"
+    )
+    parser.add_argument("--connections", type=int, default=1000, help="WSGI open connections per worker")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.workers > 1:
+        # Each worker's hot tier would only hold the samples that worker ingested
+        os.environ.setdefault("HOT_TIER_ENABLED", "0")
+    if not os.getenv("DATABASE_URL"):
+        logging.error("DATABASE_URL is not set")
+        return 1
+    try:
+        if args.asgi:
+            serve_asgi(args.bind, args.workers)
+        else:
+            serve_wsgi(args.bind, args.workers, args.threads, args.connections)
+    except RuntimeError as e:
+        logging.error(str(e))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
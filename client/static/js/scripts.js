@@ -7,6 +7,11 @@ document.addEventListener('DOMContentLoaded', function() {
     const lastUpdatedTime = "{{ last_updated_time }}";
     let currentPage = 1;
     const limit = 5;
+    // Keyset cursors: pageCursors[n] is the cursor that fetches page n (page 1 needs none)
+    let pageCursors = {1: null};
+    // Rows currently in the device metrics table; live updates are merged into page 1
+    let displayedMetrics = [];
+    let liveStream = null;
 
     updateLastUpdatedTime(lastUpdatedTime);
 
@@ -274,9 +279,13 @@ document.addEventListener('DOMContentLoaded', function() {
     
 
     function fetchMetrics(page, limit) {
-        fetch(`/api/device_metrics?page=${page}&limit=${limit}`)
+        const cursor = pageCursors[page];
+        const cursorParam = cursor ? `&cursor=${encodeURIComponent(cursor)}` : '';
+        fetch(`/api/device_metrics?limit=${limit}${cursorParam}`)
             .then(response => response.json())
             .then(data => {
+                pageCursors[page + 1] = data.next_cursor;
+                displayedMetrics = data.device_metrics;
                 updateDeviceMetricsTable(data.device_metrics);
                 updateGaugesAndHistograms(data.device_metrics);
                 document.getElementById('currentPage').innerText = page;
@@ -297,20 +306,57 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 
     window.changePage = function(direction) {
-        currentPage += direction;
-        if (currentPage < 1) currentPage = 1;
+        const nextPage = Math.max(1, currentPage + direction);
+        // No cursor means the previous page was the last one
+        if (!(nextPage in pageCursors) || (nextPage > 1 && !pageCursors[nextPage])) return;
+        currentPage = nextPage;
         fetchMetrics(currentPage, limit);
     };
 
     document.getElementById('weatherTypeDropdown').addEventListener('change', async function (event) {
         const weatherType = event.target.value;
-        const response = await fetch(`/api/weather_data?type=${weatherType}`);
+        const response = await fetch(`/api/snapshot/weather_data?type=${weatherType}`);
         const data = await response.json();
 
         weatherDataCache[weatherType] = data.weather_data;
         updateMap(weatherType);
+        if (liveStream) openLiveStream(weatherType);
     });
 
+    function mergeLiveMetrics(metrics) {
+        // Only the newest page changes when samples arrive
+        if (currentPage !== 1) return;
+        const seen = new Set();
+        displayedMetrics = metrics.concat(displayedMetrics)
+            .filter(metric => {
+                const key = `${metric.device_name}|${metric.metric_name}|${metric.timestamp}`;
+                if (seen.has(key)) return false;
+                seen.add(key);
+                return true;
+            })
+            .sort((a, b) => new Date(b.timestamp) - new Date(a.timestamp))
+            .slice(0, limit);
+        updateDeviceMetricsTable(displayedMetrics);
+        updateGaugesAndHistograms(displayedMetrics);
+    }
+
+    function mergeLiveWeather(weatherType, entries) {
+        const byName = {};
+        (weatherDataCache[weatherType] || []).forEach(entry => byName[entry.name] = entry);
+        entries.forEach(entry => byName[entry.name] = entry);
+        weatherDataCache[weatherType] = Object.values(byName);
+        updateMap(weatherType);
+    }
+
+    // Push channel: the server sends current values, then each new sample as it is stored
+    function openLiveStream(weatherType) {
+        if (liveStream) liveStream.close();
+        liveStream = new EventSource(`/api/stream?weather=${encodeURIComponent(weatherType)}`);
+        liveStream.addEventListener('device_metrics', event => mergeLiveMetrics(JSON.parse(event.data)));
+        liveStream.addEventListener('weather_data', event => mergeLiveWeather(weatherType, JSON.parse(event.data)));
+        liveStream.onerror = () => console.warn('Live stream interrupted; the browser will reconnect.');
+    }
+
     fetchMetrics(currentPage, limit);
 
     console.log("Hiding loading screen and showing content.");
@@ -319,6 +365,12 @@ document.addEventListener('DOMContentLoaded', function() {
 
     document.getElementsByClassName("tablink")[0].click();
 
+    if (window.EventSource) {
+        openLiveStream(document.getElementById('weatherTypeDropdown').value);
+        return;
+    }
+
+    // Browsers without EventSource fall back to polling
     // Fetch device metrics every 5 seconds
     setInterval(() => {
         fetchMetrics(currentPage, limit);
@@ -327,7 +379,7 @@ document.addEventListener('DOMContentLoaded', function() {
     // Fetch weather data every 10 minutes
     setInterval(() => {
         const weatherType = document.getElementById('weatherTypeDropdown').value;
-        fetch(`/api/weather_data?type=${weatherType}`)
+        fetch(`/api/snapshot/weather_data?type=${weatherType}`)
             .then(response => response.json())
             .then(data => {
                 weatherDataCache[weatherType] = data.weather_data;
@@ -1,19 +1,30 @@
+from lib_utils.wire_format import compress, decompress, decode_samples, encode_samples
+
 class MetricsDTO:
-    def __init__(self, device_id, device_name, cpu_usage, ram_usage, weather_and_air_quality_data):
+    def __init__(self, device_id, device_name, cpu_usage, ram_usage, weather_and_air_quality_data, timestamp=None, sample_id=None, metrics=None):
         self.device_id = device_id
         self.device_name = device_name
         self.cpu_usage = cpu_usage
         self.ram_usage = ram_usage
         self.weather_and_air_quality_data = weather_and_air_quality_data  # List of third-party data
+        self.timestamp = timestamp  # Optional ISO-8601 sample time, set by agents that buffer samples
+        self.sample_id = sample_id  # Optional agent-generated ID that makes re-sent samples idempotent
+        self.metrics = metrics or []  # Any other device metrics: [{"name", "value", "timestamp"}]
 
     def to_dict(self):
-        return {
+        data = {
             "device_id": self.device_id,
             "device_name": self.device_name,
             "cpu_usage": self.cpu_usage,
             "ram_usage": self.ram_usage,
+            "metrics": self.metrics,
             "weather_and_air_quality_data": self.weather_and_air_quality_data  # Include third-party data
         }
+        if self.timestamp is not None:
+            data["timestamp"] = self.timestamp
+        if self.sample_id is not None:
+            data["sample_id"] = self.sample_id
+        return data
 
     @staticmethod
     def from_dict(data):
@@ -22,6 +33,29 @@ class MetricsDTO:
             device_name=data.get("device_name"),
             cpu_usage=data.get("cpu_usage"),
             ram_usage=data.get("ram_usage"),
-            weather_and_air_quality_data=data.get("weather_and_air_quality_data", [])  # Default to empty list
+            weather_and_air_quality_data=data.get("weather_and_air_quality_data", []),  # Default to empty list
+            timestamp=data.get("timestamp"),
+            sample_id=data.get("sample_id"),
+            metrics=data.get("metrics", [])
         )
 
+    def to_bytes(self, encoding="gzip"):
+        """This sample as a compressed binary frame (see lib_utils.wire_format)."""
+        return MetricsDTO.list_to_bytes([self], encoding)
+
+    @staticmethod
+    def from_bytes(body, encoding="gzip"):
+        """Inverse of to_bytes(); raises ValueError unless `body` holds exactly one sample."""
+        dtos = MetricsDTO.list_from_bytes(body, encoding)
+        if len(dtos) != 1:
+            raise ValueError(f"Expected one sample, got {len(dtos)}")
+        return dtos[0]
+
+    @staticmethod
+    def list_to_bytes(dtos, encoding="gzip"):
+        """A batch of samples as one compressed frame; raises ValueError if a sample cannot be framed."""
+        return compress(encode_samples([dto.to_dict() for dto in dtos]), encoding)
+
+    @staticmethod
+    def list_from_bytes(body, encoding="gzip"):
+        return [MetricsDTO.from_dict(sample) for sample in decode_samples(decompress(body, encoding))]
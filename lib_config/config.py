@@ -1,9 +1,48 @@
 import json
+import logging
 import os
+import threading
+import time
+
+CONFIG_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '../config.json'))
 
 def load_config():
-    config_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../config.json'))
+    config_path = CONFIG_PATH
     print(f"Loading configuration from: {config_path}")  # Add this line to print the path
     with open(config_path, 'r') as config_file:
         config = json.load(config_file)
-    return config
\ No newline at end of file
+    return config
+
+class ConfigWatcher:
+    """Returns config.json as it is now, re-reading it when the file changes.
+
+    The file's modification time is checked at most every `check_seconds`; an
+    unreadable or half-written file keeps the previous configuration.
+    """
+
+    def __init__(self, path=CONFIG_PATH, check_seconds=5):
+        self.path = path
+        self.check_seconds = check_seconds
+        self._lock = threading.Lock()
+        self._config = load_config() if path == CONFIG_PATH else self._read()
+        self._modified = os.stat(path).st_mtime_ns
+        self._checked_at = time.monotonic()
+
+    def get(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._checked_at >= self.check_seconds:
+                self._checked_at = now
+                try:
+                    modified = os.stat(self.path).st_mtime_ns
+                    if modified != self._modified:
+                        self._config = self._read()
+                        self._modified = modified
+                        logging.info(f"Reloaded configuration from {self.path}")
+                except (OSError, ValueError) as e:
+                    logging.warning(f"Keeping the previous configuration, could not reload {self.path}: {e}")
+            return self._config
+
+    def _read(self):
+        with open(self.path, 'r') as config_file:
+            return json.load(config_file)
@@ -0,0 +1,364 @@
+"""
+Bulk export and import of raw device metrics and third-party data.
+
+Exports stream a time range (optionally limited to some metric names) straight from
+a server-side cursor in chunks, so memory stays bounded whatever the range; imports
+read a file chunk by chunk and write each with multi-row INSERTs, bypassing the
+per-sample HTTP path entirely. Row UUIDs travel with the data, so re-importing a
+file skips rows that already exist.
+
+Two formats:
+
+    csv       header row plus one line per sample
+    columnar  typed-array binary format, several times smaller than CSV and far
+              cheaper to parse:
+
+        file    := b"SMCOL1\\n" uint32 header_length header_json chunk* uint32 0
+        chunk   := uint32 length zlib(uint32 row_count column*)
+        column  := float64 / timestamp: row_count little-endian doubles / int64 microseconds since epoch
+                   uuid: row_count x 16 raw bytes
+                   string: uint32 length JSON list of distinct values, then row_count uint32 indexes
+
+Usage:
+
+    python lib_database/bulk_io.py export --kind device --from 2025-01-01 --to 2026-01-01 --output device.smcol
+    python lib_database/bulk_io.py import --input device.smcol
+"""
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import struct
+import sys
+import uuid
+import zlib
+from array import array
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import Device, DeviceMetric, Metric, ThirdParty, ThirdPartyType
+from lib_database.engine import get_engine, create_session
+from lib_database.lookup_cache import lookup_cache
+from lib_database.update_database import insert_rows
+from lib_database.rollups import rebuild_by_day
+from lib_database.snapshot import snapshot_store
+from lib_database.hot_tier import hot_tier
+from lib_database.query_cache import query_cache
+from lib_utils.blocktimer import BlockTimer
+
+# Rows fetched from the cursor, encoded and written per chunk
+CHUNK_SIZE = 50000
+
+MAGIC = b"SMCOL1\n"
+FORMATS = ("csv", "columnar")
+
+# Exported columns per kind, with their columnar type
+COLUMNS = {
+    "device": [
+        ("uuid", "uuid"), ("device_name", "string"), ("metric_name", "string"),
+        ("value", "float64"), ("timestamp", "timestamp")
+    ],
+    "third_party": [
+        ("uuid", "uuid"), ("type_name", "string"), ("latitude", "float64"), ("longitude", "float64"),
+        ("location_name", "string"), ("value", "float64"), ("timestamp", "timestamp")
+    ]
+}
+# Third-party exports written before ThirdParty.name was dropped; still importable
+_THIRD_PARTY_COLUMNS_V1 = COLUMNS["third_party"][:5] + [("name", "string")] + COLUMNS["third_party"][5:]
+
+_EPOCH = datetime(1970, 1, 1)
+_LITTLE_ENDIAN = sys.byteorder == "little"
+
+
+def _export_statement(kind, start, end, metric_names):
+    if kind == "device":
+        statement = select(
+            DeviceMetric.uuid, Device.name, Metric.name, DeviceMetric.value, DeviceMetric.timestamp
+        ).join(Device, DeviceMetric.device_id == Device.uuid).join(Metric, DeviceMetric.metric_id == Metric.uuid).where(
+            DeviceMetric.timestamp >= start, DeviceMetric.timestamp < end
+        ).order_by(DeviceMetric.timestamp)
+        if metric_names:
+            statement = statement.where(Metric.name.in_(metric_names))
+        return statement
+
+    statement = select(
+        ThirdParty.uuid, ThirdPartyType.name, ThirdPartyType.latitude, ThirdPartyType.longitude,
+        ThirdPartyType.location_name, ThirdParty.value, ThirdParty.timestamp
+    ).join(ThirdPartyType, ThirdParty.thirdparty_id == ThirdPartyType.uuid).where(
+        ThirdParty.timestamp >= start, ThirdParty.timestamp < end
+    ).order_by(ThirdParty.timestamp)
+    if metric_names:
+        statement = statement.where(ThirdPartyType.name.in_(metric_names))
+    return statement
+
+
+def export_chunks(kind, start, end, metric_names=None, chunk_size=CHUNK_SIZE):
+    """Yields lists of up to `chunk_size` row tuples (in COLUMNS[kind] order) from a server-side cursor."""
+    if kind not in COLUMNS:
+        raise ValueError(f"Unknown kind: {kind}")
+    with get_engine().connect() as connection:
+        result = connection.execution_options(stream_results=True, max_row_buffer=chunk_size).execute(
+            _export_statement(kind, start, end, metric_names)
+        )
+        for chunk in result.partitions(chunk_size):
+            yield [tuple(row) for row in chunk]
+
+
+def encode(kind, chunks, output_format):
+    """Yields the bytes of an export file, one piece per chunk."""
+    if output_format == "csv":
+        yield from _encode_csv(kind, chunks)
+    elif output_format == "columnar":
+        yield from _encode_columnar(kind, chunks)
+    else:
+        raise ValueError(f"Unknown format: {output_format}")
+
+
+def _encode_csv(kind, chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in COLUMNS[kind]])
+    for chunk in chunks:
+        for row in chunk:
+            writer.writerow(value.isoformat() if isinstance(value, datetime) else value for value in row)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+def _encode_columnar(kind, chunks):
+    header = json.dumps({"kind": kind, "columns": COLUMNS[kind]}).encode("utf-8")
+    yield MAGIC + struct.pack("<I", len(header)) + header
+    for chunk in chunks:
+        if not chunk:
+            continue
+        body = [struct.pack("<I", len(chunk))]
+        for index, (_, column_type) in enumerate(COLUMNS[kind]):
+            body.append(_encode_column(column_type, [row[index] for row in chunk]))
+        block = zlib.compress(b"".join(body), 6)
+        yield struct.pack("<I", len(block)) + block
+    yield struct.pack("<I", 0)
+
+
+def _encode_column(column_type, values):
+    if column_type == "float64":
+        return _array_bytes(array("d", (float(value) for value in values)))
+    if column_type == "timestamp":
+        return _array_bytes(array("q", (
+            (value - _EPOCH) // timedelta(microseconds=1) for value in values
+        )))
+    if column_type == "uuid":
+        return b"".join(uuid.UUID(value).bytes for value in values)
+    # Strings are dictionary-encoded: names repeat on nearly every row
+    dictionary = {}
+    indexes = array("I", (dictionary.setdefault(value, len(dictionary)) for value in values))
+    encoded = json.dumps(list(dictionary)).encode("utf-8")
+    return struct.pack("<I", len(encoded)) + encoded + _array_bytes(indexes)
+
+
+def _array_bytes(values):
+    if not _LITTLE_ENDIAN:
+        values.byteswap()
+    return values.tobytes()
+
+
+def decode(stream):
+    """Yields (kind, chunk) pairs from a CSV or columnar export read from the binary `stream`."""
+    if stream.read(len(MAGIC)) == MAGIC:
+        yield from _decode_columnar(stream)
+    else:
+        stream.seek(0)
+        yield from _decode_csv(io.TextIOWrapper(stream, encoding="utf-8", newline=""))
+
+
+def _decode_columnar(stream):
+    header = json.loads(stream.read(struct.unpack("<I", stream.read(4))[0]))
+    kind, columns = header["kind"], header["columns"]
+    while True:
+        length = struct.unpack("<I", stream.read(4))[0]
+        if length == 0:
+            return
+        body = memoryview(zlib.decompress(stream.read(length)))
+        row_count = struct.unpack_from("<I", body)[0]
+        offset = 4
+        decoded = []
+        for _, column_type in columns:
+            values, offset = _decode_column(column_type, body, offset, row_count)
+            decoded.append(values)
+        yield kind, list(zip(*decoded))
+
+
+def _decode_column(column_type, body, offset, row_count):
+    if column_type in ("float64", "timestamp"):
+        values = _read_array("d" if column_type == "float64" else "q", body, offset, row_count)
+        offset += 8 * row_count
+        if column_type == "timestamp":
+            return [_EPOCH + timedelta(microseconds=value) for value in values], offset
+        return values.tolist(), offset
+    if column_type == "uuid":
+        end = offset + 16 * row_count
+        # Hex the whole column once; building uuid.UUID objects per row costs several times more
+        digits = bytes(body[offset:end]).hex()
+        return [
+            f"{digits[i:i + 8]}-{digits[i + 8:i + 12]}-{digits[i + 12:i + 16]}-{digits[i + 16:i + 20]}-{digits[i + 20:i + 32]}"
+            for i in range(0, len(digits), 32)
+        ], end
+    length = struct.unpack_from("<I", body, offset)[0]
+    dictionary = json.loads(bytes(body[offset + 4:offset + 4 + length]))
+    offset += 4 + length
+    indexes = _read_array("I", body, offset, row_count)
+    return [dictionary[index] for index in indexes], offset + indexes.itemsize * row_count
+
+
+def _read_array(typecode, body, offset, row_count):
+    values = array(typecode)
+    values.frombytes(body[offset:offset + values.itemsize * row_count])
+    if not _LITTLE_ENDIAN:
+        values.byteswap()
+    return values
+
+
+def _decode_csv(text_stream):
+    reader = csv.reader(text_stream)
+    names = next(reader)
+    known = list(COLUMNS.items()) + [("third_party", _THIRD_PARTY_COLUMNS_V1)]
+    kind, columns = next(((kind, columns) for kind, columns in known if [name for name, _ in columns] == names), (None, None))
+    if kind is None:
+        raise ValueError(f"CSV header does not match a known export: {names}")
+    types = [column_type for _, column_type in columns]
+    chunk = []
+    for record in reader:
+        chunk.append(tuple(_parse_csv_value(column_type, value) for column_type, value in zip(types, record)))
+        if len(chunk) >= CHUNK_SIZE:
+            yield kind, chunk
+            chunk = []
+    if chunk:
+        yield kind, chunk
+
+
+def _parse_csv_value(column_type, value):
+    if column_type == "float64":
+        return float(value)
+    if column_type == "timestamp":
+        return datetime.fromisoformat(value)
+    return value if value != "" else None
+
+
+def export_to_file(path, kind, start, end, metric_names=None, output_format="columnar"):
+    """Writes an export file and returns the number of rows written."""
+    rows = 0
+
+    def counted(chunks):
+        nonlocal rows
+        for chunk in chunks:
+            rows += len(chunk)
+            yield chunk
+
+    with BlockTimer("Exporting rows", logging.getLogger(__name__), labels={"kind": kind}), open(path, "wb") as output:
+        for piece in encode(kind, counted(export_chunks(kind, start, end, metric_names)), output_format):
+            output.write(piece)
+    return rows
+
+
+def import_file(path, rebuild_rollups=True):
+    """Imports a CSV or columnar export, one transaction per chunk. Returns {"kind", "rows", "from", "to"}.
+
+    Devices, metrics and third-party types missing from this database are created.
+    Rollups for the imported time range are rebuilt once at the end, unless
+    `rebuild_rollups` is false (then run `rollups.py --backfill-days` later).
+    """
+    kind = None
+    rows = 0
+    first = last = None
+    with BlockTimer("Importing file", logging.getLogger(__name__)), open(path, "rb") as stream:
+        for kind, chunk in decode(stream):
+            with create_session() as session:
+                try:
+                    device_rows, third_party_rows = _import_rows(session, kind, chunk)
+                    model = DeviceMetric if kind == "device" else ThirdParty
+                    insert_rows(session, model, device_rows or third_party_rows, ignore_duplicates=True)
+                    session.commit()
+                except Exception:
+                    session.rollback()
+                    raise
+            snapshot_store.update(device_rows, third_party_rows)
+            hot_tier.add(device_rows, third_party_rows)
+            rows += len(chunk)
+            chunk_first, chunk_last = min(row[-1] for row in chunk), max(row[-1] for row in chunk)
+            first = chunk_first if first is None else min(first, chunk_first)
+            last = chunk_last if last is None else max(last, chunk_last)
+            logging.info(f"Imported {rows} {kind} rows")
+
+    if rows:
+        if rebuild_rollups:
+            rebuild_by_day(kind, first, last + timedelta(microseconds=1))
+        if kind == "third_party":
+            query_cache.invalidate("weather_data")
+    return {"kind": kind, "rows": rows, "from": first, "to": last}
+
+
+def _import_rows(session, kind, chunk):
+    """Insert rows for one chunk, resolving names to this database's IDs."""
+    # Resolve each distinct name once per chunk rather than once per row
+    if kind == "device":
+        device_ids = {name: lookup_cache.device_id(session, name) for name in {row[1] for row in chunk}}
+        metric_ids = {name: lookup_cache.metric_id(session, name, create=True) for name in {row[2] for row in chunk}}
+        return [{
+            "uuid": row_id,
+            "device_id": device_ids[device_name],
+            "metric_id": metric_ids[metric_name],
+            "value": value,
+            "timestamp": timestamp
+        } for row_id, device_name, metric_name, value, timestamp in chunk], []
+
+    type_ids = {}
+    for _, type_name, latitude, longitude, location_name, *_ in chunk:
+        key = (type_name, latitude, longitude)
+        if key not in type_ids:
+            type_ids[key] = lookup_cache.third_party_type_id(session, *key, location_name=location_name) or \
+                _create_third_party_type(session, type_name, latitude, longitude, location_name)
+    return [], [{
+        "uuid": row_id,
+        "thirdparty_id": type_ids[(type_name, latitude, longitude)],
+        "value": value,
+        "timestamp": timestamp
+    } for row_id, type_name, latitude, longitude, location_name, *_, value, timestamp in chunk]
+
+
+def _create_third_party_type(session, name, latitude, longitude, location_name):
+    type_id = str(uuid.uuid4())
+    with create_session() as create:
+        create.add(ThirdPartyType(uuid=type_id, name=name, latitude=latitude, longitude=longitude, location_name=location_name))
+        create.commit()
+    logging.info(f"New third_party_types row added: {name} ({latitude}, {longitude}) with ID: {type_id}")
+    return lookup_cache.third_party_type_id(session, name, latitude, longitude)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Bulk export/import of raw metrics.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export")
+    export_parser.add_argument("--kind", choices=list(COLUMNS), default="device")
+    export_parser.add_argument("--from", dest="start", type=datetime.fromisoformat, required=True)
+    export_parser.add_argument("--to", dest="end", type=datetime.fromisoformat, default=datetime.utcnow())
+    export_parser.add_argument("--metric", action="append", help="metric or third-party type name; repeatable")
+    export_parser.add_argument("--format", choices=FORMATS, default="columnar")
+    export_parser.add_argument("--output", required=True)
+    import_parser = commands.add_parser("import")
+    import_parser.add_argument("--input", required=True)
+    import_parser.add_argument("--skip-rollups", action="store_true", help="leave rollups for a later backfill")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        count = export_to_file(args.output, args.kind, args.start, args.end, args.metric, args.format)
+        print(f"Exported {count} {args.kind} rows to {args.output}")
+    else:
+        result = import_file(args.input, rebuild_rollups=not args.skip_rollups)
+        print(f"Imported {result['rows']} {result['kind']} rows from {args.input}")
@@ -0,0 +1,198 @@
+"""
+Single, lazily created SQLAlchemy engine shared by every module in the process.
+
+Nothing connects at import time: the engine is built on the first get_engine() /
+create_session() call, from DATABASE_URL plus these optional environment variables:
+
+    DB_POOL_SIZE       connections kept open per process (default 5)
+    DB_MAX_OVERFLOW    extra connections allowed under burst (default 10)
+    DB_POOL_TIMEOUT    seconds to wait for a free connection (default 30)
+    DB_POOL_RECYCLE    seconds before a connection is replaced (default 280, under
+                       MySQL/PythonAnywhere's 300s idle timeout)
+    DB_POOL_PRE_PING   "0" to skip the liveness check on checkout (default on)
+
+pool_stats() reports checkout latency and how often the pool ran dry.
+
+get_async_engine() / create_async_session() give the ASGI app (client/asgi.py) an
+asyncio engine on the same database and pool settings. It needs the backend's async
+driver (aiomysql for MySQL, aiosqlite for SQLite), imported only when first used.
+"""
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+
+# Async driver for each backend, used by get_async_engine()
+ASYNC_DRIVERS = {"mysql": "aiomysql", "sqlite": "aiosqlite"}
+
+_lock = threading.Lock()
+_engine = None
+_session_factory = None
+_async_engine = None
+_async_session_factory = None
+_stats_lock = threading.Lock()
+_stats = {"checkouts": 0, "checkout_seconds_total": 0.0, "max_checkout_seconds": 0.0, "exhausted": 0, "timeouts": 0}
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited and whether the pool was exhausted."""
+
+    def _do_get(self):
+        exhausted = self.checkedin() == 0 and self._max_overflow > -1 and self.overflow() >= self._max_overflow
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            with _stats_lock:
+                _stats["timeouts"] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with _stats_lock:
+                _stats["checkouts"] += 1
+                _stats["checkout_seconds_total"] += elapsed
+                _stats["max_checkout_seconds"] = max(_stats["max_checkout_seconds"], elapsed)
+                if exhausted:
+                    _stats["exhausted"] += 1
+
+
+def _engine_options(url):
+    """Pool and driver options appropriate for the backend in `url`."""
+    backend = make_url(url).get_backend_name()
+    if backend == "sqlite":
+        # SQLite uses its own file/thread pools; pool sizing does not apply
+        return {}
+    options = {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": int(os.getenv("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 10)),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", 30)),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", 280)),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "1") != "0"
+    }
+    if backend == "mysql":
+        options["connect_args"] = {"connect_timeout": 60}
+    return options
+
+
+def _build_engine(url, options):
+    global _engine, _session_factory
+    url = url or os.getenv("DATABASE_URL")
+    if not url:
+        raise RuntimeError("DATABASE_URL is not set")
+    engine = create_engine(url, **dict(_engine_options(url), **options))
+    previous, _engine = _engine, engine
+    _session_factory = sessionmaker(bind=engine)
+    logging.info(f"Database engine created for {engine.url.get_backend_name()} ({engine.pool.__class__.__name__})")
+    return previous
+
+
+def configure_engine(url=None, **options):
+    """Replaces the shared engine, e.g. to point scripts and benchmarks at another database.
+
+    Keyword options override the defaults from _engine_options().
+    """
+    with _lock:
+        previous = _build_engine(url, options)
+    if previous is not None:
+        previous.dispose()
+    return _engine
+
+
+def get_engine():
+    """Returns the shared engine, creating it on first use."""
+    if _engine is None:
+        with _lock:
+            if _engine is None:
+                _build_engine(None, {})
+    return _engine
+
+
+def create_session():
+    """Opens a new Session on the shared engine."""
+    get_engine()
+    return _session_factory()
+
+
+def dispose_engine():
+    """Drops pooled connections inherited from the parent; call in each worker after a pre-fork server forks.
+
+    The connections are abandoned rather than closed, so the parent's sockets are left
+    alone, and the async engine (bound to the parent's event loop) is rebuilt on next use.
+    """
+    global _async_engine, _async_session_factory
+    if _engine is not None:
+        try:
+            _engine.dispose(close=False)
+        except TypeError:
+            # SQLAlchemy before 1.4.33: what dispose(close=False) does
+            _engine.pool = _engine.pool.recreate()
+    _async_engine = None
+    _async_session_factory = None
+
+
+def async_url(url):
+    """`url` with the backend's async driver, e.g. mysql+pymysql:// becomes mysql+aiomysql://."""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    driver = ASYNC_DRIVERS.get(backend)
+    if driver is None:
+        raise RuntimeError(f"No async driver is known for {backend} databases")
+    try:
+        __import__(driver)
+    except ImportError:
+        raise RuntimeError(f"The async database engine needs the {driver} package: pip install {driver}")
+    return url.set(drivername=f"{backend}+{driver}")
+
+
+def get_async_engine():
+    """Returns the shared AsyncEngine, creating it on first use. Call from the event loop that uses it."""
+    global _async_engine, _async_session_factory
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+        url = get_engine().url  # Before taking the lock: get_engine() may need it
+        with _lock:
+            if _async_engine is None:
+                options = _engine_options(url)
+                # Async engines need an asyncio-aware pool; keep the sizing, not the class
+                options.pop("poolclass", None)
+                _async_engine = create_async_engine(async_url(url), **options)
+                _async_session_factory = sessionmaker(bind=_async_engine, class_=AsyncSession, expire_on_commit=False)
+                logging.info(f"Async database engine created for {_async_engine.url.drivername}")
+    return _async_engine
+
+
+def create_async_session():
+    """Opens a new AsyncSession on the shared async engine."""
+    get_async_engine()
+    return _async_session_factory()
+
+
+async def dispose_async_engine():
+    """Closes the async engine's connections, on the event loop that opened them."""
+    global _async_engine, _async_session_factory
+    engine, _async_engine, _async_session_factory = _async_engine, None, None
+    if engine is not None:
+        await engine.dispose()
+
+
+def pool_stats():
+    """Returns checkout latency/exhaustion counters plus the pool's current occupancy."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["avg_checkout_seconds"] = stats["checkout_seconds_total"] / stats["checkouts"] if stats["checkouts"] else 0.0
+    if _engine is not None and isinstance(_engine.pool, QueuePool):
+        stats.update(
+            pool_size=_engine.pool.size(),
+            checked_in=_engine.pool.checkedin(),
+            checked_out=_engine.pool.checkedout(),
+            overflow=_engine.pool.overflow()
+        )
+    return stats
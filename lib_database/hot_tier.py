@@ -0,0 +1,361 @@
+"""
+Hot tier: the last few hours of every series in memory, in fixed-size NumPy ring buffers.
+
+Dashboards mostly ask for recent data. query_series() answers a from/to/resolution
+request whose whole range lies inside the tier with vectorised per-bucket mean, min,
+max, last and, optionally, percentiles; for anything older it returns None and the
+caller reads rollups from the database as before.
+
+Each series, (device, metric) or ThirdPartyType, gets `points_per_series` slots of a
+timestamp (int64 microseconds) and a value (float64), so memory is bounded by
+max_series * points_per_series * 16 bytes; stats() reports the actual and bound
+figures. A full buffer overwrites its oldest point, and once there are `max_series`
+series the least recently updated one is evicted. A sample with the timestamp and
+value of one already held is a re-sent duplicate (the database ignored it too) and
+is skipped.
+
+The tier is fed with the rows every ingest path commits and warmed at startup with the
+last `window_hours` of raw rows. It only answers for ranges it holds every sample of:
+from the start of the warm-up window (or from configure() if warming failed), from a
+series' oldest point once its buffer has wrapped, and after the newest point of any
+evicted series. It sees this process's ingest only, so it is opt-in: set
+`enabled` (or HOT_TIER_ENABLED=1) only when a single server process writes to the
+database. client/serve.py forces it off whenever --workers is above 1.
+
+numpy is only imported when the tier is enabled.
+"""
+import logging
+import os
+import sys
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib_database.rollups import HOUR, KINDS, bucket_start
+from lib_utils.blocktimer import BlockTimer
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+# Bytes held per point: an int64 timestamp and a float64 value
+POINT_BYTES = 16
+
+
+def micros(timestamp):
+    """Naive UTC datetime -> integer microseconds since the epoch."""
+    return (timestamp - _EPOCH) // _MICROSECOND
+
+
+def percentile_name(q):
+    """Response field for percentile `q`: 95 -> "p95", 99.9 -> "p99.9"."""
+    return f"p{q:g}"
+
+
+class _RingBuffer:
+    """One series: parallel timestamp/value arrays in time order, starting at `start` and wrapping."""
+
+    __slots__ = ("times", "values", "start", "size", "covered_from", "newest")
+
+    def __init__(self, np, capacity):
+        self.times = np.empty(capacity, dtype=np.int64)
+        self.values = np.empty(capacity, dtype=np.float64)
+        self.start = 0
+        self.size = 0
+        self.covered_from = 0  # Samples before this timestamp may have been dropped
+        self.newest = None  # (timestamp, value) of the last point, kept as Python numbers for append()
+
+    def append(self, np, timestamp, value):
+        """Adds one sample; returns "appended", "duplicate" or "late" (inserted out of order)."""
+        newest = self.newest
+        if newest is not None:
+            if timestamp == newest[0] and value == newest[1]:
+                return "duplicate"
+            if timestamp < newest[0]:
+                return self._insert(np, timestamp, value)
+        capacity = len(self.times)
+        end = (self.start + self.size) % capacity
+        self.times[end] = timestamp
+        self.values[end] = value
+        self.newest = (timestamp, value)
+        if self.size < capacity:
+            self.size += 1
+        else:
+            self.start = (self.start + 1) % capacity
+            self.covered_from = max(self.covered_from, int(self.times[self.start]))
+        return "appended"
+
+    def merge(self, np, times, values):
+        """Adds many samples in any order (warm-up); duplicates of held timestamps are skipped."""
+        held_times, held_values = self.window(np, None, None)
+        all_times = np.concatenate((held_times, times))
+        all_values = np.concatenate((held_values, values))
+        order = np.lexsort((all_values, all_times))
+        all_times, all_values = all_times[order], all_values[order]
+        keep = np.ones(len(all_times), dtype=bool)
+        keep[1:] = (all_times[1:] != all_times[:-1]) | (all_values[1:] != all_values[:-1])
+        self._replace(all_times[keep], all_values[keep])
+
+    def window(self, np, low, high):
+        """Copies of the timestamps and values in [low, high); None means unbounded."""
+        capacity = len(self.times)
+        end = self.start + self.size
+        segments = [(self.start, min(end, capacity))]
+        if end > capacity:
+            segments.append((0, end - capacity))
+        times, values = [], []
+        for first, last in segments:
+            segment = self.times[first:last]
+            lo = first + (int(np.searchsorted(segment, low, "left")) if low is not None else 0)
+            hi = first + (int(np.searchsorted(segment, high, "left")) if high is not None else len(segment))
+            if hi > lo:
+                times.append(self.times[lo:hi])
+                values.append(self.values[lo:hi])
+        if not times:
+            return self.times[:0].copy(), self.values[:0].copy()
+        return np.concatenate(times), np.concatenate(values)
+
+    def _insert(self, np, timestamp, value):
+        times, values = self.window(np, None, None)
+        first = int(np.searchsorted(times, timestamp, "left"))
+        index = int(np.searchsorted(times, timestamp, "right"))
+        if (values[first:index] == value).any():
+            return "duplicate"
+        self._replace(np.insert(times, index, timestamp), np.insert(values, index, value))
+        return "late"
+
+    def _replace(self, times, values):
+        """Stores sorted `times`/`values`, keeping the newest `capacity` points."""
+        capacity = len(self.times)
+        if len(times) > capacity:
+            times, values = times[-capacity:], values[-capacity:]
+            self.covered_from = max(self.covered_from, int(times[0]))
+        self.times[:len(times)] = times
+        self.values[:len(values)] = values
+        self.start = 0
+        self.size = len(times)
+        self.newest = (int(times[-1]), float(values[-1])) if len(times) else None
+
+
+class HotTier:
+    """Thread-safe recent-window store for device metrics and third-party data."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._np = None
+        self.enabled = False
+        self.window_seconds = 4 * HOUR
+        self.points_per_series = 2880
+        self.max_series = 2000
+        self._series = OrderedDict()  # (kind name, series key) -> _RingBuffer, least recently updated first
+        self._complete_since = {name: None for name in KINDS}
+        self._evicted_until = {name: None for name in KINDS}
+        self._counters = self._new_counters()
+
+    @staticmethod
+    def _new_counters():
+        return {"samples": 0, "duplicates": 0, "late": 0, "evictions": 0, "warm_rows": 0, "hits": 0, "fallbacks": 0}
+
+    def configure(self, settings):
+        """Applies the `hot_tier` block of config.json and empties the tier.
+
+        HOT_TIER_ENABLED=0/1 overrides `enabled`. Raises RuntimeError if numpy is missing.
+        """
+        enabled = settings.get("enabled", False)
+        if os.getenv("HOT_TIER_ENABLED"):
+            enabled = os.getenv("HOT_TIER_ENABLED") != "0"
+        np = None
+        if enabled:
+            try:
+                import numpy as np
+            except ImportError:
+                self.enabled = False
+                raise RuntimeError("The hot tier needs numpy: pip install numpy")
+        now = micros(datetime.utcnow())
+        with self._lock:
+            self._np = np
+            self.enabled = enabled
+            self.window_seconds = float(settings.get("window_hours", 4)) * HOUR
+            self.points_per_series = int(settings.get("points_per_series", 2880))
+            self.max_series = int(settings.get("max_series", 2000))
+            self._series = OrderedDict()
+            # Until warm() succeeds, only samples ingested from now on are known to be complete
+            self._complete_since = {name: now for name in KINDS}
+            self._evicted_until = {name: None for name in KINDS}
+            self._counters = self._new_counters()
+
+    def warm(self, session):
+        """Loads the last `window_hours` of raw rows, so recent ranges are answered from the first request."""
+        if not self.enabled:
+            return
+        np = self._np
+        since = datetime.utcnow() - timedelta(seconds=self.window_seconds)
+        with BlockTimer("Warming hot tier", logging.getLogger(__name__)):
+            loaded = 0
+            for kind_name, kind in KINDS.items():
+                model = kind.raw_model
+                series = [getattr(model, column) for column in kind.series_columns]
+                grouped = {}
+                for row in session.query(*series, model.timestamp, model.value).filter(model.timestamp >= since).yield_per(10000):
+                    *key, timestamp, value = row
+                    if value is None:
+                        continue
+                    times, values = grouped.setdefault(tuple(key), ([], []))
+                    times.append(micros(timestamp))
+                    values.append(value)
+                    loaded += 1
+                with self._lock:
+                    for key, (times, values) in grouped.items():
+                        self._buffer(kind_name, key).merge(
+                            np, np.array(times, dtype=np.int64), np.array(values, dtype=np.float64)
+                        )
+                    self._complete_since[kind_name] = min(self._complete_since[kind_name], micros(since))
+            with self._lock:
+                self._counters["warm_rows"] += loaded
+        logging.info(f"Hot tier warmed with {loaded} rows from the last {self.window_seconds / HOUR:g} hours")
+
+    def add(self, device_metric_rows, third_party_rows):
+        """Applies freshly committed insert rows (the dicts insert_rows() wrote)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            for row in device_metric_rows:
+                self._add("device", (row["device_id"], row["metric_id"]), row["timestamp"], row["value"])
+            for row in third_party_rows:
+                self._add("third_party", (row["thirdparty_id"],), row["timestamp"], row["value"])
+
+    def query_series(self, kind_name, start, end, resolution, series_filter=None, percentiles=()):
+        """Points for [start, end) in rollups.query_series() format, or None if the range is not all in memory.
+
+        With `percentiles` (numbers 0-100) every point also has a percentile_name(q) field.
+        """
+        if not self.enabled:
+            return None
+        kind = KINDS[kind_name]
+        if resolution is not None:
+            start = bucket_start(start, resolution)
+            end = bucket_start(end - _MICROSECOND, resolution) + timedelta(seconds=resolution)
+        low, high = micros(start), micros(end)
+        wanted = {column: set(ids) for column, ids in (series_filter or {}).items() if column in kind.series_columns}
+        positions = {column: kind.series_columns.index(column) for column in wanted}
+
+        np = self._np
+        windows = []
+        with self._lock:
+            evicted_until = self._evicted_until[kind_name]
+            if low < self._complete_since[kind_name] or (evicted_until is not None and low <= evicted_until):
+                self._counters["fallbacks"] += 1
+                return None
+            for (series_kind, key), buffer in self._series.items():
+                if series_kind != kind_name or any(key[positions[column]] not in ids for column, ids in wanted.items()):
+                    continue
+                if low < buffer.covered_from:
+                    self._counters["fallbacks"] += 1
+                    return None
+                times, values = buffer.window(np, low, high)
+                if len(times):
+                    windows.append((key, times, values))
+            self._counters["hits"] += 1
+
+        points = []
+        for key, times, values in sorted(windows, key=lambda window: window[0]):
+            points.extend(_series_points(np, kind, key, times, values, resolution, percentiles))
+        return points
+
+    def stats(self):
+        """Series and point counts, memory held and its bound, coverage and hit/fallback counters."""
+        with self._lock:
+            series = {name: 0 for name in KINDS}
+            points = 0
+            for (kind_name, _), buffer in self._series.items():
+                series[kind_name] += 1
+                points += buffer.size
+            per_series_bytes = self.points_per_series * POINT_BYTES
+            return dict(
+                self._counters,
+                enabled=self.enabled,
+                series=series,
+                points=points,
+                memory_bytes=len(self._series) * per_series_bytes,
+                memory_limit_bytes=self.max_series * per_series_bytes,
+                window_hours=self.window_seconds / HOUR,
+                complete_since={
+                    name: _datetime(max(since, (self._evicted_until[name] or -1) + 1)).isoformat()
+                    for name, since in self._complete_since.items() if since is not None
+                }
+            )
+
+    def _add(self, kind_name, key, timestamp, value):
+        if value is None:
+            return
+        outcome = self._buffer(kind_name, key).append(self._np, micros(timestamp), value)
+        if outcome == "duplicate":
+            self._counters["duplicates"] += 1
+        else:
+            self._counters["samples"] += 1
+            if outcome == "late":
+                self._counters["late"] += 1
+
+    def _buffer(self, kind_name, key):
+        series_key = (kind_name, key)
+        buffer = self._series.get(series_key)
+        if buffer is not None:
+            self._series.move_to_end(series_key)
+            return buffer
+        while len(self._series) >= self.max_series:
+            (evicted_kind, _), evicted = self._series.popitem(last=False)
+            if evicted.newest is not None:
+                newest = evicted.newest[0]
+                self._evicted_until[evicted_kind] = max(self._evicted_until[evicted_kind] or newest, newest)
+            self._counters["evictions"] += 1
+        buffer = self._series[series_key] = _RingBuffer(self._np, self.points_per_series)
+        return buffer
+
+
+def _series_points(np, kind, key, times, values, resolution, percentiles):
+    """Aggregates one series' window into points: per sample (resolution None) or per bucket."""
+    if resolution is None:
+        stamps, means, mins, maxs, lasts = times, values, values, values, values
+        counts = np.ones(len(values), dtype=np.int64)
+        quantiles = [values] * len(percentiles)
+    else:
+        width = resolution * 1_000_000
+        buckets = times // width
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+        ends = np.append(starts[1:], len(values))
+        counts = ends - starts
+        stamps = buckets[starts] * width
+        mins = np.minimum.reduceat(values, starts)
+        maxs = np.maximum.reduceat(values, starts)
+        means = np.add.reduceat(values, starts) / counts
+        lasts = values[ends - 1]
+        quantiles = []
+        if percentiles:
+            # Sort values within each bucket once, then interpolate every percentile like np.percentile
+            ordered = values[np.lexsort((values, buckets))]
+            for q in percentiles:
+                position = starts + (counts - 1) * (q / 100)
+                below = np.floor(position).astype(np.int64)
+                above = np.minimum(below + 1, ends - 1)
+                quantiles.append(ordered[below] + (ordered[above] - ordered[below]) * (position - below))
+
+    names = [percentile_name(q) for q in percentiles]
+    quantile_lists = [quantile.tolist() for quantile in quantiles]
+    base = dict(zip(kind.series_columns, key))
+    points = []
+    for index, (stamp, mean, low, high, count, last) in enumerate(zip(
+        stamps.tolist(), means.tolist(), mins.tolist(), maxs.tolist(), counts.tolist(), lasts.tolist()
+    )):
+        point = dict(base, timestamp=_datetime(stamp), value=mean, min=low, max=high, count=count, last=last)
+        for name, quantile in zip(names, quantile_lists):
+            point[name] = quantile[index]
+        points.append(point)
+    return points
+
+
+def _datetime(timestamp):
+    return _EPOCH + timedelta(microseconds=timestamp)
+
+
+# Fed by update_database and bulk imports; read by the series endpoints
+hot_tier = HotTier()
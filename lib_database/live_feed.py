@@ -0,0 +1,114 @@
+"""
+Fan-out of new samples to live dashboard connections (Server-Sent Events in client/app.py).
+
+LiveFeed listens to the latest-value snapshot, so each committed sample is labelled
+once and handed to every subscriber whose filters match, with no database query per
+viewer. Each subscription keeps only the newest pending value per series: a client
+that reads slowly, or asks for a long push interval, receives one coalesced update
+instead of a backlog.
+
+Each open stream holds a server thread for as long as the client is connected. On a
+bounded thread pool (gunicorn gthread workers, the ASGI app's WSGI bridge) the
+server calls limit_to_threads(), which leaves most threads to ingest and page
+requests; the next viewer past the limit gets a 503 rather than stalling ingest.
+"""
+import threading
+
+# Keeps a burst of dashboard tabs from tying up every server thread
+MAX_SUBSCRIBERS = 100
+# On a pool of N threads, at most N // STREAM_THREAD_SHARE may hold live streams
+STREAM_THREAD_SHARE = 4
+
+
+class SubscriberLimitError(Exception):
+    """Raised when MAX_SUBSCRIBERS live connections are already open."""
+
+
+class Subscription:
+    """Pending updates for one client, coalesced to the newest value per series."""
+
+    def __init__(self, device=None, metric=None, weather_type=None):
+        self.device = device
+        self.metric = metric
+        self.weather_type = weather_type
+        self._condition = threading.Condition()
+        self._device_metrics = {}  # (device_name, metric_name) -> entry
+        self._weather_data = {}  # ThirdParty name -> entry
+
+    def matches_device_metric(self, entry):
+        return (self.device is None or entry["device_name"] == self.device) and \
+            (self.metric is None or entry["metric_name"] == self.metric)
+
+    def matches_weather(self, entry):
+        return self.weather_type is None or entry["type"] == self.weather_type
+
+    def offer(self, device_entries, weather_entries):
+        """Queues the entries this subscription is interested in and wakes its reader."""
+        device_entries = [entry for entry in device_entries if self.matches_device_metric(entry)]
+        weather_entries = [entry for entry in weather_entries if self.matches_weather(entry)]
+        if not device_entries and not weather_entries:
+            return
+        with self._condition:
+            for entry in device_entries:
+                self._device_metrics[(entry["device_name"], entry["metric_name"])] = entry
+            for entry in weather_entries:
+                self._weather_data[entry["name"]] = entry
+            self._condition.notify()
+
+    def wait(self, timeout):
+        """Blocks up to `timeout` seconds for updates; returns (device_entries, weather_entries)."""
+        with self._condition:
+            if not self._device_metrics and not self._weather_data:
+                self._condition.wait(timeout)
+            device_entries = list(self._device_metrics.values())
+            weather_entries = list(self._weather_data.values())
+            self._device_metrics.clear()
+            self._weather_data.clear()
+        return device_entries, weather_entries
+
+
+class LiveFeed:
+    """Registry of live subscriptions, fed by SnapshotStore.add_listener()."""
+
+    def __init__(self, max_subscribers=MAX_SUBSCRIBERS):
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+        self._counters = {"published": 0, "delivered": 0}
+
+    def subscribe(self, device=None, metric=None, weather_type=None):
+        """Opens a subscription; raises SubscriberLimitError when the feed is full."""
+        subscription = Subscription(device, metric, weather_type)
+        with self._lock:
+            if len(self._subscriptions) >= self.max_subscribers:
+                raise SubscriberLimitError(f"Live feed is full ({self.max_subscribers} subscribers)")
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def limit_to_threads(self, threads):
+        """Caps subscribers for a server with `threads` request threads, keeping the rest for other requests."""
+        with self._lock:
+            self.max_subscribers = min(self.max_subscribers, max(1, threads // STREAM_THREAD_SHARE))
+        return self.max_subscribers
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, device_entries, weather_entries):
+        """Hands one update to every subscription; called once per ingest commit."""
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+            self._counters["published"] += 1
+            self._counters["delivered"] += len(subscriptions)
+        for subscription in subscriptions:
+            subscription.offer(device_entries, weather_entries)
+
+    def stats(self):
+        """Returns the subscriber count and publish/delivery counters."""
+        with self._lock:
+            return dict(self._counters, subscribers=len(self._subscriptions))
+
+
+# Shared by the ingest path and the API in this process
+live_feed = LiveFeed()
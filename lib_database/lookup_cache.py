@@ -0,0 +1,168 @@
+"""
+In-process cache of the small, rarely-changing lookup tables used on the ingest path:
+devices (by name), metrics (by name) and third-party types (by name, latitude, longitude).
+
+IDs are immutable once a row exists, so cached entries never go stale; only misses
+hit the database. Misses are not cached, so rows added later by the schema scripts
+are picked up on first use. `invalidate()` drops everything for in-process callers.
+"""
+import logging
+import threading
+import uuid
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import Device, Metric, ThirdPartyType
+
+
+def coordinate_key(name, latitude, longitude):
+    """Normalised (name, lat, lon) key matching the DECIMAL(9, 6) columns of ThirdPartyType."""
+    return (name, round(float(latitude), 6), round(float(longitude), 6))
+
+
+class LookupCache:
+    """Thread-safe name -> uuid cache for Device, Metric and ThirdPartyType rows."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._devices = {}
+        self._metrics = {}
+        self._third_party_types = {}
+        self._located_types = set()  # ThirdPartyType IDs whose location_name is set
+        self._counters = {"hits": 0, "misses": 0, "queries": 0, "rows_created": 0, "invalidations": 0}
+
+    def warm(self, session):
+        """Loads every lookup row in three queries; call once at startup."""
+        devices = session.query(Device.name, Device.uuid).all()
+        metrics = session.query(Metric.name, Metric.uuid).all()
+        third_party_types = session.query(
+            ThirdPartyType.name, ThirdPartyType.latitude, ThirdPartyType.longitude, ThirdPartyType.uuid,
+            ThirdPartyType.location_name
+        ).all()
+        with self._lock:
+            self._counters["queries"] += 3
+            # Oldest row wins if a name was registered more than once before names were unique
+            for name, device_id in devices:
+                self._devices.setdefault(name, device_id)
+            self._metrics.update(metrics)
+            for name, latitude, longitude, type_id, location_name in third_party_types:
+                self._third_party_types[coordinate_key(name, latitude, longitude)] = type_id
+                if location_name:
+                    self._located_types.add(type_id)
+        logging.info(
+            f"Lookup cache warmed: {len(self._devices)} devices, {len(self._metrics)} metrics, "
+            f"{len(self._third_party_types)} third-party types"
+        )
+
+    def invalidate(self):
+        """Forgets every cached ID; the next lookups go back to the database."""
+        with self._lock:
+            self._devices.clear()
+            self._metrics.clear()
+            self._third_party_types.clear()
+            self._located_types.clear()
+            self._counters["invalidations"] += 1
+
+    def stats(self):
+        """Returns a snapshot of the hit/miss/query counters and cache sizes."""
+        with self._lock:
+            return dict(
+                self._counters,
+                devices=len(self._devices),
+                metrics=len(self._metrics),
+                third_party_types=len(self._third_party_types)
+            )
+
+    def metric_id(self, session, name, create=False):
+        """Returns the uuid of the Metric called `name`, registering it first if `create` is set."""
+        metric_id = self._lookup(self._metrics, name, lambda: session.query(Metric.uuid).filter_by(name=name).scalar())
+        if metric_id is not None or not create:
+            return metric_id
+        return self._create(session, self._metrics, name, lambda: Metric(uuid=str(uuid.uuid4()), name=name))
+
+    def third_party_type_id(self, session, name, latitude, longitude, location_name=None):
+        """Returns the uuid of the ThirdPartyType at (latitude, longitude), or None if it does not exist.
+
+        A `location_name` is stored on the type the first time one is seen for it:
+        third-party rows no longer carry their own "{location} {type}" name.
+        """
+        type_id = self._lookup(
+            self._third_party_types,
+            coordinate_key(name, latitude, longitude),
+            lambda: session.query(ThirdPartyType.uuid).filter_by(name=name, latitude=latitude, longitude=longitude).scalar()
+        )
+        if type_id is not None and location_name and type_id not in self._located_types:
+            self._set_location_name(session, type_id, location_name)
+        return type_id
+
+    def device_id(self, session, name, create=True):
+        """Returns the uuid of the Device called `name`, registering it first if `create` is set."""
+        device_id = self._lookup(
+            self._devices, name,
+            lambda: session.query(Device.uuid).filter_by(name=name).order_by(Device.date_registered).limit(1).scalar()
+        )
+        if device_id is not None or not create:
+            return device_id
+        return self._create(
+            session, self._devices, name,
+            lambda: Device(uuid=str(uuid.uuid4()), name=name, date_registered=datetime.utcnow())
+        )
+
+    def _create(self, session, table, name, make_row):
+        """Inserts the row built by `make_row` and caches its uuid.
+
+        The row is committed in its own short transaction so the cached ID stays
+        valid even if the caller's transaction is later rolled back. The lock is only
+        taken to publish the ID, so a slow insert never holds up other lookups.
+        """
+        with Session(bind=session.get_bind()) as create_session:
+            row = make_row()
+            model = type(row)
+            row_id = row.uuid
+            create_session.add(row)
+            try:
+                create_session.commit()
+                created = True
+                logging.info(f"New {model.__tablename__} row added: {name} with ID: {row_id}")
+            except IntegrityError:
+                # Another thread or process registered the same name first
+                create_session.rollback()
+                row_id = create_session.query(model.uuid).filter_by(name=name).scalar()
+                created = False
+
+        with self._lock:
+            self._counters["rows_created" if created else "queries"] += 1
+            return table.setdefault(name, row_id)
+
+    def _set_location_name(self, session, type_id, location_name):
+        """Fills in a missing ThirdPartyType.location_name in its own short transaction, outside the lock."""
+        # Only set if still NULL, so a racing thread's update is harmless
+        with Session(bind=session.get_bind()) as update_session:
+            update_session.query(ThirdPartyType).filter(
+                ThirdPartyType.uuid == type_id, ThirdPartyType.location_name.is_(None)
+            ).update({ThirdPartyType.location_name: location_name}, synchronize_session=False)
+            update_session.commit()
+        with self._lock:
+            self._counters["queries"] += 1
+            self._located_types.add(type_id)
+
+    def _lookup(self, table, key, query):
+        value = table.get(key)
+        if value is not None:
+            with self._lock:
+                self._counters["hits"] += 1
+            return value
+
+        value = query()
+        with self._lock:
+            self._counters["misses"] += 1
+            self._counters["queries"] += 1
+            if value is not None:
+                table[key] = value
+        return value
+
+
+# Shared by every ingest path in this process
+lookup_cache = LookupCache()
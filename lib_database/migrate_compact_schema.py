@@ -0,0 +1,348 @@
+"""
+Online migration of an existing database to the compact schema in models.py.
+
+The compact schema stores every UUID column as BINARY(16) instead of VARCHAR(36)
+and drops third_parties.name, which repeated "{location} {type}" on every row
+(it is derived from ThirdPartyType now, see models.third_party_name). Each fact row
+and each index entry on it shrinks to well under half its old size.
+
+Two steps, both safe to interrupt and re-run:
+
+    python lib_database/migrate_compact_schema.py --copy    copy every table into "<table>_compact"
+    python lib_database/migrate_compact_schema.py --swap    catch up, then swap the tables over
+
+--copy runs while the application keeps serving: tables are copied in time (raw
+samples) or primary-key (rollups) order, one short transaction per chunk, and progress is simply the copied table
+itself, so a re-run resumes where the last one stopped. Rows written meanwhile are
+picked up by a catch-up pass over their time column (rows newer than the copy's start,
+less --catch-up-hours for late, spooled samples); duplicates are skipped.
+
+--swap takes write locks on the old and new tables (a single transaction on SQLite),
+runs a final catch-up and renames the tables in one statement, keeping the old ones
+as "<table>_legacy" for rollback. Stop the server on the old version before --swap
+and start this version right after. On MySQL the old code's writes fail against the
+BINARY(16) columns (agents spool and resend them), but SQLite stores its 36-character
+text uuids as is: models.BinaryUUID still reads those rows, yet they never match
+lookups by binary uuid. This version refuses to start on the old schema
+(models.check_schema), so it cannot write to the tables before they are migrated.
+
+Tables that the database does not have yet (e.g. the rollup tables, on a database
+created before they existed) are created empty by the swap.
+Re-run `retention.py --partition` afterwards if the raw tables were partitioned.
+"""
+import argparse
+import logging
+import os
+import sys
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import (
+    Column, DateTime, ForeignKey, Index, MetaData, String, Table, UniqueConstraint, func, inspect, select, text, tuple_
+)
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import Base, is_compact
+from lib_database.engine import get_engine
+from lib_utils.blocktimer import BlockTimer
+
+COMPACT_SUFFIX = "_compact"
+LEGACY_SUFFIX = "_legacy"
+DEFAULT_CHUNK_SIZE = 20000
+# Samples spooled by agents can arrive this long after their timestamp
+DEFAULT_CATCH_UP_HOURS = 24
+
+# Tables small enough to refresh whole; the rest are copied in chunks and caught up
+# through their time column. Raw samples are append-only and copied in time order;
+# rollup rows are rewritten in place by RollupWorker, so they are copied in key order
+# and their recent buckets replaced rather than merely topped up.
+SMALL_TABLES = ("devices", "metrics", "third_party_types")
+FACT_TABLES = ("device_metrics", "third_parties")
+TIME_COLUMNS = {
+    "device_metrics": "timestamp",
+    "third_parties": "timestamp",
+    "device_metric_rollups": "bucket_start",
+    "third_party_rollups": "bucket_start"
+}
+# Widest rollup bucket: a bucket starting this long before the window can still change
+MAX_BUCKET = timedelta(days=1)
+
+_progress_metadata = MetaData()
+# When copying of each table began, so catch-up knows how far back to look
+progress_table = Table(
+    "compact_schema_migration", _progress_metadata,
+    Column("table_name", String(64), primary_key=True),
+    Column("started_at", DateTime, nullable=False)
+)
+
+
+def compact_tables(with_indexes):
+    """"<table>_compact" copies of every model table, in dependency order, with foreign keys between them.
+
+    SQLite index names are global, so there the secondary indexes are only built
+    at swap time, under their final names.
+    """
+    metadata = MetaData()
+    tables = []
+    for table in Base.metadata.sorted_tables:
+        columns = [
+            Column(
+                column.name, column.type,
+                *[ForeignKey(f"{key.column.table.name}{COMPACT_SUFFIX}.{key.column.name}") for key in column.foreign_keys],
+                primary_key=column.primary_key, nullable=column.nullable, unique=column.unique,
+                autoincrement=column.autoincrement
+            )
+            for column in table.columns
+        ]
+        constraints = [
+            UniqueConstraint(*[column.name for column in constraint.columns], name=constraint.name)
+            for constraint in table.constraints if isinstance(constraint, UniqueConstraint)
+        ]
+        compact = Table(f"{table.name}{COMPACT_SUFFIX}", metadata, *columns, *constraints)
+        if with_indexes:
+            for index in table.indexes:
+                Index(index.name, *[compact.c[column.name] for column in index.columns])
+        tables.append((table, compact))
+    return tables
+
+
+def copy_tables(chunk_size=DEFAULT_CHUNK_SIZE, catch_up_hours=DEFAULT_CATCH_UP_HOURS):
+    """Bulk-copies every table into its compact counterpart, then catches up. Returns bulk rows copied per table."""
+    engine = get_engine()
+    with engine.connect() as connection:
+        if is_compact(connection):
+            raise RuntimeError("device_metrics already uses the compact schema")
+    existing = set(inspect(engine).get_table_names())
+    tables = compact_tables(with_indexes=engine.dialect.name != "sqlite")
+    with engine.begin() as connection:
+        _progress_metadata.create_all(connection)
+        for _, compact in tables:
+            compact.create(connection, checkfirst=True)
+        recorded = {row.table_name for row in connection.execute(progress_table.select())}
+        started = [
+            {"table_name": table.name, "started_at": datetime.utcnow()} for table, _ in tables if table.name not in recorded
+        ]
+        if started:
+            connection.execute(progress_table.insert(), started)
+
+    copied = {}
+    for table, compact in tables:
+        if table.name not in existing:
+            # Nothing to copy: the empty compact table takes its place at swap time
+            copied[table.name] = 0
+            continue
+        legacy = _reflect(engine, table.name)
+        with BlockTimer("Copying table", logging.getLogger(__name__), labels={"table": table.name}):
+            if table.name in SMALL_TABLES:
+                with engine.begin() as connection:
+                    copied[table.name] = _refresh(connection, legacy, compact)
+            else:
+                copied[table.name] = _copy_chunks(engine, legacy, compact, chunk_size)
+        logging.info(f"Copied {copied[table.name]} rows of {table.name}")
+
+    for table, compact in tables:
+        if table.name not in SMALL_TABLES and table.name in existing:
+            with BlockTimer("Catching up table", logging.getLogger(__name__), labels={"table": table.name}):
+                _catch_up(engine, None, _reflect(engine, table.name), compact, chunk_size, catch_up_hours)
+    return copied
+
+
+def swap_tables(chunk_size=DEFAULT_CHUNK_SIZE, catch_up_hours=DEFAULT_CATCH_UP_HOURS):
+    """Final catch-up and rename under write locks; the old tables stay as "<table>_legacy"."""
+    engine = get_engine()
+    with engine.connect() as connection:
+        if is_compact(connection):
+            raise RuntimeError("device_metrics already uses the compact schema")
+    mysql = engine.dialect.name == "mysql"
+    tables = compact_tables(with_indexes=mysql)
+    existing = set(inspect(engine).get_table_names())
+    legacy = {table.name: _reflect(engine, table.name) for table, _ in tables if table.name in existing}
+    legacy_indexes = {name: [index["name"] for index in inspect(engine).get_indexes(name)] for name in legacy}
+
+    with BlockTimer("Swapping in the compact tables", logging.getLogger(__name__)), engine.begin() as connection:
+        if mysql:
+            locked = [table.name for table, _ in tables if table.name in legacy]
+            locked += [compact.name for _, compact in tables] + [progress_table.name]
+            connection.execute(text("LOCK TABLES " + ", ".join(f"{name} WRITE" for name in locked)))
+        try:
+            for table, compact in tables:
+                if table.name not in legacy:
+                    continue
+                if table.name in SMALL_TABLES:
+                    _refresh(connection, legacy[table.name], compact)
+                else:
+                    _catch_up(engine, connection, legacy[table.name], compact, chunk_size, catch_up_hours)
+
+            if mysql:
+                # One statement, so readers never see a half-swapped schema
+                connection.execute(text("RENAME TABLE " + ", ".join(
+                    (f"{table.name} TO {table.name}{LEGACY_SUFFIX}, " if table.name in legacy else "")
+                    + f"{compact.name} TO {table.name}" for table, compact in tables
+                )))
+            else:
+                for table, compact in tables:
+                    if table.name in legacy:
+                        for index_name in legacy_indexes[table.name]:
+                            connection.execute(text(f"DROP INDEX {index_name}"))
+                        connection.execute(text(f"ALTER TABLE {table.name} RENAME TO {table.name}{LEGACY_SUFFIX}"))
+                    connection.execute(text(f"ALTER TABLE {compact.name} RENAME TO {table.name}"))
+                for table, _ in tables:
+                    for index in table.indexes:
+                        index.create(connection)
+        finally:
+            if mysql:
+                connection.execute(text("UNLOCK TABLES"))
+        progress_table.drop(connection)
+    logging.info("Compact schema in place; the old tables are kept with the _legacy suffix")
+
+
+def _reflect(engine, name):
+    return Table(name, MetaData(), autoload_with=engine)
+
+
+def _rows(result, compact):
+    """Converts legacy rows to insert dicts for `compact`, leaving out dropped columns."""
+    names = [column.name for column in compact.columns]
+    return [{name: row._mapping[name] for name in names} for row in result]
+
+
+def _insert_ignore(connection, table, rows):
+    if not rows:
+        return
+    statement = table.insert()
+    dialect = connection.dialect.name
+    if dialect == "mysql":
+        statement = statement.prefix_with("IGNORE")
+    elif dialect == "sqlite":
+        statement = statement.prefix_with("OR IGNORE")
+    connection.execute(statement, rows)
+
+
+def _refresh(connection, legacy, compact):
+    """Makes a small compact table match its legacy table, updating rows that changed in place."""
+    key = [column.name for column in compact.primary_key.columns]
+    current = {tuple(row._mapping[name] for name in key): dict(row._mapping) for row in connection.execute(compact.select())}
+    missing = []
+    for row in _rows(connection.execute(legacy.select()), compact):
+        existing = current.get(tuple(row[name] for name in key))
+        if existing is None:
+            missing.append(row)
+        elif existing != row:
+            connection.execute(compact.update().where(*[compact.c[name] == row[name] for name in key]).values(row))
+    _insert_ignore(connection, compact, missing)
+    return len(missing)
+
+
+def _copy_chunks(engine, legacy, compact, chunk_size):
+    """Bulk-copies `legacy`, resuming after the rows already in `compact`. Returns rows read."""
+    if legacy.name in FACT_TABLES:
+        with engine.connect() as connection:
+            last = connection.execute(select(func.max(compact.c[TIME_COLUMNS[legacy.name]]))).scalar()
+        return _copy_by_time(engine, legacy, compact, chunk_size, last)
+
+    key = [column.name for column in compact.primary_key.columns]
+    with engine.connect() as connection:
+        last = connection.execute(
+            compact.select().with_only_columns(*compact.primary_key.columns)
+            .order_by(*[compact.c[name].desc() for name in key]).limit(1)
+        ).first()
+    return _copy_by_key(engine, legacy, compact, chunk_size, key, None if last is None else tuple(last))
+
+
+def _catch_up(engine, connection, legacy, compact, chunk_size, catch_up_hours):
+    """Copies rows written since the copy began; returns rows read.
+
+    With `connection` the whole pass runs in that one transaction (the swap).
+    """
+    started_at = (connection or engine).execute(
+        progress_table.select().with_only_columns(progress_table.c.started_at)
+        .where(progress_table.c.table_name == legacy.name)
+    ).scalar()
+    since = started_at - timedelta(hours=catch_up_hours)
+    if legacy.name in FACT_TABLES:
+        return _copy_by_time(engine, legacy, compact, chunk_size, since, connection)
+
+    time_column = TIME_COLUMNS[legacy.name]
+    since -= MAX_BUCKET
+    with _transaction(engine, connection) as delete_connection:
+        delete_connection.execute(compact.delete().where(compact.c[time_column] >= since))
+    key = [column.name for column in compact.primary_key.columns]
+    return _copy_by_key(engine, legacy, compact, chunk_size, key, None, legacy.c[time_column] >= since, connection)
+
+
+def _copy_by_time(engine, legacy, compact, chunk_size, since, connection=None):
+    """Copies the rows of `legacy` from `since` on, oldest first.
+
+    Copying in time order keeps the new table's rows in the order they were
+    written, so on SQLite a series' rows for a day stay on neighbouring pages.
+    Rows at a chunk's last timestamp are read again by the next chunk; their
+    duplicates are skipped.
+    """
+    time_column = legacy.c[TIME_COLUMNS[legacy.name]]
+    name = time_column.name
+    bound, past_bound = since, False
+    copied = 0
+    while True:
+        with _transaction(engine, connection) as chunk_connection:
+            statement = legacy.select().order_by(time_column).limit(chunk_size)
+            if bound is not None:
+                statement = statement.where(time_column > bound if past_bound else time_column >= bound)
+            rows = _rows(chunk_connection.execute(statement), compact)
+            past_bound = len(rows) == chunk_size and rows[0][name] == rows[-1][name]
+            if past_bound:
+                # More than a chunk shares one timestamp: take all of them, then move past it
+                rows = _rows(chunk_connection.execute(legacy.select().where(time_column == rows[0][name])), compact)
+            _insert_ignore(chunk_connection, compact, rows)
+        copied += len(rows)
+        if len(rows) < chunk_size and not past_bound:
+            return copied
+        bound = rows[-1][name]
+        logging.info(f"{legacy.name}: {copied} rows copied, up to {bound}")
+
+
+def _copy_by_key(engine, legacy, compact, chunk_size, key, last, condition=None, connection=None):
+    """Copies the rows of `legacy` matching `condition` in `key` order, starting after `last`."""
+    legacy_key = tuple_(*[legacy.c[name] for name in key])
+    copied = 0
+    while True:
+        with _transaction(engine, connection) as chunk_connection:
+            statement = legacy.select().order_by(*[legacy.c[name] for name in key]).limit(chunk_size)
+            if condition is not None:
+                statement = statement.where(condition)
+            if last is not None:
+                statement = statement.where(legacy_key > last)
+            rows = _rows(chunk_connection.execute(statement), compact)
+            _insert_ignore(chunk_connection, compact, rows)
+        copied += len(rows)
+        if len(rows) < chunk_size:
+            return copied
+        last = tuple(rows[-1][name] for name in key)
+        logging.info(f"{legacy.name}: {copied} rows copied")
+
+
+@contextmanager
+def _transaction(engine, connection):
+    """The caller's `connection` if given, else a new transaction per use."""
+    if connection is not None:
+        yield connection
+    else:
+        with engine.begin() as new_connection:
+            yield new_connection
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Migrate the database to the compact (binary uuid) schema.")
+    step = parser.add_mutually_exclusive_group(required=True)
+    step.add_argument("--copy", action="store_true", help="copy every table into <table>_compact (resumable)")
+    step.add_argument("--swap", action="store_true", help="final catch-up, then rename the compact tables into place")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--catch-up-hours", type=float, default=DEFAULT_CATCH_UP_HOURS)
+    args = parser.parse_args()
+
+    if args.copy:
+        for table_name, rows in copy_tables(args.chunk_size, args.catch_up_hours).items():
+            print(f"{table_name}: {rows} rows copied")
+    else:
+        swap_tables(args.chunk_size, args.catch_up_hours)
@@ -0,0 +1,316 @@
+"""
+Shared, invalidation-aware cache for read queries served by client/app.py.
+
+Values are JSON documents stored under versioned keys: "<namespace>:<version>:<key>".
+The ingest path calls invalidate(namespace) after committing new rows, which bumps
+the namespace version, so every worker sharing the backend misses on its next read
+and old entries simply expire. Readers never see data older than the last commit.
+
+Backends (config.json "cache.backend"):
+
+    memory   per-process dict; invalidation only reaches the process that ingested
+    file     SQLite file shared by every worker on the host (the local stand-in for Redis)
+    redis    any Redis-compatible server; needs the optional `redis` package
+
+Stampedes are prevented twice over: concurrent misses in one process wait for a
+single loader, and across processes the loader takes a short lock key in the backend
+while the others poll for its result. If the backend fails, the query runs uncached.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+# The file backend purges expired rows once every this many writes
+PURGE_EVERY_WRITES = 500
+
+
+class MemoryBackend:
+    """In-process backend with per-entry expiry."""
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._entries = {}  # key -> (value, expires_at or None)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] is not None and entry[1] <= time.time():
+                del self._entries[key]
+                return None
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._purge()
+            self._entries[key] = (value, time.time() + ttl if ttl else None)
+
+    def add(self, key, value, ttl=None):
+        """Sets `key` only if it is absent or expired; returns True if it was set."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > time.time()):
+                return False
+            self._entries[key] = (value, time.time() + ttl if ttl else None)
+            return True
+
+    def incr(self, key):
+        with self._lock:
+            value = int(self._entries.get(key, ("0", None))[0]) + 1
+            self._entries[key] = (str(value), None)
+            return value
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _purge(self):
+        now = time.time()
+        for key in [key for key, (_, expires_at) in self._entries.items() if expires_at is not None and expires_at <= now]:
+            del self._entries[key]
+        # Still full of live entries: drop the oldest insertions
+        while len(self._entries) >= self.max_entries:
+            del self._entries[next(iter(self._entries))]
+
+
+class FileBackend:
+    """SQLite-file backend shared by every process on the host."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)")
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM cache WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, time.time() + ttl if ttl else None)
+            )
+            self._after_write()
+
+    def add(self, key, value, ttl=None):
+        """Sets `key` only if it is absent or expired; returns True if it was set."""
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO cache (key, value, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+                "WHERE cache.expires_at IS NOT NULL AND cache.expires_at <= ?",
+                (key, value, now + ttl if ttl else None, now)
+            )
+            return cursor.rowcount == 1
+
+    def incr(self, key):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute(
+                    "INSERT INTO cache (key, value, expires_at) VALUES (?, '1', NULL) "
+                    "ON CONFLICT(key) DO UPDATE SET value = CAST(cache.value AS INTEGER) + 1",
+                    (key,)
+                )
+                value = int(self._db.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()[0])
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return value
+
+    def delete(self, key):
+        with self._lock:
+            self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def _after_write(self):
+        self._writes += 1
+        if self._writes % PURGE_EVERY_WRITES == 0:
+            self._db.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+
+
+class RedisBackend:
+    """Backend for Redis or any server speaking its protocol."""
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("The redis cache backend needs the `redis` package: pip install redis")
+        self._client = redis.Redis.from_url(url, decode_responses=True, socket_timeout=1)
+
+    def get(self, key):
+        return self._client.get(key)
+
+    def set(self, key, value, ttl=None):
+        self._client.set(key, value, ex=int(ttl) if ttl else None)
+
+    def add(self, key, value, ttl=None):
+        return bool(self._client.set(key, value, ex=int(ttl) if ttl else None, nx=True))
+
+    def incr(self, key):
+        return self._client.incr(key)
+
+    def delete(self, key):
+        self._client.delete(key)
+
+
+def create_backend(settings):
+    """Builds the backend named by settings["backend"] ("memory", "file" or "redis")."""
+    backend = settings.get("backend", "memory")
+    if backend == "memory":
+        return MemoryBackend(max_entries=settings.get("max_entries", 4096))
+    if backend == "file":
+        return FileBackend(settings.get("path", "query_cache.db"))
+    if backend == "redis":
+        return RedisBackend(settings.get("url", "redis://localhost:6379/0"))
+    raise ValueError(f"Unknown cache backend: {backend}")
+
+
+class _Flight:
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class QueryCache:
+    """Versioned read-through cache with single-flight loading and hit/miss counters."""
+
+    def __init__(self, backend=None, ttl_seconds=600, lock_seconds=30, poll_seconds=0.05):
+        self.backend = backend or MemoryBackend()
+        self.ttl_seconds = ttl_seconds
+        self.lock_seconds = lock_seconds
+        self.poll_seconds = poll_seconds
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._counters = {
+            "hits": 0, "misses": 0, "loads": 0, "shared": 0, "remote_waits": 0, "invalidations": 0, "backend_errors": 0
+        }
+
+    def configure(self, backend, ttl_seconds=None):
+        """Swaps the backend, e.g. from config.json at startup."""
+        self.backend = backend
+        if ttl_seconds is not None:
+            self.ttl_seconds = ttl_seconds
+        logging.info(f"Query cache using {type(backend).__name__} (ttl {self.ttl_seconds}s)")
+
+    def get(self, namespace, key, load):
+        """Returns the cached value of `key` in `namespace`, calling `load()` on a miss.
+
+        `load` must return something json.dumps() can encode.
+        """
+        try:
+            full_key = f"{namespace}:{self._version(namespace)}:{key}"
+            cached = self.backend.get(full_key)
+        except Exception as e:
+            self._count("backend_errors")
+            logging.warning(f"Query cache backend unavailable, loading {namespace}:{key} uncached: {e}")
+            return load()
+
+        if cached is not None:
+            self._count("hits")
+            return json.loads(cached)
+        self._count("misses")
+
+        with self._lock:
+            flight = self._in_flight.get(full_key)
+            leader = flight is None
+            if leader:
+                flight = self._in_flight[full_key] = _Flight()
+            else:
+                self._counters["shared"] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = self._load_once(full_key, load)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(full_key, None)
+            flight.done.set()
+
+    def invalidate(self, namespace):
+        """Makes every cached entry of `namespace` unreachable; call after committing new rows."""
+        try:
+            self.backend.incr(f"version:{namespace}")
+            self._count("invalidations")
+        except Exception as e:
+            self._count("backend_errors")
+            logging.error(f"Could not invalidate query cache namespace {namespace}: {e}")
+
+    def stats(self):
+        """Returns hit/miss/load counters and the hit ratio."""
+        with self._lock:
+            stats = dict(self._counters, backend=type(self.backend).__name__)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 3) if lookups else None
+        return stats
+
+    def _version(self, namespace):
+        return self.backend.get(f"version:{namespace}") or "0"
+
+    def _load_once(self, full_key, load):
+        """Loads and stores `full_key`, letting only one process on the backend run the query."""
+        lock_key = f"lock:{full_key}"
+        try:
+            acquired = self.backend.add(lock_key, "1", self.lock_seconds)
+        except Exception:
+            acquired = True
+
+        if not acquired:
+            # Another process is loading the same key: wait for its result
+            self._count("remote_waits")
+            deadline = time.monotonic() + self.lock_seconds
+            while time.monotonic() < deadline:
+                time.sleep(self.poll_seconds)
+                cached = self.backend.get(full_key)
+                if cached is not None:
+                    return json.loads(cached)
+
+        self._count("loads")
+        try:
+            value = load()
+            try:
+                self.backend.set(full_key, json.dumps(value), self.ttl_seconds)
+            except Exception as e:
+                self._count("backend_errors")
+                logging.warning(f"Could not store {full_key} in the query cache: {e}")
+            return value
+        finally:
+            if acquired:
+                try:
+                    self.backend.delete(lock_key)
+                except Exception:
+                    pass  # The lock expires on its own after lock_seconds
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+
+# Shared by the API and the ingest path in this process
+query_cache = QueryCache()
@@ -0,0 +1,295 @@
+"""
+Retention for raw samples and rollups.
+
+Policies come from `retention` in config.json, e.g.:
+
+    "retention": {
+        "raw_days": 7,                      device_metrics default
+        "third_party_days": 7,              third_parties
+        "metrics": {"CPU Usage": 30},       per-metric overrides for device_metrics
+        "rollup_days": {"60": 30, "3600": 365, "86400": 730},
+        "batch_size": 5000,
+        "use_partitions": false
+    }
+
+A missing entry means "keep forever". RetentionPruner deletes expired rows in small
+batches, each its own transaction found through a timestamp index, so no delete holds
+locks for long and ingest keeps flowing between batches.
+
+On MySQL, device_metrics and third_parties can instead be RANGE-partitioned by day
+(`python lib_database/retention.py --partition`); with "use_partitions" set the pruner
+then drops whole expired partitions, which is O(1) however many rows they hold, and
+keeps a few days of empty partitions ready ahead of time. InnoDB does not allow
+foreign keys on partitioned tables, so partitioning drops those two tables' foreign
+keys and widens their primary keys to (uuid, timestamp).
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import inspect, text
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import DeviceMetric, DeviceMetricRollup, Metric, ThirdParty, ThirdPartyRollup
+from lib_database.engine import get_engine, create_session
+from lib_utils.blocktimer import BlockTimer
+
+DEFAULT_BATCH_SIZE = 5000
+# Pause between delete batches so concurrent writers get the table
+BATCH_PAUSE_SECONDS = 0.05
+# Empty daily partitions kept ready ahead of today
+PARTITIONS_AHEAD_DAYS = 3
+PARTITIONED_TABLES = (DeviceMetric.__table__, ThirdParty.__table__)
+
+
+def _days_ago(days, now):
+    return None if days is None else now - timedelta(days=float(days))
+
+
+class RetentionPruner:
+    """Applies the retention policies in `settings` (the `retention` block of config.json)."""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.batch_size = settings.get("batch_size", DEFAULT_BATCH_SIZE)
+        self.use_partitions = settings.get("use_partitions", False)
+        self._counters = {"runs": 0, "rows_deleted": 0, "partitions_dropped": 0, "partitions_added": 0}
+        self._lock = threading.Lock()
+
+    def run(self, now=None):
+        """Prunes every table once; returns the number of rows deleted by batched deletes."""
+        now = now or datetime.utcnow()
+        deleted = 0
+        with BlockTimer("Applying retention", logging.getLogger(__name__)):
+            deleted += self._prune_device_metrics(now)
+            deleted += self._prune_raw(ThirdParty.__table__, _days_ago(self.settings.get("third_party_days"), now), now)
+            for resolution, days in self.settings.get("rollup_days", {}).items():
+                for model in (DeviceMetricRollup, ThirdPartyRollup):
+                    deleted += delete_before(
+                        model.__table__, model.bucket_start, _days_ago(days, now), self.batch_size,
+                        model.resolution == int(resolution)
+                    )
+        with self._lock:
+            self._counters["runs"] += 1
+            self._counters["rows_deleted"] += deleted
+        if deleted:
+            logging.info(f"Retention removed {deleted} rows")
+        return deleted
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def _prune_device_metrics(self, now):
+        default_cutoff = _days_ago(self.settings.get("raw_days"), now)
+        overrides = self.settings.get("metrics", {})
+        metric_ids = {}
+        if overrides:
+            with create_session() as session:
+                metric_ids = dict(session.query(Metric.name, Metric.uuid).filter(Metric.name.in_(list(overrides))).all())
+
+        table = DeviceMetric.__table__
+        deleted = 0
+        for name, metric_id in metric_ids.items():
+            deleted += delete_before(
+                table, table.c.timestamp, _days_ago(overrides[name], now), self.batch_size, table.c.metric_id == metric_id
+            )
+        if default_cutoff is None:
+            return deleted
+
+        if self.use_partitions and is_partitioned(table):
+            # Partitions hold every metric, so only drop days no override still needs
+            cutoffs = [default_cutoff] + [_days_ago(overrides[name], now) for name in metric_ids]
+            self._maintain_partitions(table, None if None in cutoffs else min(cutoffs), now)
+        others = table.c.metric_id.notin_(list(metric_ids.values())) if metric_ids else None
+        return deleted + delete_before(table, table.c.timestamp, default_cutoff, self.batch_size, others)
+
+    def _prune_raw(self, table, cutoff, now):
+        if cutoff is None:
+            return 0
+        if self.use_partitions and is_partitioned(table):
+            self._maintain_partitions(table, cutoff, now)
+        return delete_before(table, table.c.timestamp, cutoff, self.batch_size)
+
+    def _maintain_partitions(self, table, cutoff, now):
+        added = add_partitions(table, now + timedelta(days=PARTITIONS_AHEAD_DAYS))
+        dropped = drop_partitions_before(table, cutoff) if cutoff is not None else 0
+        with self._lock:
+            self._counters["partitions_added"] += added
+            self._counters["partitions_dropped"] += dropped
+
+
+def delete_before(table, time_column, cutoff, batch_size, condition=None):
+    """Deletes rows with time_column < cutoff in batches of about `batch_size`; returns rows deleted.
+
+    Each batch finds its upper bound by walking the time index from the oldest
+    row, then deletes below it in its own short transaction.
+    """
+    if cutoff is None:
+        return 0
+    conditions = [time_column < cutoff] + ([condition] if condition is not None else [])
+    deleted = 0
+    engine = get_engine()
+    while True:
+        with engine.begin() as connection:
+            boundary = connection.execute(
+                table.select().with_only_columns(time_column).where(*conditions)
+                .order_by(time_column).offset(batch_size).limit(1)
+            ).scalar()
+            # Fewer than batch_size rows left: everything below the cutoff goes
+            upper = time_column < boundary if boundary is not None else time_column < cutoff
+            result = connection.execute(table.delete().where(upper, *conditions))
+            if result.rowcount == 0 and boundary is not None:
+                # More than batch_size rows share the oldest timestamp
+                result = connection.execute(table.delete().where(time_column <= boundary, *conditions))
+        deleted += result.rowcount
+        if boundary is None:
+            return deleted
+        time.sleep(BATCH_PAUSE_SECONDS)
+
+
+def _partition_name(day):
+    return f"p{day:%Y%m%d}"
+
+
+def _partitions(connection, table):
+    """(name, upper bound day) of each RANGE partition of `table`, oldest first; the catch-all has None."""
+    rows = connection.execute(text(
+        "SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL "
+        "ORDER BY PARTITION_ORDINAL_POSITION"
+    ), {"table": table.name}).all()
+    partitions = []
+    for name, description in rows:
+        if description == "MAXVALUE":
+            partitions.append((name, None))
+        else:
+            upper = connection.execute(text("SELECT FROM_DAYS(:days)"), {"days": int(description)}).scalar()
+            partitions.append((name, datetime.combine(upper, datetime.min.time())))
+    return partitions
+
+
+def is_partitioned(table):
+    """True if `table` is a RANGE-partitioned MySQL table."""
+    engine = get_engine()
+    if engine.dialect.name != "mysql":
+        return False
+    with engine.connect() as connection:
+        return bool(_partitions(connection, table))
+
+
+def partition_table(table, start_day, ahead_days=PARTITIONS_AHEAD_DAYS):
+    """One-off migration: RANGE-partitions `table` by day from `start_day` (MySQL only).
+
+    Rebuilds the table, so run it in a maintenance window.
+    """
+    engine = get_engine()
+    if engine.dialect.name != "mysql":
+        raise RuntimeError("Partitioning is only supported on MySQL")
+    start_day = datetime.combine(start_day.date(), datetime.min.time())
+    days = (datetime.utcnow() - start_day).days + ahead_days + 1
+    definitions = [
+        f"PARTITION {_partition_name(start_day + timedelta(days=i))} "
+        f"VALUES LESS THAN (TO_DAYS('{(start_day + timedelta(days=i + 1)):%Y-%m-%d}'))"
+        for i in range(days)
+    ] + ["PARTITION pmax VALUES LESS THAN MAXVALUE"]
+
+    with engine.begin() as connection:
+        for foreign_key in inspect(connection).get_foreign_keys(table.name):
+            connection.execute(text(f"ALTER TABLE {table.name} DROP FOREIGN KEY {foreign_key['name']}"))
+        connection.execute(text(f"ALTER TABLE {table.name} DROP PRIMARY KEY, ADD PRIMARY KEY (uuid, timestamp)"))
+        connection.execute(text(
+            f"ALTER TABLE {table.name} PARTITION BY RANGE (TO_DAYS(timestamp)) ({', '.join(definitions)})"
+        ))
+    logging.info(f"Partitioned {table.name} into {days} daily partitions")
+
+
+def add_partitions(table, until):
+    """Splits the catch-all partition so there is a daily partition up to `until`. Returns partitions added."""
+    engine = get_engine()
+    with engine.begin() as connection:
+        partitions = _partitions(connection, table)
+        bounded = [upper for _, upper in partitions if upper is not None]
+        if not bounded:
+            return 0
+        day = max(bounded)
+        definitions = []
+        while day <= until:
+            definitions.append(
+                f"PARTITION {_partition_name(day)} VALUES LESS THAN (TO_DAYS('{(day + timedelta(days=1)):%Y-%m-%d}'))"
+            )
+            day += timedelta(days=1)
+        if definitions:
+            # pmax is empty in normal operation, so this is a metadata-only change
+            connection.execute(text(
+                f"ALTER TABLE {table.name} REORGANIZE PARTITION pmax INTO "
+                f"({', '.join(definitions)}, PARTITION pmax VALUES LESS THAN MAXVALUE)"
+            ))
+    return len(definitions)
+
+
+def drop_partitions_before(table, cutoff):
+    """Drops every daily partition whose rows are all older than `cutoff`. Returns partitions dropped."""
+    engine = get_engine()
+    with engine.begin() as connection:
+        expired = [name for name, upper in _partitions(connection, table) if upper is not None and upper <= cutoff]
+        if expired:
+            connection.execute(text(f"ALTER TABLE {table.name} DROP PARTITION {', '.join(expired)}"))
+            logging.info(f"Dropped {len(expired)} expired partitions of {table.name}")
+    return len(expired)
+
+
+class RetentionWorker:
+    """Background thread that runs the pruner every `interval_seconds`."""
+
+    def __init__(self, pruner, interval_seconds=3600):
+        self.pruner = pruner
+        self.interval_seconds = interval_seconds
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="retention-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=30):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval_seconds):
+            try:
+                self.pruner.run()
+            except Exception as e:
+                logging.error(f"Error applying retention: {e}", exc_info=True)
+
+
+def load_settings():
+    config_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config.json")
+    with open(config_path) as config_file:
+        return json.load(config_file).get("retention", {})
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Apply retention policies once, or partition the raw tables.")
+    parser.add_argument("--partition", action="store_true", help="RANGE-partition the raw tables by day (MySQL)")
+    args = parser.parse_args()
+
+    if args.partition:
+        for partitioned_table in PARTITIONED_TABLES:
+            with create_session() as session:
+                oldest = session.query(partitioned_table.c.timestamp).order_by(partitioned_table.c.timestamp).limit(1).scalar()
+            partition_table(partitioned_table, oldest or datetime.utcnow())
+    else:
+        print(f"Deleted {RetentionPruner(load_settings()).run()} rows")
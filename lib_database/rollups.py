@@ -0,0 +1,453 @@
+"""
+Time-series rollups for device_metrics and third_parties.
+
+Raw samples are aggregated into 1-minute, 1-hour and 1-day buckets (min, max, sum,
+count and last value) per series: (device, metric) for device metrics and
+ThirdPartyType for third-party data. Each level is rebuilt from the one below it,
+so rebuilding a bucket is idempotent and re-sent or late samples are never counted
+twice.
+
+The ingest path calls mark_dirty() with the timestamps it wrote; RollupWorker
+periodically rebuilds just those buckets. backfill() rebuilds a whole time range
+for data that was written before rollups existed:
+
+    python lib_database/rollups.py --backfill-days 30
+
+A rebuild only replaces the buckets its source level still has rows for, and skips
+buckets around the retention cutoff of that level (lib_database/retention.py), whose
+source rows may be partly pruned: backfilling or importing past the raw retention
+window leaves the minute, hour and day rows that outlive raw data untouched.
+
+query_series() answers a from/to/resolution request from the coarsest level whose
+bucket width divides the requested resolution, re-bucketing in Python if needed;
+iter_series() yields the same points, streaming raw samples.
+"""
+import argparse
+import logging
+import os
+import sys
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import tuple_
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import DeviceMetric, DeviceMetricRollup, ThirdParty, ThirdPartyRollup
+from lib_database.engine import create_session
+from lib_database.retention import load_settings as load_retention_settings
+from lib_utils.blocktimer import BlockTimer
+
+MINUTE = 60
+HOUR = 3600
+DAY = 86400
+# Rollup levels, finest first; each is rebuilt from the previous level (raw data for minutes)
+ROLLUP_RESOLUTIONS = (MINUTE, HOUR, DAY)
+
+RESOLUTION_SUFFIXES = {"s": 1, "m": MINUTE, "h": HOUR, "d": DAY}
+# Upper bound on points per series when the caller does not ask for a resolution
+MAX_POINTS_PER_SERIES = 1000
+# Upper bound on buckets per series when the caller does: a fine resolution over a long
+# range would aggregate that many buckets (reading raw rows below a minute) in memory
+MAX_BUCKETS_PER_SERIES = 100000
+
+_EPOCH = datetime(1970, 1, 1)
+# Stored rollup rows replaced per DELETE statement
+_DELETE_CHUNK = 500
+
+
+class _RollupKind:
+    """Where the raw and rolled-up rows of one fact table live, and which columns identify a series."""
+
+    def __init__(self, name, raw_model, rollup_model, series_columns):
+        self.name = name
+        self.raw_model = raw_model
+        self.rollup_model = rollup_model
+        self.series_columns = series_columns
+
+
+KINDS = {
+    "device": _RollupKind("device", DeviceMetric, DeviceMetricRollup, ("device_id", "metric_id")),
+    "third_party": _RollupKind("third_party", ThirdParty, ThirdPartyRollup, ("thirdparty_id",))
+}
+
+
+def bucket_start(timestamp, width):
+    """Start of the `width`-second bucket containing `timestamp` (naive UTC)."""
+    seconds = int((timestamp - _EPOCH).total_seconds())
+    return _EPOCH + timedelta(seconds=seconds - seconds % width)
+
+
+def parse_resolution(text):
+    """Parses "raw", a number of seconds, or a duration like "30s", "5m", "1h", "1d".
+
+    Returns the width in seconds, or None for raw samples.
+    """
+    text = text.strip().lower()
+    if text == "raw":
+        return None
+    if text[-1:] in RESOLUTION_SUFFIXES:
+        seconds = int(text[:-1]) * RESOLUTION_SUFFIXES[text[-1]]
+    else:
+        seconds = int(text)
+    if seconds <= 0:
+        raise ValueError(f"Resolution must be positive: {text}")
+    return seconds
+
+
+def check_resolution(start, end, resolution):
+    """Raises ValueError if [start, end) at `resolution` seconds has more than MAX_BUCKETS_PER_SERIES buckets."""
+    buckets = (end - start).total_seconds() / resolution
+    if buckets > MAX_BUCKETS_PER_SERIES:
+        finest = int((end - start).total_seconds() // MAX_BUCKETS_PER_SERIES) + 1
+        raise ValueError(
+            f"Resolution {resolution}s gives {buckets:.0f} points per series over this range "
+            f"(limit {MAX_BUCKETS_PER_SERIES}): use at least {finest}s or a shorter range"
+        )
+
+
+def auto_resolution(start, end, limit=MAX_POINTS_PER_SERIES):
+    """Finest rollup level (or raw) that keeps a series under `limit` points for [start, end)."""
+    span = (end - start).total_seconds()
+    if span <= limit * 5:  # Agents sample every 5s at most
+        return None
+    for width in ROLLUP_RESOLUTIONS:
+        if span / width <= limit:
+            return width
+    return DAY
+
+
+class _Aggregate:
+    __slots__ = ("min_value", "max_value", "sum_value", "sample_count", "last_value", "last_timestamp")
+
+    def __init__(self, min_value, max_value, sum_value, sample_count, last_value, last_timestamp):
+        self.min_value = min_value
+        self.max_value = max_value
+        self.sum_value = sum_value
+        self.sample_count = sample_count
+        self.last_value = last_value
+        self.last_timestamp = last_timestamp
+
+    def merge(self, min_value, max_value, sum_value, sample_count, last_value, last_timestamp):
+        self.min_value = min(self.min_value, min_value)
+        self.max_value = max(self.max_value, max_value)
+        self.sum_value += sum_value
+        self.sample_count += sample_count
+        if last_timestamp >= self.last_timestamp:
+            self.last_value = last_value
+            self.last_timestamp = last_timestamp
+
+
+def _aggregate(rows, width):
+    """Folds (series_key, timestamp, min, max, sum, count, last, last_timestamp) rows into width-second buckets."""
+    buckets = {}
+    for series_key, timestamp, *values in rows:
+        key = (series_key, bucket_start(timestamp, width))
+        aggregate = buckets.get(key)
+        if aggregate is None:
+            buckets[key] = _Aggregate(*values)
+        else:
+            aggregate.merge(*values)
+    return buckets
+
+
+def _source_rows(session, kind, source_width, start, end, series_filter=None, ordered=False):
+    """Rows of the level below, in the shape _aggregate() expects. source_width=None reads raw samples.
+
+    With `ordered`, raw samples come in series/time order (the raw tables' series index).
+    """
+    if source_width is None:
+        model = kind.raw_model
+        series = [getattr(model, column) for column in kind.series_columns]
+        query = session.query(*series, model.timestamp, model.value).filter(
+            model.timestamp >= start, model.timestamp < end
+        )
+        query = _apply_series_filter(query, model, kind, series_filter)
+        if ordered:
+            query = query.order_by(*series, model.timestamp)
+        for row in query.yield_per(10000):
+            *key, timestamp, value = row
+            yield tuple(key), timestamp, value, value, value, 1, value, timestamp
+        return
+
+    model = kind.rollup_model
+    series = [getattr(model, column) for column in kind.series_columns]
+    query = session.query(
+        *series, model.bucket_start, model.min_value, model.max_value, model.sum_value,
+        model.sample_count, model.last_value, model.last_timestamp
+    ).filter(model.resolution == source_width, model.bucket_start >= start, model.bucket_start < end)
+    query = _apply_series_filter(query, model, kind, series_filter)
+    for row in query.yield_per(10000):
+        count = len(kind.series_columns)
+        yield tuple(row[:count]), *row[count:]
+
+
+def _apply_series_filter(query, model, kind, series_filter):
+    """Restricts a query to the given {column: [ids]} filter, if any."""
+    for column, ids in (series_filter or {}).items():
+        if column in kind.series_columns:
+            query = query.filter(getattr(model, column).in_(ids))
+    return query
+
+
+_retention_settings = None
+
+
+def configure_retention(settings):
+    """Sets the retention policies (the `retention` block of config.json) rebuilds must respect."""
+    global _retention_settings
+    _retention_settings = settings or {}
+
+
+def _pruned_windows(kind_name, source_width, now=None):
+    """[start, end) ranges in which the pruner may have deleted part of the source level's rows.
+
+    The pruner deletes rows older than its cutoff every `interval_seconds`, so the
+    boundary of what remains lies somewhere in the interval before today's cutoff.
+    """
+    if _retention_settings is None:
+        try:
+            configure_retention(load_retention_settings())
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not read retention settings, rebuilding without them: {e}")
+            configure_retention({})
+    settings = _retention_settings
+    if source_width is not None:
+        days = [settings.get("rollup_days", {}).get(str(source_width))]
+    elif kind_name == "device":
+        days = [settings.get("raw_days")] + list(settings.get("metrics", {}).values())
+    else:
+        days = [settings.get("third_party_days")]
+    now = now or datetime.utcnow()
+    interval = timedelta(seconds=settings.get("interval_seconds", 3600))
+    windows = []
+    for value in days:
+        if value is not None:
+            cutoff = now - timedelta(days=float(value))
+            windows.append((cutoff - interval, cutoff))
+    return windows
+
+
+def _rebuild(session, kind, width, source_width, start, end):
+    """Recomputes the `width` buckets in [start, end) that the level below has rows for and replaces them.
+
+    Buckets without source rows keep what is stored (their source may have been pruned
+    by retention), and so do buckets overlapping a retention cutoff of the level below.
+    """
+    buckets = _aggregate(_source_rows(session, kind, source_width, start, end), width)
+    for window_start, window_end in _pruned_windows(kind.name, source_width):
+        if window_end > start and window_start < end:
+            first = bucket_start(window_start, width)
+            buckets = {
+                key: aggregate for key, aggregate in buckets.items()
+                if not first <= key[1] < window_end
+            }
+    model = kind.rollup_model
+    key_columns = [getattr(model, column) for column in kind.series_columns] + [model.bucket_start]
+    keys = [(*series_key, start_of_bucket) for series_key, start_of_bucket in buckets]
+    for offset in range(0, len(keys), _DELETE_CHUNK):
+        session.query(model).filter(
+            model.resolution == width, tuple_(*key_columns).in_(keys[offset:offset + _DELETE_CHUNK])
+        ).delete(synchronize_session=False)
+    rows = []
+    for (series_key, start_of_bucket), aggregate in buckets.items():
+        row = dict(zip(kind.series_columns, series_key))
+        row.update(
+            resolution=width,
+            bucket_start=start_of_bucket,
+            min_value=aggregate.min_value,
+            max_value=aggregate.max_value,
+            sum_value=aggregate.sum_value,
+            sample_count=aggregate.sample_count,
+            last_value=aggregate.last_value,
+            last_timestamp=aggregate.last_timestamp
+        )
+        rows.append(row)
+    if rows:
+        session.execute(model.__table__.insert(), rows)
+    return len(rows)
+
+
+def _ranges(bucket_starts, width):
+    """Coalesces bucket starts into contiguous [start, end) ranges."""
+    ranges = []
+    for start in sorted(bucket_starts):
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = start + timedelta(seconds=width)
+        else:
+            ranges.append([start, start + timedelta(seconds=width)])
+    return ranges
+
+
+def rebuild_range(kind_name, start, end):
+    """Rebuilds all rollup levels of one kind for the buckets overlapping [start, end)."""
+    kind = KINDS[kind_name]
+    with create_session() as session:
+        try:
+            source_width = None
+            for width in ROLLUP_RESOLUTIONS:
+                level_start = bucket_start(start, width)
+                level_end = bucket_start(end - timedelta(microseconds=1), width) + timedelta(seconds=width)
+                _rebuild(session, kind, width, source_width, level_start, level_end)
+                source_width = width
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+
+
+class RollupTracker:
+    """Remembers which minute buckets have new samples since the last refresh."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dirty = {name: set() for name in KINDS}
+
+    def mark_dirty(self, kind_name, timestamps):
+        """Records the minute buckets touched by freshly written samples."""
+        minutes = {bucket_start(timestamp, MINUTE) for timestamp in timestamps}
+        if minutes:
+            with self._lock:
+                self._dirty[kind_name].update(minutes)
+
+    def refresh(self):
+        """Rebuilds every dirty minute and the hour/day buckets above it. Returns the number of minutes rebuilt."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {name: set() for name in KINDS}
+
+        rebuilt = 0
+        for kind_name, minutes in dirty.items():
+            if not minutes:
+                continue
+            kind = KINDS[kind_name]
+            try:
+                with create_session() as session:
+                    with BlockTimer("Refreshing rollups", logging.getLogger(__name__), labels={"kind": kind_name}):
+                        buckets = minutes
+                        source_width = None
+                        for width in ROLLUP_RESOLUTIONS:
+                            buckets = {bucket_start(minute, width) for minute in buckets}
+                            for start, end in _ranges(buckets, width):
+                                _rebuild(session, kind, width, source_width, start, end)
+                            source_width = width
+                        session.commit()
+                rebuilt += len(minutes)
+            except Exception as e:
+                logging.error(f"Error refreshing {kind_name} rollups: {e}", exc_info=True)
+                # Keep the buckets so the next refresh tries again
+                with self._lock:
+                    self._dirty[kind_name].update(minutes)
+        return rebuilt
+
+    def pending(self):
+        with self._lock:
+            return {name: len(minutes) for name, minutes in self._dirty.items()}
+
+
+# Fed by update_database; drained by RollupWorker
+rollup_tracker = RollupTracker()
+
+
+def mark_dirty(kind_name, timestamps):
+    rollup_tracker.mark_dirty(kind_name, timestamps)
+
+
+class RollupWorker:
+    """Background thread that refreshes dirty rollup buckets every `interval_seconds`."""
+
+    def __init__(self, interval_seconds=30, tracker=rollup_tracker):
+        self.interval_seconds = interval_seconds
+        self.tracker = tracker
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="rollup-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=30):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval_seconds):
+            self.tracker.refresh()
+        self.tracker.refresh()
+
+
+def query_series(kind_name, start, end, resolution, series_filter=None):
+    """Returns aggregated points for [start, end) at `resolution` seconds (None = raw samples).
+
+    Each point is {series column..., "timestamp", "value" (mean), "min", "max", "count", "last"},
+    ordered by series then time. The range is widened to whole `resolution` buckets and
+    read from the coarsest rollup level whose width divides `resolution`.
+    """
+    return list(iter_series(kind_name, start, end, resolution, series_filter))
+
+
+def iter_series(kind_name, start, end, resolution, series_filter=None):
+    """query_series() as a generator. Raw samples are streamed from a server-side cursor
+    in series/time order, so a consumer that reduces them (see lib_utils.decimation)
+    never holds the whole range in memory.
+    """
+    kind = KINDS[kind_name]
+    if resolution is None:
+        with create_session() as session:
+            for series_key, timestamp, *values in _source_rows(session, kind, None, start, end, series_filter, ordered=True):
+                yield _point(kind, series_key, timestamp, values)
+        return
+
+    start = bucket_start(start, resolution)
+    end = bucket_start(end - timedelta(microseconds=1), resolution) + timedelta(seconds=resolution)
+    source_width = None
+    for width in ROLLUP_RESOLUTIONS:
+        if resolution % width == 0:
+            source_width = width
+    with create_session() as session:
+        buckets = _aggregate(_source_rows(session, kind, source_width, start, end, series_filter), resolution)
+    for (series_key, timestamp), a in sorted(buckets.items(), key=lambda item: item[0]):
+        yield _point(kind, series_key, timestamp, (
+            a.min_value, a.max_value, a.sum_value, a.sample_count, a.last_value, a.last_timestamp
+        ))
+
+
+def _point(kind, series_key, timestamp, values):
+    min_value, max_value, sum_value, sample_count, last_value, _ = values
+    point = dict(zip(kind.series_columns, series_key))
+    point.update(
+        timestamp=timestamp,
+        value=sum_value / sample_count,
+        min=min_value,
+        max=max_value,
+        count=sample_count,
+        last=last_value
+    )
+    return point
+
+
+def rebuild_by_day(kind_name, start, end):
+    """Rebuilds one kind's rollups for [start, end), one day at a time to bound memory."""
+    day = bucket_start(start, DAY)
+    while day < end:
+        with BlockTimer("Rebuilding rollups for a day", logging.getLogger(__name__), labels={"kind": kind_name}):
+            rebuild_range(kind_name, day, day + timedelta(days=1))
+        logging.info(f"Rebuilt {kind_name} rollups for {day.date()}")
+        day += timedelta(days=1)
+
+
+def backfill(days):
+    """Rebuilds rollups for the last `days` days."""
+    end = bucket_start(datetime.utcnow(), DAY) + timedelta(days=1)
+    for kind_name in KINDS:
+        rebuild_by_day(kind_name, end - timedelta(days=days), end)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Rebuild metric rollups from raw data.")
+    parser.add_argument("--backfill-days", type=int, default=1)
+    backfill(parser.parse_args().backfill_days)
@@ -0,0 +1,198 @@
+"""
+In-memory "current state" table: the latest value of every series.
+
+Series are (device, metric) for device metrics and ThirdPartyType (one location and
+data type) for third-party data. The ingest path calls update() with the rows it has
+just committed; rebuild() reloads everything from the database at startup with one
+latest-per-series query per table. Readers get constant-size answers straight from
+memory, so the dashboard never scans history just to show current values.
+
+Series keys are IDs; their display names are loaded by rebuild() and, for series
+registered later, fetched in one query on the first read that needs them.
+
+Listeners added with add_listener() are called after every update() with the
+labelled entries that changed, which is how lib_database.live_feed pushes new
+samples to dashboards without querying the database.
+"""
+import logging
+import os
+import sys
+import threading
+
+from sqlalchemy import and_, func
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import Device, DeviceMetric, Metric, ThirdParty, ThirdPartyType, third_party_name
+from lib_database.engine import create_session
+from lib_utils.blocktimer import BlockTimer
+
+
+class SnapshotStore:
+    """Thread-safe latest-value table for device metrics and third-party data."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._device_metrics = {}  # (device_id, metric_id) -> (value, timestamp)
+        self._third_parties = {}  # thirdparty_id -> (value, timestamp)
+        self._device_names = {}
+        self._metric_names = {}
+        self._third_party_types = {}  # thirdparty_id -> (type name, latitude, longitude, location_name)
+        self._counters = {"updates": 0, "rebuilds": 0, "label_loads": 0}
+        self._listeners = []
+
+    def rebuild(self, session):
+        """Loads the latest row of every series in the database into the snapshot."""
+        with BlockTimer("Rebuilding latest-value snapshot", logging.getLogger(__name__)):
+            latest_device = session.query(
+                DeviceMetric.device_id, DeviceMetric.metric_id, func.max(DeviceMetric.timestamp).label("timestamp")
+            ).group_by(DeviceMetric.device_id, DeviceMetric.metric_id).subquery()
+            device_rows = session.query(
+                DeviceMetric.device_id, DeviceMetric.metric_id, DeviceMetric.value, DeviceMetric.timestamp
+            ).join(latest_device, and_(
+                DeviceMetric.device_id == latest_device.c.device_id,
+                DeviceMetric.metric_id == latest_device.c.metric_id,
+                DeviceMetric.timestamp == latest_device.c.timestamp
+            )).all()
+
+            latest_third_party = session.query(
+                ThirdParty.thirdparty_id, func.max(ThirdParty.timestamp).label("timestamp")
+            ).group_by(ThirdParty.thirdparty_id).subquery()
+            third_party_rows = session.query(
+                ThirdParty.thirdparty_id, ThirdParty.value, ThirdParty.timestamp
+            ).join(latest_third_party, and_(
+                ThirdParty.thirdparty_id == latest_third_party.c.thirdparty_id,
+                ThirdParty.timestamp == latest_third_party.c.timestamp
+            )).all()
+
+            with self._lock:
+                # Merge rather than replace: samples ingested while the queries ran may be newer
+                for row in device_rows:
+                    self._keep_newer(self._device_metrics, (row.device_id, row.metric_id), (row.value, row.timestamp))
+                for row in third_party_rows:
+                    self._keep_newer(self._third_parties, row.thirdparty_id, (row.value, row.timestamp))
+                self._counters["rebuilds"] += 1
+            self._load_labels(session)
+        logging.info(f"Snapshot rebuilt: {len(device_rows)} device series, {len(third_party_rows)} third-party series")
+
+    def add_listener(self, listener):
+        """Calls listener(device_metric_entries, third_party_entries) with the series each update() changed."""
+        self._listeners.append(listener)
+
+    def update(self, device_metric_rows, third_party_rows):
+        """Applies freshly committed insert rows; older values never overwrite newer ones."""
+        changed_devices = set()
+        changed_third_parties = set()
+        with self._lock:
+            for row in device_metric_rows:
+                key = (row["device_id"], row["metric_id"])
+                if self._keep_newer(self._device_metrics, key, (row["value"], row["timestamp"])):
+                    changed_devices.add(key)
+            for row in third_party_rows:
+                if self._keep_newer(self._third_parties, row["thirdparty_id"], (row["value"], row["timestamp"])):
+                    changed_third_parties.add(row["thirdparty_id"])
+            self._counters["updates"] += 1
+
+        if self._listeners and (changed_devices or changed_third_parties):
+            device_entries = self.device_metrics(keys=changed_devices) if changed_devices else []
+            third_party_entries = self.third_parties(keys=changed_third_parties) if changed_third_parties else []
+            for listener in self._listeners:
+                try:
+                    listener(device_entries, third_party_entries)
+                except Exception as e:
+                    # A broken listener must never fail ingest
+                    logging.error(f"Snapshot listener failed: {e}", exc_info=True)
+
+    def device_metrics(self, device=None, metric=None, keys=None):
+        """Latest value of every device metric series, optionally for one device and/or metric name.
+
+        `keys` restricts the result to those (device_id, metric_id) series.
+        """
+        with self._lock:
+            if keys is None:
+                entries = list(self._device_metrics.items())
+            else:
+                entries = [(key, self._device_metrics[key]) for key in keys if key in self._device_metrics]
+        if any(device_id not in self._device_names or metric_id not in self._metric_names for (device_id, metric_id), _ in entries):
+            self._load_missing_labels()
+
+        snapshot = []
+        for (device_id, metric_id), (value, timestamp) in entries:
+            device_name = self._device_names.get(device_id)
+            metric_name = self._metric_names.get(metric_id)
+            if (device is not None and device_name != device) or (metric is not None and metric_name != metric):
+                continue
+            snapshot.append({"device_name": device_name, "metric_name": metric_name, "value": value, "timestamp": timestamp})
+        return snapshot
+
+    def third_parties(self, data_type=None, keys=None):
+        """Latest value per location, optionally for one data type ("Temperature", ...).
+
+        `keys` restricts the result to those ThirdPartyType IDs.
+        """
+        with self._lock:
+            if keys is None:
+                entries = list(self._third_parties.items())
+            else:
+                entries = [(key, self._third_parties[key]) for key in keys if key in self._third_parties]
+        if any(thirdparty_id not in self._third_party_types for thirdparty_id, _ in entries):
+            self._load_missing_labels()
+
+        snapshot = []
+        for thirdparty_id, (value, timestamp) in entries:
+            type_name, latitude, longitude, location_name = self._third_party_types.get(thirdparty_id, (None, None, None, None))
+            if data_type is not None and type_name != data_type:
+                continue
+            snapshot.append({
+                "name": third_party_name(location_name, type_name),
+                "type": type_name,
+                "value": value,
+                "latitude": latitude,
+                "longitude": longitude,
+                "location_name": location_name,
+                "timestamp": timestamp
+            })
+        return snapshot
+
+    def stats(self):
+        """Returns the series counts and update/rebuild counters."""
+        with self._lock:
+            return dict(self._counters, device_series=len(self._device_metrics), third_party_series=len(self._third_parties))
+
+    @staticmethod
+    def _keep_newer(table, key, entry):
+        """Stores `entry` under `key` unless the current entry is newer; the timestamp is entry[-1].
+
+        Returns True if the stored value changed.
+        """
+        current = table.get(key)
+        if current is None or (entry[-1] >= current[-1] and entry != current):
+            table[key] = entry
+            return True
+        return False
+
+    def _load_missing_labels(self):
+        """Fetches names for series registered since the last load."""
+        with create_session() as session:
+            self._load_labels(session)
+
+    def _load_labels(self, session):
+        device_names = dict(session.query(Device.uuid, Device.name).all())
+        metric_names = dict(session.query(Metric.uuid, Metric.name).all())
+        third_party_types = {
+            row.uuid: (row.name, float(row.latitude), float(row.longitude), row.location_name)
+            for row in session.query(
+                ThirdPartyType.uuid, ThirdPartyType.name, ThirdPartyType.latitude,
+                ThirdPartyType.longitude, ThirdPartyType.location_name
+            )
+        }
+        with self._lock:
+            # Replace rather than mutate so readers iterating the old dicts are unaffected
+            self._device_names = device_names
+            self._metric_names = metric_names
+            self._third_party_types = third_party_types
+            self._counters["label_loads"] += 1
+
+
+# Shared by the ingest path and the API in this process
+snapshot_store = SnapshotStore()
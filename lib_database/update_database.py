@@ -1,6 +1,4 @@
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
-from models import DeviceMetric, Metric, ThirdParty, ThirdPartyType, Device  # Import Device model
+from models import DeviceMetric, ThirdParty
 from datetime import datetime
 import os
 import sys
@@ -10,115 +8,260 @@ from tenacity import retry, stop_after_attempt, wait_fixed
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from lib_utils.blocktimer import BlockTimer  # Import BlockTimer
-
-# Database Configuration
-DATABASE_URL = os.getenv('DATABASE_URL')
-engine = create_engine(DATABASE_URL, connect_args={"connect_timeout": 60})
-SessionLocal = sessionmaker(bind=engine)  # Use a session factory
+from lib_database.lookup_cache import lookup_cache
+from lib_database.engine import create_session
+from lib_database.rollups import mark_dirty
+from lib_database.snapshot import snapshot_store
+from lib_database.hot_tier import hot_tier
+from lib_database.query_cache import query_cache
 
 # Setup logger
 logging.basicConfig(level=logging.INFO)
 
+# Device metric name -> MetricsDTO attribute
+DEVICE_METRIC_FIELDS = {
+    "CPU Usage": "cpu_usage",
+    "RAM Usage": "ram_usage"
+}
+
+# Third-party metric name -> key in each weather_and_air_quality_data entry
+THIRD_PARTY_METRIC_FIELDS = {
+    "Temperature": "temperature",
+    "Humidity": "humidity",
+    "Wind Speed": "wind_speed",
+    "Pressure": "pressure",
+    "Air Quality Index": "air_quality_index",
+    "Precipitation": "precipitation",
+    "UV Index": "uv_index"
+}
+
+# Largest number of samples accepted by update_database_batch in one call
+MAX_BATCH_SIZE = 1000
+
+# Matches the length of Metric.name
+MAX_METRIC_NAME_LENGTH = 255
+
+def sample_timestamp(metrics_dto, default):
+    """Returns the DTO's own sample time if it carries one, otherwise `default`."""
+    if not metrics_dto.timestamp:
+        return default
+    if isinstance(metrics_dto.timestamp, datetime):
+        return metrics_dto.timestamp
+    return datetime.fromisoformat(metrics_dto.timestamp)
+
+def row_uuid(metrics_dto, *parts):
+    """Row key for one value of a sample.
+
+    Samples carrying a sample_id get a deterministic uuid5 so that re-sending the
+    same sample produces the same keys and is skipped by insert_rows().
+    """
+    if not metrics_dto.sample_id:
+        return str(uuid.uuid4())
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, "/".join([str(metrics_dto.sample_id), *map(str, parts)])))
+
+def insert_rows(session, model, rows, ignore_duplicates=False):
+    """Multi-row INSERT of `rows`; with ignore_duplicates, rows whose key already exists are skipped."""
+    if not rows:
+        return
+    statement = model.__table__.insert()
+    if ignore_duplicates:
+        dialect = session.get_bind().dialect.name
+        if dialect == "mysql":
+            statement = statement.prefix_with("IGNORE")
+        elif dialect == "sqlite":
+            statement = statement.prefix_with("OR IGNORE")
+    session.execute(statement, rows)
+
 @retry(stop=stop_after_attempt(3), wait=wait_fixed(2))
 def update_database(metrics_dto):
     """Inserts device and third-party metrics into the database."""
-    timestamp = datetime.utcnow()
+    timestamp = sample_timestamp(metrics_dto, datetime.utcnow())
 
-    with SessionLocal() as session:
+    with create_session() as session:
         try:
-            with BlockTimer("Checking device existence", logging.getLogger(__name__)):
-                # 1. Check if the Device exists by `device_name`
-                device = session.query(Device).filter_by(name=metrics_dto.device_name).first()
-
-                if not device:
-                    # If device does not exist, create and insert it into the 'devices' table
-                    device = Device(
-                        uuid=str(uuid.uuid4()),  # Generate a new UUID for the new device
-                        name=metrics_dto.device_name,  # Using the device name passed in the DTO
-                        date_registered=timestamp
-                    )
-                    session.add(device)
-                    logging.info(f"New device added: {metrics_dto.device_name} with ID: {device.uuid}")
-                else:
-                    logging.info(f"Device already exists: {metrics_dto.device_name} with ID: {device.uuid}")
-
-            with BlockTimer("Getting metric types", logging.getLogger(__name__)):
-                # 2. Get Metric Type IDs dynamically (e.g., "CPU Usage" and "RAM Usage")
-                cpu_metric_type = session.query(Metric).filter_by(name="CPU Usage").first()
-                ram_metric_type = session.query(Metric).filter_by(name="RAM Usage").first()
-
-                if not (cpu_metric_type and ram_metric_type):
-                    raise ValueError("One or more device metric types are missing in the database.")
-
-            with BlockTimer("Inserting device metrics", logging.getLogger(__name__)):
-                # 3. Insert Device Metrics
-                cpu_metric = DeviceMetric(
-                    uuid=str(uuid.uuid4()),
-                    device_id=device.uuid,  # Use the uuid of the found or newly created device
-                    metric_id=cpu_metric_type.uuid,  # Corrected field name here
-                    value=metrics_dto.cpu_usage,
-                    timestamp=timestamp
-                )
-                ram_metric = DeviceMetric(
-                    uuid=str(uuid.uuid4()),
-                    device_id=device.uuid,  # Use the uuid of the found or newly created device
-                    metric_id=ram_metric_type.uuid,  # Corrected field name here
-                    value=metrics_dto.ram_usage,
-                    timestamp=timestamp
-                )
-                session.add_all([cpu_metric, ram_metric])
-
-            with BlockTimer("Preparing third-party metrics", logging.getLogger(__name__)):
-                # 4. Prepare Third-Party Metrics in bulk
-                third_party_metrics = []
-                for third_party_data in metrics_dto.weather_and_air_quality_data:
-                    location = third_party_data["name"]
-                    temp = third_party_data["temperature"]
-                    humidity = third_party_data["humidity"]
-                    wind_speed = third_party_data["wind_speed"]
-                    pressure = third_party_data["pressure"]
-                    air_quality_index = third_party_data["air_quality_index"]
-                    precipitation = third_party_data["precipitation"]
-                    uv_index = third_party_data["uv_index"]
-                    latitude = third_party_data.get("latitude")  # Use get to avoid KeyError
-                    longitude = third_party_data.get("longitude")  # Use get to avoid KeyError
-
-                    # 4.1 Get Third-Party Metric Types for Temperature, Humidity, etc.
-                    metric_types = {
-                        "Temperature": temp,
-                        "Humidity": humidity,
-                        "Wind Speed": wind_speed,
-                        "Pressure": pressure,
-                        "Air Quality Index": air_quality_index,
-                        "Precipitation": precipitation,
-                        "UV Index": uv_index
-                    }
-
-                    for metric_name, value in metric_types.items():
-                        # Get the ThirdPartyType ID dynamically for each metric
-                        third_party_type = session.query(ThirdPartyType).filter_by(name=metric_name, latitude=latitude, longitude=longitude).first()
-
-                        if not third_party_type:
-                            raise ValueError(f"Third-party type {metric_name} ({latitude}, {longitude}) not found in the database.")
-
-                        # Insert Third-Party Metric for each metric, now referencing the third_party_type that contains lat/lon
-                        third_party_metrics.append(ThirdParty(
-                            uuid=str(uuid.uuid4()),
-                            thirdparty_id=third_party_type.uuid,  # This links to the third-party type
-                            name=f"{location} {metric_name}",  # Use location and metric as the name
-                            value=value,
-                            timestamp=timestamp
-                        ))
-
-                # Insert all Third-Party Metrics in bulk
-                session.bulk_save_objects(third_party_metrics)
+            with BlockTimer("Resolving lookups and preparing rows", logging.getLogger(__name__)):
+                device_metric_rows, third_party_rows = _prepare_rows(metrics_dto, timestamp, session)
+
+            with BlockTimer("Inserting metrics", logging.getLogger(__name__)):
+                idempotent = bool(metrics_dto.sample_id)
+                insert_rows(session, DeviceMetric, device_metric_rows, ignore_duplicates=idempotent)
+                insert_rows(session, ThirdParty, third_party_rows, ignore_duplicates=idempotent)
 
             with BlockTimer("Committing changes", logging.getLogger(__name__)):
                 # Commit all changes at once
                 session.commit()  # Commit changes
                 logging.info("Data successfully updated in the database.")
+                after_commit(device_metric_rows, third_party_rows)
 
         except Exception as e:
             session.rollback()
             logging.error(f"Error during database update: {e}", exc_info=True)
-            raise e
\ No newline at end of file
+            raise e
+
+def update_database_batch(metrics_dtos):
+    """Inserts many MetricsDTOs in one transaction using multi-row INSERTs.
+
+    Lookups come from the shared lookup cache, so a warm batch issues no SELECTs.
+    Returns one {"index", "status"[, "error"]} dict per input, in input order;
+    rejected items are skipped while the rest of the batch is still written.
+    """
+    with create_session() as session:
+        try:
+            results, device_metric_rows, third_party_rows = write_batch(session, metrics_dtos)
+
+            with BlockTimer("Batch: committing changes", logging.getLogger(__name__)):
+                session.commit()
+                after_commit(device_metric_rows, third_party_rows)
+                logging.info(
+                    f"Batch of {len(metrics_dtos)} samples written: {len(device_metric_rows)} device metrics, "
+                    f"{len(third_party_rows)} third-party metrics."
+                )
+
+        except Exception as e:
+            session.rollback()
+            logging.error(f"Error during batch database update: {e}", exc_info=True)
+            raise e
+
+    return results
+
+def write_batch(session, metrics_dtos):
+    """Prepares and inserts a batch on `session` without committing.
+
+    Returns (results, device_metric_rows, third_party_rows); the caller commits and
+    then calls after_commit() with the rows. Shared by update_database_batch() and the
+    async ingest path, which runs it on an async driver's connection.
+    """
+    if len(metrics_dtos) > MAX_BATCH_SIZE:
+        raise ValueError(f"Batch of {len(metrics_dtos)} samples exceeds the limit of {MAX_BATCH_SIZE}.")
+
+    received_at = datetime.utcnow()
+    results = []
+    device_metric_rows = []
+    third_party_rows = []
+    # Rows of samples with a sample_id, whose re-sent duplicates are skipped, and the rest
+    keyed_rows = {DeviceMetric: [], ThirdParty: []}
+    plain_rows = {DeviceMetric: [], ThirdParty: []}
+
+    with BlockTimer("Batch: preparing rows", logging.getLogger(__name__)):
+        for index, dto in enumerate(metrics_dtos):
+            try:
+                item_device_rows, item_third_party_rows = _prepare_rows(dto, received_at, session)
+            except (ValueError, KeyError, TypeError) as e:
+                results.append({"index": index, "status": "rejected", "error": str(e)})
+                continue
+            device_metric_rows.extend(item_device_rows)
+            third_party_rows.extend(item_third_party_rows)
+            rows = keyed_rows if dto.sample_id else plain_rows
+            rows[DeviceMetric].extend(item_device_rows)
+            rows[ThirdParty].extend(item_third_party_rows)
+            results.append({"index": index, "status": "accepted"})
+
+    with BlockTimer("Batch: inserting rows", logging.getLogger(__name__)):
+        # Separate statements: on MySQL, IGNORE also turns truncation and foreign key
+        # errors into warnings, which must not drop rows that have no sample_id
+        for model in (DeviceMetric, ThirdParty):
+            insert_rows(session, model, keyed_rows[model], ignore_duplicates=True)
+            insert_rows(session, model, plain_rows[model])
+
+    return results, device_metric_rows, third_party_rows
+
+def after_commit(device_metric_rows, third_party_rows):
+    """Propagates freshly committed rows to rollups, the latest-value snapshot, the hot tier and cached reads."""
+    mark_dirty("device", {row["timestamp"] for row in device_metric_rows})
+    mark_dirty("third_party", {row["timestamp"] for row in third_party_rows})
+    snapshot_store.update(device_metric_rows, third_party_rows)
+    hot_tier.add(device_metric_rows, third_party_rows)
+    if third_party_rows:
+        query_cache.invalidate("weather_data")
+
+def validate_sample(metrics_dto, session):
+    """Raises ValueError (or KeyError/TypeError) if write_batch() would reject the DTO; writes nothing.
+
+    Lets the write-behind path answer 400 before queueing. Third-party types are
+    looked up through the lookup cache, so `session` only queries on a cache miss.
+    """
+    if metrics_dto is None:
+        raise ValueError("Sample must be a JSON object.")
+    if not metrics_dto.device_name:
+        raise ValueError("device_name is required.")
+    timestamp = sample_timestamp(metrics_dto, datetime.utcnow())
+    for _, metric_name, latitude, longitude, _ in _third_party_samples(metrics_dto):
+        if lookup_cache.third_party_type_id(session, metric_name, latitude, longitude) is None:
+            raise ValueError(f"Third-party type {metric_name} ({latitude}, {longitude}) not found in the database.")
+    _device_samples(metrics_dto, timestamp)
+
+def _prepare_rows(metrics_dto, received_at, session):
+    """Builds the insert rows for one DTO, raising ValueError if any part of it is invalid."""
+    if metrics_dto is None:
+        raise ValueError("Sample must be a JSON object.")
+    if not metrics_dto.device_name:
+        raise ValueError("device_name is required.")
+
+    timestamp = sample_timestamp(metrics_dto, received_at)
+    third_party_rows = []
+    for location, metric_name, latitude, longitude, value in _third_party_samples(metrics_dto):
+        type_id = lookup_cache.third_party_type_id(session, metric_name, latitude, longitude, location_name=location)
+        if type_id is None:
+            raise ValueError(f"Third-party type {metric_name} ({latitude}, {longitude}) not found in the database.")
+        third_party_rows.append({
+            "uuid": row_uuid(metrics_dto, location, metric_name),
+            "thirdparty_id": type_id,
+            "value": value,
+            "timestamp": timestamp
+        })
+
+    device_samples = _device_samples(metrics_dto, timestamp)
+
+    # Register the device only once the rest of the sample is known to be valid
+    device_id = lookup_cache.device_id(session, metrics_dto.device_name)
+    device_rows = []
+    for metric_name, value, sample_time, key_parts in device_samples:
+        device_rows.append({
+            "uuid": row_uuid(metrics_dto, *key_parts),
+            "device_id": device_id,
+            # Metric names not seen before are registered on first use
+            "metric_id": lookup_cache.metric_id(session, metric_name, create=True),
+            "value": value,
+            "timestamp": sample_time
+        })
+
+    return device_rows, third_party_rows
+
+def _third_party_samples(metrics_dto):
+    """Validated (location, metric_name, latitude, longitude, value) for every third-party value in the DTO."""
+    samples = []
+    for third_party_data in metrics_dto.weather_and_air_quality_data or []:
+        location = third_party_data["name"]
+        latitude = third_party_data.get("latitude")
+        longitude = third_party_data.get("longitude")
+        if latitude is None or longitude is None:
+            raise ValueError(f"Third-party data for {location} is missing latitude/longitude.")
+
+        for metric_name, field in THIRD_PARTY_METRIC_FIELDS.items():
+            value = third_party_data.get(field)
+            if value is not None:
+                samples.append((location, metric_name, latitude, longitude, float(value)))
+    return samples
+
+def _device_samples(metrics_dto, timestamp):
+    """Validated (metric_name, value, timestamp, row key parts) for every device metric in the DTO.
+
+    Covers both the legacy cpu_usage/ram_usage fields and the generic `metrics` list.
+    """
+    samples = []
+    for metric_name, field in DEVICE_METRIC_FIELDS.items():
+        value = getattr(metrics_dto, field)
+        if value is not None:
+            samples.append((metric_name, float(value), timestamp, (metric_name,)))
+
+    for metric in metrics_dto.metrics or []:
+        if not isinstance(metric, dict):
+            raise ValueError("Each entry in metrics must be an object.")
+        metric_name = metric.get("name")
+        if not isinstance(metric_name, str) or not metric_name.strip() or len(metric_name) > MAX_METRIC_NAME_LENGTH:
+            raise ValueError(f"Invalid metric name: {metric_name!r}.")
+        if metric.get("value") is None:
+            continue
+        sample_time = datetime.fromisoformat(metric["timestamp"]) if metric.get("timestamp") else timestamp
+        samples.append((metric_name, float(metric["value"]), sample_time, (metric_name, sample_time.isoformat())))
+    return samples
@@ -1,17 +1,12 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 import os
 import sys
 import logging
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from models import Base, ThirdPartyType
+from sqlalchemy import Index, func, inspect
 
-
-# Database Configuration
-DATABASE_URL = os.getenv('DATABASE_URL')
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(bind=engine)
+from models import Base, Device, DeviceMetric, DeviceMetricRollup, Metric, ThirdPartyType
+from lib_database.engine import get_engine, create_session
 
 LOCATIONS = [
     ("Dublin", 53.349804, -6.260310),
@@ -27,7 +22,7 @@ LOCATIONS = [
 ]
 
 def update_location_names():
-    session = SessionLocal()
+    session = create_session()
     try:
         third_party_types = session.query(ThirdPartyType).all()
         for tpt in third_party_types:
@@ -42,5 +37,91 @@ def update_location_names():
     finally:
         session.close()
 
-# Run the update
-update_location_names()
\ No newline at end of file
+def deduplicate_names():
+    """Merges Devices (and Metrics) that share a name into the oldest one, so names can be made unique.
+
+    Before names were unique, two ingest threads seeing a new device at once could
+    each register it. The duplicates' samples are re-pointed to the kept row and
+    their rollups folded into its rollups; the rows themselves are then deleted.
+    """
+    merged = 0
+    with create_session() as session:
+        try:
+            for model, order, sample_column, rollup_column in (
+                (Device, Device.date_registered, DeviceMetric.device_id, DeviceMetricRollup.device_id),
+                (Metric, Metric.uuid, DeviceMetric.metric_id, DeviceMetricRollup.metric_id)
+            ):
+                names = [name for name, in session.query(model.name).group_by(model.name).having(func.count() > 1)]
+                for name in names:
+                    ids = [row_id for row_id, in session.query(model.uuid).filter(model.name == name).order_by(order, model.uuid)]
+                    keep, duplicates = ids[0], ids[1:]
+                    session.query(DeviceMetric).filter(sample_column.in_(duplicates)).update(
+                        {sample_column: keep}, synchronize_session=False
+                    )
+                    _merge_rollups(session, rollup_column, keep, duplicates)
+                    session.query(model).filter(model.uuid.in_(duplicates)).delete(synchronize_session=False)
+                    merged += len(duplicates)
+                    logging.info(f"Merged {len(duplicates)} duplicate {model.__tablename__} rows named {name!r}")
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+    return merged
+
+def _merge_rollups(session, column, keep, duplicates):
+    """Moves the duplicates' rollup rows to `keep`, combining them with any bucket `keep` already has."""
+    def key(row, series_id):
+        return (row.resolution, row.bucket_start, series_id,
+                row.metric_id if column.key == "device_id" else row.device_id)
+
+    existing = {key(row, keep): row for row in session.query(DeviceMetricRollup).filter(column == keep)}
+    for row in session.query(DeviceMetricRollup).filter(column.in_(duplicates)).all():
+        target = existing.get(key(row, keep))
+        if target is None:
+            setattr(row, column.key, keep)
+            existing[key(row, keep)] = row
+            continue
+        # Disjoint samples of the same series and bucket
+        target.min_value = min(target.min_value, row.min_value)
+        target.max_value = max(target.max_value, row.max_value)
+        target.sum_value += row.sum_value
+        target.sample_count += row.sample_count
+        if row.last_timestamp > target.last_timestamp:
+            target.last_value, target.last_timestamp = row.last_value, row.last_timestamp
+        session.delete(row)
+    session.flush()
+
+def create_unique_name_indexes():
+    """Enforces unique Device/Metric names on tables created before models.py declared them.
+
+    create_all() never alters an existing table, and lookup_cache relies on the
+    IntegrityError to resolve two threads registering the same name. Run after
+    deduplicate_names().
+    """
+    engine = get_engine()
+    inspector = inspect(engine)
+    for model in (Device, Metric):
+        table = model.__tablename__
+        unique = [constraint["column_names"] for constraint in inspector.get_unique_constraints(table)]
+        unique += [index["column_names"] for index in inspector.get_indexes(table) if index["unique"]]
+        if ["name"] not in unique:
+            Index(f"uq_{table}_name", model.__table__.c.name, unique=True).create(engine)
+            logging.info(f"Created unique index on {table}.name")
+
+def create_missing_indexes():
+    """Create indexes added to models.py after the tables were first created."""
+    engine = get_engine()
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(engine, checkfirst=True)
+            except Exception as e:
+                logging.error(f"Error creating index {index.name}: {str(e)}")
+
+if __name__ == "__main__":
+    # Run the update
+    logging.basicConfig(level=logging.INFO)
+    deduplicate_names()
+    create_unique_name_indexes()
+    create_missing_indexes()
+    update_location_names()
\ No newline at end of file
@@ -0,0 +1,144 @@
+"""
+Write-behind ingest queue.
+
+The HTTP handler validates a MetricsDTO, puts it on a bounded in-memory queue and
+returns immediately. A single background writer drains the queue and group-commits
+samples through update_database_batch, flushing when either `max_batch_size`
+samples are waiting or `max_delay_seconds` has passed since the first one arrived.
+
+Samples still on the queue are lost if the process dies, which is the trade-off
+for taking database latency off the request path.
+"""
+import logging
+import queue
+import threading
+import time
+
+from lib_database.update_database import update_database_batch, MAX_BATCH_SIZE
+
+
+class QueueFullError(Exception):
+    """Raised by submit() when the queue is at capacity; callers should answer 429."""
+
+
+class WriteBehindQueue:
+    """Bounded queue of MetricsDTOs drained by one background group-commit writer."""
+
+    def __init__(self, max_queue_size=10000, max_batch_size=500, max_delay_seconds=1.0,
+                 write_attempts=3, retry_wait_seconds=2, write_batch=update_database_batch):
+        self.max_batch_size = min(max_batch_size, MAX_BATCH_SIZE)
+        self.max_delay_seconds = max_delay_seconds
+        self.write_attempts = write_attempts
+        self.retry_wait_seconds = retry_wait_seconds
+        self._write_batch = write_batch
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0,
+            "rejected_queue_full": 0,
+            "written": 0,
+            "rejected_invalid": 0,
+            "failed": 0,
+            "batches": 0,
+            "last_batch_size": 0,
+            "max_batch_size_seen": 0,
+            "commit_seconds_total": 0.0,
+            "last_commit_seconds": 0.0,
+            "max_commit_seconds": 0.0
+        }
+
+    def start(self):
+        """Starts the background writer if it is not already running."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="write-behind-writer", daemon=True)
+        self._thread.start()
+        logging.info(
+            f"Write-behind writer started (queue={self._queue.maxsize}, batch={self.max_batch_size}, "
+            f"delay={self.max_delay_seconds}s)"
+        )
+
+    def stop(self, timeout=30):
+        """Stops the writer after flushing whatever is still queued."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def submit(self, metrics_dto):
+        """Queues one sample without blocking; raises QueueFullError when at capacity."""
+        try:
+            self._queue.put_nowait(metrics_dto)
+        except queue.Full:
+            with self._stats_lock:
+                self._stats["rejected_queue_full"] += 1
+            raise QueueFullError(f"Ingest queue is full ({self._queue.maxsize} samples)")
+        with self._stats_lock:
+            self._stats["enqueued"] += 1
+
+    def stats(self):
+        """Returns queue depth plus batch-size and commit-latency counters."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["queue_depth"] = self._queue.qsize()
+        stats["queue_capacity"] = self._queue.maxsize
+        stats["avg_commit_seconds"] = stats["commit_seconds_total"] / stats["batches"] if stats["batches"] else 0.0
+        stats["running"] = self._thread is not None and self._thread.is_alive()
+        return stats
+
+    def _run(self):
+        while not (self._stop_event.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._write(batch)
+
+    def _next_batch(self):
+        """Blocks for the first sample, then gathers more until the batch is full or the delay expires."""
+        try:
+            batch = [self._queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.max_delay_seconds
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stop_event.is_set():
+                # Shutting down: take what is already queued without waiting
+                remaining = 0
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        for attempt in range(1, self.write_attempts + 1):
+            start = time.perf_counter()
+            try:
+                results = self._write_batch(batch)
+            except Exception as e:
+                logging.error(f"Write-behind commit of {len(batch)} samples failed (attempt {attempt}/{self.write_attempts}): {e}")
+                if attempt < self.write_attempts:
+                    time.sleep(self.retry_wait_seconds)
+                continue
+
+            elapsed = time.perf_counter() - start
+            rejected = [result for result in results if result["status"] != "accepted"]
+            for result in rejected:
+                logging.warning(f"Write-behind sample rejected: {result.get('error')}")
+            with self._stats_lock:
+                self._stats["batches"] += 1
+                self._stats["written"] += len(batch) - len(rejected)
+                self._stats["rejected_invalid"] += len(rejected)
+                self._stats["last_batch_size"] = len(batch)
+                self._stats["max_batch_size_seen"] = max(self._stats["max_batch_size_seen"], len(batch))
+                self._stats["commit_seconds_total"] += elapsed
+                self._stats["last_commit_seconds"] = elapsed
+                self._stats["max_commit_seconds"] = max(self._stats["max_commit_seconds"], elapsed)
+            return
+
+        with self._stats_lock:
+            self._stats["failed"] += len(batch)
+        logging.error(f"Dropping {len(batch)} samples after {self.write_attempts} failed commit attempts")
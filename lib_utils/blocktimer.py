@@ -1,41 +1,205 @@
 """
 Library module for utility functions for the application.
-BlockTimer is a RAII timer that measures and logs execution time of a code block.
+BlockTimer is a RAII timer that measures the execution time of a code block.
+
+Every block is recorded into an in-process latency histogram keyed by block name
+and labels (see `block_timings`), which both Flask apps expose as Prometheus text
+on /metrics. Log lines are optional: `configure_block_timers` sets how many blocks
+of each kind are logged (by default every one, as before).
+
+Block names should be constant, with the variable parts passed as labels, so that
+repeated blocks aggregate into one histogram:
+
+    with BlockTimer("Collector", logger, labels={"collector": "host"}):
+        ...
 
 Does have test code to demonstrate usage at the bottom of the file.
 """
+import bisect
+import os
+import threading
 import time
 import logging
 
+# Upper bounds in seconds of the histogram buckets: 1, 2.5, 5 per decade from 10us to 50s
+BUCKET_BOUNDS = tuple(m * 10.0 ** e for e in range(-5, 2) for m in (1, 2.5, 5))
+QUANTILES = (0.5, 0.95, 0.99)
+_BUCKET_BOUNDS_NS = tuple(round(bound * 1e9) for bound in BUCKET_BOUNDS)
+
+
+class LatencyHistogram:
+    """Bucketed durations, total time, count and error count of one (block name, labels) series."""
+
+    __slots__ = ("name", "labels", "buckets", "count", "errors", "total_ns", "_lock")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)  # Last bucket is +Inf
+        self.count = 0
+        self.errors = 0
+        self.total_ns = 0
+        self._lock = threading.Lock()
+
+    def observe(self, duration_ns, error=False):
+        """Records one block; returns how many blocks this series has recorded."""
+        index = bisect.bisect_left(_BUCKET_BOUNDS_NS, duration_ns)
+        with self._lock:
+            self.buckets[index] += 1
+            self.total_ns += duration_ns
+            self.count += 1
+            if error:
+                self.errors += 1
+            return self.count
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.buckets), self.count, self.errors, self.total_ns
+
+    @staticmethod
+    def quantile(buckets, count, q):
+        """Estimates the q-quantile in seconds by interpolating inside its bucket, like PromQL's histogram_quantile."""
+        if count == 0:
+            return None
+        rank = q * count
+        seen = 0
+        for index, bucket_count in enumerate(buckets):
+            if bucket_count and seen + bucket_count >= rank:
+                if index == len(BUCKET_BOUNDS):
+                    return BUCKET_BOUNDS[-1]  # Beyond the largest bound: report the bound
+                lower = BUCKET_BOUNDS[index - 1] if index else 0.0
+                return lower + (BUCKET_BOUNDS[index] - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return BUCKET_BOUNDS[-1]
+
+
+class BlockTimings:
+    """Thread-safe registry of the latency histograms recorded by BlockTimer in this process."""
+
+    def __init__(self):
+        self._histograms = {}  # (name, ((label, value), ...)) -> LatencyHistogram
+        self._lock = threading.Lock()
+        self.log_every = int(os.getenv("BLOCKTIMER_LOG_EVERY", "1"))
+
+    def histogram(self, name, labels=()):
+        key = (name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, LatencyHistogram(name, labels))
+        return histogram
+
+    def stats(self):
+        """Count, errors, mean and estimated p50/p95/p99 in milliseconds of every series."""
+        with self._lock:
+            histograms = list(self._histograms.values())
+        stats = []
+        for histogram in histograms:
+            buckets, count, errors, total_ns = histogram.snapshot()
+            entry = {"block": histogram.name, "labels": dict(histogram.labels), "count": count, "errors": errors,
+                     "mean_ms": round(total_ns / count / 1e6, 3) if count else None}
+            for q in QUANTILES:
+                value = LatencyHistogram.quantile(buckets, count, q)
+                entry[f"p{round(q * 100)}_ms"] = None if value is None else round(value * 1e3, 3)
+            stats.append(entry)
+        return sorted(stats, key=lambda entry: (entry["block"], sorted(entry["labels"].items())))
+
+    def render_prometheus(self, prefix="sysmonitor"):
+        """Prometheus text exposition (version 0.0.4) of every series."""
+        with self._lock:
+            histograms = sorted(self._histograms.values(), key=lambda histogram: (histogram.name, histogram.labels))
+        durations = [
+            f"# HELP {prefix}_block_duration_seconds Time spent in BlockTimer blocks.",
+            f"# TYPE {prefix}_block_duration_seconds histogram"
+        ]
+        errors = [
+            f"# HELP {prefix}_block_errors_total BlockTimer blocks that raised.",
+            f"# TYPE {prefix}_block_errors_total counter"
+        ]
+        quantiles = [
+            f"# HELP {prefix}_block_duration_quantile_seconds Quantiles estimated from the block duration histogram.",
+            f"# TYPE {prefix}_block_duration_quantile_seconds gauge"
+        ]
+        for histogram in histograms:
+            buckets, count, error_count, total_ns = histogram.snapshot()
+            labels = _format_labels((("block", histogram.name),) + histogram.labels)
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKET_BOUNDS + (None,), buckets):
+                cumulative += bucket_count
+                le = "+Inf" if bound is None else repr(bound)
+                durations.append(f'{prefix}_block_duration_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+            durations.append(f"{prefix}_block_duration_seconds_sum{{{labels}}} {total_ns / 1e9}")
+            durations.append(f"{prefix}_block_duration_seconds_count{{{labels}}} {count}")
+            errors.append(f"{prefix}_block_errors_total{{{labels}}} {error_count}")
+            for q in QUANTILES:
+                value = LatencyHistogram.quantile(buckets, count, q)
+                if value is not None:
+                    quantiles.append(f'{prefix}_block_duration_quantile_seconds{{{labels},quantile="{q}"}} {value}')
+        return "\n".join(durations + errors + quantiles) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+
+
+def _format_labels(labels):
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for name, value in labels
+    )
+    return ",".join(f'{name}="{value}"' for name, value in escaped)
+
+
+# Shared by every BlockTimer in this process
+block_timings = BlockTimings()
+
+
+def configure_block_timers(settings):
+    """Applies the `instrumentation` block of config.json.
+
+    "log_every": log one block in N of each series (1 = every block, 0 = never);
+    the histograms record every block either way.
+    """
+    block_timings.log_every = int(settings.get("log_every", block_timings.log_every))
+
+
 class BlockTimer:
-    """RAII timer that measures and logs execution time of a code block."""
-    
-    def __init__(self, block_name: str, logger: logging.Logger):
+    """RAII timer that records the execution time of a code block and optionally logs it."""
+
+    __slots__ = ("block_name", "logger", "labels", "start_time")
+
+    def __init__(self, block_name: str, logger: logging.Logger, labels: dict = None):
         """Initialize the timer with a name for the code block being timed.
-        
+
         Args:
-            block_name (str): Name to identify this timed block in logs
+            block_name (str): Name to identify this timed block in logs and /metrics
             logger (logging.Logger): Logger instance to use for output
+            labels (dict): Optional low-cardinality labels, e.g. {"collector": "host"}
         """
         self.block_name = block_name
         self.logger = logger
-        
+        self.labels = tuple(labels.items()) if labels else ()
+
     def __enter__(self):
         """Start timing when entering the context."""
         self.start_time = time.perf_counter_ns()
         return self
-        
+
     def __exit__(self, exc_type, exc_val, exc_tb):
-        """Log the elapsed time when exiting the context."""
-        end_time = time.perf_counter_ns()
-        duration_ms = (end_time - self.start_time) / 1_000_000  # Convert ns to ms
-        self.logger.info("%s took %.2fms to execute", self.block_name, duration_ms)
+        """Record the elapsed time, and log it if this block is sampled for logging."""
+        duration_ns = time.perf_counter_ns() - self.start_time
+        count = block_timings.histogram(self.block_name, self.labels).observe(duration_ns, exc_type is not None)
+        log_every = block_timings.log_every
+        if log_every and (count - 1) % log_every == 0 and self.logger.isEnabledFor(logging.INFO):
+            label_text = f" ({_format_labels(self.labels)})" if self.labels else ""
+            self.logger.info("%s%s took %.2fms to execute", self.block_name, label_text, duration_ns / 1_000_000)
 
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
     logger = logging.getLogger(__name__)
-    
+
     with BlockTimer("main", logger) as timer:
         print("This is a test block to measure execution time.")
-        time.sleep(1)  # Simulate some work
\ No newline at end of file
+        time.sleep(1)  # Simulate some work
+    print(block_timings.render_prometheus())
@@ -0,0 +1,137 @@
+"""
+Chart decimation: reduce a series to at most `max_points` points that still draw like the original.
+
+  lttb     Largest-Triangle-Three-Buckets: keeps the first and last points and, from each
+           of max_points - 2 equal time buckets, the point forming the largest triangle
+           with the point kept before it and the average of the next bucket. Follows
+           the shape of the line.
+  minmax   The lowest and highest point of each of max_points // 2 equal time buckets,
+           in time order. Keeps every spike, at the cost of a jagged line.
+
+Both take points in rollups.query_series() format, ordered by series then time, as
+an iterator: they hold at most two buckets of one series at a time, so decimating
+iter_series() over a server-side cursor uses the same memory for a day as for a year.
+A series that already has at most max_points points is passed through unchanged.
+"""
+from itertools import chain, groupby, islice
+
+
+def _bucket_index(point, start, width, buckets):
+    index = int((point["timestamp"] - start).total_seconds() / width)
+    return min(max(index, 0), buckets - 1)
+
+
+def _x(point, start):
+    return (point["timestamp"] - start).total_seconds()
+
+
+def _peek(points, max_points):
+    """Returns (head, rest): head is the whole series if it has at most max_points points, else rest continues it."""
+    head = list(islice(points, max_points + 1))
+    if len(head) <= max_points:
+        return head, None
+    return head, points
+
+
+def lttb(points, start, end, max_points):
+    """Largest-Triangle-Three-Buckets over one series' time-ordered points (max_points >= 3)."""
+    points = iter(points)
+    head, rest = _peek(points, max_points)
+    if rest is None:
+        yield from head
+        return
+
+    buckets = max_points - 2
+    width = max((end - start).total_seconds() / buckets, 1e-6)
+    kept = head[0]
+    yield kept
+    # The newest point is held back so the last point is always kept as is
+    tail = None
+    selecting, selecting_index = [], None
+    following, following_index = [], None
+
+    def select(candidates, previous, next_x, next_y):
+        previous_x, previous_y = _x(previous, start), previous["value"]
+        best, best_area = candidates[0], -1.0
+        for candidate in candidates:
+            area = abs((previous_x - next_x) * (candidate["value"] - previous_y)
+                       - (previous_x - _x(candidate, start)) * (next_y - previous_y))
+            if area > best_area:
+                best, best_area = candidate, area
+        return best
+
+    for point in chain(head[1:], rest):
+        if tail is not None:
+            index = _bucket_index(tail, start, width, buckets)
+            if index == following_index:
+                following.append(tail)
+            elif selecting_index is None or index == selecting_index:
+                selecting.append(tail)
+                selecting_index = index
+            else:
+                if following:
+                    # A third bucket begins: the selecting bucket can be decided
+                    next_x = sum(_x(p, start) for p in following) / len(following)
+                    next_y = sum(p["value"] for p in following) / len(following)
+                    kept = select(selecting, kept, next_x, next_y)
+                    yield kept
+                    selecting, selecting_index = following, following_index
+                following, following_index = [tail], index
+        tail = point
+
+    for bucket in (selecting, following):
+        if bucket:
+            if bucket is selecting and following:
+                next_x = sum(_x(p, start) for p in following) / len(following)
+                next_y = sum(p["value"] for p in following) / len(following)
+            else:
+                next_x, next_y = _x(tail, start), tail["value"]
+            kept = select(bucket, kept, next_x, next_y)
+            yield kept
+    yield tail
+
+
+def minmax(points, start, end, max_points):
+    """The minimum and maximum point of each time bucket of one series' time-ordered points (max_points >= 2)."""
+    points = iter(points)
+    head, rest = _peek(points, max_points)
+    if rest is None:
+        yield from head
+        return
+
+    buckets = max_points // 2
+    width = max((end - start).total_seconds() / buckets, 1e-6)
+    low = high = None
+    current = None
+    for point in chain(head, rest):
+        index = _bucket_index(point, start, width, buckets)
+        if index != current:
+            if low is not None:
+                yield from _in_time_order(low, high)
+            low = high = point
+            current = index
+        elif point["value"] < low["value"]:
+            low = point
+        elif point["value"] > high["value"]:
+            high = point
+    if low is not None:
+        yield from _in_time_order(low, high)
+
+
+def _in_time_order(low, high):
+    if low is high:
+        return (low,)
+    return (low, high) if low["timestamp"] <= high["timestamp"] else (high, low)
+
+
+METHODS = {"lttb": lttb, "minmax": minmax}
+# Smallest max_points each method can honour
+MIN_POINTS = {"lttb": 3, "minmax": 2}
+
+
+def decimate_series(points, series_columns, start, end, max_points, method="lttb"):
+    """Decimates every series of `points` (ordered by series then time) to at most max_points points."""
+    decimate = METHODS[method]
+    key = lambda point: tuple(point[column] for column in series_columns)
+    for _, series in groupby(points, key=key):
+        yield from decimate(series, start, end, max_points)
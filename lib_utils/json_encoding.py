@@ -0,0 +1,24 @@
+"""
+Compact JSON encoding for API responses.
+
+Flask's default encoder writes datetimes as RFC 822 strings ("Thu, 01 Jan 2026 00:00:00 GMT")
+and pads its output with whitespace. dumps() writes ISO-8601 timestamps, which sort and
+parse cheaply in the browser, with no padding, and handles the Decimal values of the
+latitude/longitude columns.
+"""
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(payload):
+    """Serializes `payload` as compact JSON with ISO-8601 timestamps."""
+    return json.dumps(payload, separators=(",", ":"), default=_default)
@@ -0,0 +1,325 @@
+"""
+Compact binary encoding for agent -> server sample uploads.
+
+JSON repeats every key name in every sample and every weather location, and spells
+each number and timestamp out in text. A frame stores a batch column by column
+instead: key names are implied by the column order, repeated strings (device,
+metric and location names) are dictionary-encoded, numbers are raw float64s and
+timestamps are delta-encoded int64 microseconds, so a batch of samples taken at a
+steady interval compresses to a few bytes per timestamp.
+
+    frame   := b"SMW1" uint32 sample_count column*   (all integers little-endian)
+    column  := string:  uint32 length, JSON list of distinct values, then uint32 index per value
+               float:   float64 per value, NaN for missing
+               time:    uint8 present flag per value, then int64 delta from the previous present value
+               uuid:    16 raw bytes per value, all zero for missing
+               count:   uint32 per sample (entries in a nested list)
+
+Sample columns, in order: sample_id, timestamp, device_id, device_name, cpu_usage,
+ram_usage; metrics count, name, value, timestamp; weather count, name, then
+WEATHER_FIELDS. Samples that do not fit this shape (unknown keys, a sample_id that
+is not a canonical UUID, timezone-aware timestamps) raise ValueError, and callers
+fall back to JSON, which stays supported everywhere.
+
+Bodies are compressed with gzip, or with zstd when the optional `zstandard`
+package is installed on both ends.
+"""
+import gzip
+import json
+import math
+import struct
+import sys
+import uuid
+from array import array
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+JSON_CONTENT_TYPE = "application/json"
+FRAME_CONTENT_TYPE = "application/vnd.sysmonitor.frame"
+MAGIC = b"SMW1"
+
+SAMPLE_KEYS = {
+    "sample_id", "timestamp", "device_id", "device_name", "cpu_usage", "ram_usage", "metrics", "weather_and_air_quality_data"
+}
+METRIC_KEYS = {"name", "value", "timestamp"}
+WEATHER_FIELDS = (
+    "temperature", "humidity", "wind_speed", "pressure", "air_quality_index", "precipitation", "uv_index",
+    "latitude", "longitude"
+)
+
+_EPOCH = datetime(1970, 1, 1)
+_SECOND = timedelta(seconds=1)
+_MICROSECOND = timedelta(microseconds=1)
+_NO_UUID = bytes(16)
+_LITTLE_ENDIAN = sys.byteorder == "little"
+
+
+class UnsupportedFormatError(ValueError):
+    """A Content-Type or Content-Encoding this process cannot read (HTTP 415)."""
+
+
+def available_encodings():
+    """Content-Encodings this process can produce and read, preferred first."""
+    try:
+        import zstandard  # noqa: F401
+        return ["zstd", "gzip", "identity"]
+    except ImportError:
+        return ["gzip", "identity"]
+
+
+def compress(body, encoding):
+    if encoding == "gzip":
+        return gzip.compress(body, 6)
+    if encoding == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=6).compress(body)
+    if encoding in ("identity", None, ""):
+        return body
+    raise UnsupportedFormatError(f"Unsupported Content-Encoding: {encoding}")
+
+
+def decompress(body, encoding):
+    """Inverse of compress(); raises ValueError for an encoding this process cannot read."""
+    encoding = (encoding or "identity").lower()
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    if encoding == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise UnsupportedFormatError("zstd bodies need the `zstandard` package: pip install zstandard")
+        # Frames written by ZstdCompressor.compress() carry their size, so this is one allocation
+        return zstandard.ZstdDecompressor().decompress(body)
+    if encoding == "identity":
+        return body
+    raise UnsupportedFormatError(f"Unsupported Content-Encoding: {encoding}")
+
+
+def encode_samples(samples):
+    """Encodes a list of sample dicts (as built by server.build_payload / MetricsDTO.to_dict) as a frame."""
+    for sample in samples:
+        _check_keys(sample, SAMPLE_KEYS, "sample")
+    metrics = [metric for sample in samples for metric in sample.get("metrics") or []]
+    weather = [location for sample in samples for location in sample.get("weather_and_air_quality_data") or []]
+    for metric in metrics:
+        _check_keys(metric, METRIC_KEYS, "metric")
+    for location in weather:
+        _check_keys(location, {"name", *WEATHER_FIELDS}, "weather entry")
+
+    try:
+        return _encode_columns(samples, metrics, weather)
+    except TypeError as e:
+        # e.g. a list where a name or number belongs
+        raise ValueError(f"Cannot frame samples: {e}")
+
+
+def _encode_columns(samples, metrics, weather):
+    parts = [MAGIC, struct.pack("<I", len(samples))]
+    parts.append(_uuid_column([sample.get("sample_id") for sample in samples]))
+    parts.append(_time_column([sample.get("timestamp") for sample in samples]))
+    parts.append(_string_column([sample.get("device_id") for sample in samples]))
+    parts.append(_string_column([sample.get("device_name") for sample in samples]))
+    parts.append(_float_column([sample.get("cpu_usage") for sample in samples]))
+    parts.append(_float_column([sample.get("ram_usage") for sample in samples]))
+
+    parts.append(_count_column([len(sample.get("metrics") or []) for sample in samples]))
+    parts.append(_string_column([metric.get("name") for metric in metrics]))
+    parts.append(_float_column([metric.get("value") for metric in metrics]))
+    parts.append(_time_column([metric.get("timestamp") for metric in metrics]))
+
+    parts.append(_count_column([len(sample.get("weather_and_air_quality_data") or []) for sample in samples]))
+    parts.append(_string_column([location.get("name") for location in weather]))
+    for field in WEATHER_FIELDS:
+        parts.append(_float_column([location.get(field) for location in weather]))
+    return b"".join(parts)
+
+
+def decode_samples(body):
+    """Inverse of encode_samples(); raises ValueError for anything that is not a frame."""
+    body = memoryview(body)
+    if bytes(body[:len(MAGIC)]) != MAGIC:
+        raise ValueError("Body is not a sample frame")
+    try:
+        reader = _Reader(body, len(MAGIC))
+        count = reader.uint32()
+        sample_ids = reader.uuids(count)
+        timestamps = reader.times(count)
+        device_ids = reader.strings(count)
+        device_names = reader.strings(count)
+        cpu_usages = reader.floats(count)
+        ram_usages = reader.floats(count)
+
+        metric_counts = reader.counts(count)
+        metric_total = sum(metric_counts)
+        metric_columns = zip(reader.strings(metric_total), reader.floats(metric_total), reader.times(metric_total))
+        metrics = [
+            {"name": name, "value": value, "timestamp": timestamp} if value is not None and timestamp is not None
+            else _without_none({"name": name, "value": value, "timestamp": timestamp})
+            for name, value, timestamp in metric_columns
+        ]
+
+        weather_counts = reader.counts(count)
+        weather_total = sum(weather_counts)
+        names = reader.strings(weather_total)
+        fields = [reader.floats(weather_total) for _ in WEATHER_FIELDS]
+        weather = [
+            _without_none(dict(zip(("name", *WEATHER_FIELDS), values))) for values in zip(names, *fields)
+        ]
+    except (struct.error, IndexError, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError(f"Truncated or corrupt sample frame: {e}")
+
+    samples = []
+    metric_offset = weather_offset = 0
+    for i in range(count):
+        sample = _without_none({
+            "sample_id": sample_ids[i],
+            "timestamp": timestamps[i],
+            "device_id": device_ids[i],
+            "device_name": device_names[i],
+            "cpu_usage": cpu_usages[i],
+            "ram_usage": ram_usages[i]
+        })
+        sample["metrics"] = metrics[metric_offset:metric_offset + metric_counts[i]]
+        sample["weather_and_air_quality_data"] = weather[weather_offset:weather_offset + weather_counts[i]]
+        metric_offset += metric_counts[i]
+        weather_offset += weather_counts[i]
+        samples.append(sample)
+    return samples
+
+
+def _check_keys(entry, allowed, what):
+    if not isinstance(entry, dict):
+        raise ValueError(f"Each {what} must be an object")
+    unknown = set(entry) - allowed
+    if unknown:
+        raise ValueError(f"Cannot frame {what} with keys {sorted(unknown)}")
+
+
+def _without_none(entry):
+    return {key: value for key, value in entry.items() if value is not None}
+
+
+def _array_bytes(values):
+    if not _LITTLE_ENDIAN:
+        values.byteswap()
+    return values.tobytes()
+
+
+def _string_column(values):
+    dictionary = {}
+    indexes = array("I", (dictionary.setdefault(value, len(dictionary)) for value in values))
+    encoded = json.dumps(list(dictionary), separators=(",", ":")).encode("utf-8")
+    return struct.pack("<I", len(encoded)) + encoded + _array_bytes(indexes)
+
+
+def _float_column(values):
+    return _array_bytes(array("d", (math.nan if value is None else float(value) for value in values)))
+
+
+def _count_column(values):
+    return _array_bytes(array("I", values))
+
+
+def _uuid_column(values):
+    encoded = []
+    for value in values:
+        if value is None:
+            encoded.append(_NO_UUID)
+            continue
+        parsed = uuid.UUID(str(value))
+        # Row keys are derived from the sample_id text, so it must decode to exactly the same string
+        if str(parsed) != value or parsed.bytes == _NO_UUID:
+            raise ValueError(f"Cannot frame non-canonical sample_id {value!r}")
+        encoded.append(parsed.bytes)
+    return b"".join(encoded)
+
+
+def _time_column(values):
+    present = array("B")
+    deltas = array("q")
+    seconds = {}  # "YYYY-MM-DDTHH:MM:SS" -> seconds since the epoch; a batch repeats few of them
+    previous = 0
+    for value in values:
+        if value is None:
+            present.append(0)
+            deltas.append(0)
+            continue
+        if isinstance(value, str) and (len(value) == 19 or (len(value) == 26 and value[19] == "." and value[20:].isdigit())):
+            # The agent's own isoformat() output: parse the seconds once, the fraction by hand
+            second = seconds.get(value[:19])
+            if second is None:
+                second = seconds[value[:19]] = (datetime.fromisoformat(value[:19]) - _EPOCH) // _SECOND
+            micros = second * 1_000_000 + (int(value[20:]) if len(value) == 26 else 0)
+        else:
+            moment = value if isinstance(value, datetime) else datetime.fromisoformat(value)
+            if moment.tzinfo is not None:
+                raise ValueError(f"Cannot frame timezone-aware timestamp {value!r}")
+            micros = (moment - _EPOCH) // _MICROSECOND
+        present.append(1)
+        deltas.append(micros - previous)
+        previous = micros
+    return present.tobytes() + _array_bytes(deltas)
+
+
+class _Reader:
+    """Sequential reader over a frame body."""
+
+    def __init__(self, body, offset):
+        self.body = body
+        self.offset = offset
+
+    def uint32(self):
+        value = struct.unpack_from("<I", self.body, self.offset)[0]
+        self.offset += 4
+        return value
+
+    def _array(self, typecode, count):
+        values = array(typecode)
+        end = self.offset + values.itemsize * count
+        if end > len(self.body):
+            raise IndexError("column runs past the end of the frame")
+        values.frombytes(self.body[self.offset:end])
+        if not _LITTLE_ENDIAN:
+            values.byteswap()
+        self.offset = end
+        return values
+
+    def strings(self, count):
+        length = self.uint32()
+        dictionary = json.loads(bytes(self.body[self.offset:self.offset + length]))
+        self.offset += length
+        return [dictionary[index] for index in self._array("I", count)]
+
+    def floats(self, count):
+        return [None if value != value else value for value in self._array("d", count)]
+
+    def counts(self, count):
+        return self._array("I", count).tolist()
+
+    def uuids(self, count):
+        end = self.offset + 16 * count
+        if end > len(self.body):
+            raise IndexError("column runs past the end of the frame")
+        digits = bytes(self.body[self.offset:end]).hex()
+        self.offset = end
+        return [
+            None if digits[i:i + 32] == "0" * 32 else
+            f"{digits[i:i + 8]}-{digits[i + 8:i + 12]}-{digits[i + 12:i + 16]}-{digits[i + 16:i + 20]}-{digits[i + 20:i + 32]}"
+            for i in range(0, len(digits), 32)
+        ]
+
+    def times(self, count):
+        present = self._array("B", count)
+        prefixes = {}  # seconds since the epoch -> "YYYY-MM-DDTHH:MM:SS"
+        values = []
+        for flag, micros in zip(present, accumulate(self._array("q", count))):
+            if not flag:
+                values.append(None)
+                continue
+            second, fraction = divmod(micros, 1_000_000)
+            prefix = prefixes.get(second)
+            if prefix is None:
+                prefix = prefixes[second] = (_EPOCH + timedelta(seconds=second)).isoformat()
+            # Same text as datetime.isoformat(): no fraction when it is zero
+            values.append(f"{prefix}.{fraction:06d}" if fraction else prefix)
+        return values
@@ -1,21 +1,50 @@
 from sqlalchemy import (
-    create_engine, Column, Integer, Float, String, ForeignKey, DateTime, UniqueConstraint, CheckConstraint, Index, DECIMAL
+    Column, Integer, Float, String, ForeignKey, DateTime, UniqueConstraint, CheckConstraint, Index, DECIMAL, BINARY, inspect
 )
-from sqlalchemy.orm import relationship, declarative_base, sessionmaker
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.orm import relationship, declarative_base
 from datetime import datetime
 import uuid
-import os
 import pymysql
 
 pymysql.install_as_MySQLdb()
 
 Base = declarative_base()
 
+class BinaryUUID(TypeDecorator):
+    """UUID stored as BINARY(16) but read and written as the usual 36-character string.
+
+    Less than half the size of String(36) in every row, primary key and index entry
+    that holds it. Byte order matches the string's order, so comparisons and ORDER BY
+    on these columns (e.g. keyset cursors) behave exactly as they did on strings.
+    """
+    impl = BINARY(16)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, bytes):
+            return value
+        return bytes.fromhex(str(value).replace('-', ''))
+
+    def result_processor(self, dialect, coltype):
+        # Runs for every uuid column of every row read, so skip TypeDecorator's generic
+        # wrapper; slicing the hex digits is several times cheaper than uuid.UUID(bytes=...)
+        def process(value):
+            if value is None:
+                return None
+            if isinstance(value, str):
+                # Written as text by pre-compact code, which SQLite stores as is in a BINARY column
+                return value
+            digits = value.hex()
+            return f"{digits[:8]}-{digits[8:12]}-{digits[12:16]}-{digits[16:20]}-{digits[20:]}"
+        return process
+
+
 class Device(Base):
     __tablename__ = 'devices'
     
-    uuid = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    name = Column(String(255), nullable=False)
+    uuid = Column(BinaryUUID, primary_key=True, default=lambda: str(uuid.uuid4()))
+    name = Column(String(255), nullable=False, unique=True)
     date_registered = Column(DateTime, default=datetime.utcnow, nullable=False)
     
     metrics = relationship('DeviceMetric', back_populates='device')
@@ -23,7 +52,7 @@ class Device(Base):
 class Metric(Base):
     __tablename__ = 'metrics'
     
-    uuid = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    uuid = Column(BinaryUUID, primary_key=True, default=lambda: str(uuid.uuid4()))
     name = Column(String(255), nullable=False, unique=True)
     
     metrics = relationship('DeviceMetric', back_populates='metric')
@@ -31,21 +60,26 @@ class Metric(Base):
 class DeviceMetric(Base):
     __tablename__ = 'device_metrics'
     
-    uuid = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    device_id = Column(String(36), ForeignKey('devices.uuid'), nullable=False)
-    metric_id = Column(String(36), ForeignKey('metrics.uuid'), nullable=False)
+    uuid = Column(BinaryUUID, primary_key=True, default=lambda: str(uuid.uuid4()))
+    device_id = Column(BinaryUUID, ForeignKey('devices.uuid'), nullable=False)
+    metric_id = Column(BinaryUUID, ForeignKey('metrics.uuid'), nullable=False)
     value = Column(Float, nullable=False)
     timestamp = Column(DateTime, default=datetime.utcnow, nullable=False)
     
     device = relationship('Device', back_populates='metrics')
     metric = relationship('Metric', back_populates='metrics')
     
-    __table_args__ = (Index('ix_device_metrics_device_id', 'device_id'),)
+    __table_args__ = (
+        # Filtered series scans; the leading device_id also serves the foreign key
+        Index('ix_device_metrics_device_metric_timestamp', 'device_id', 'metric_id', 'timestamp'),
+        # Newest-first keyset pagination on (timestamp, uuid)
+        Index('ix_device_metrics_timestamp_uuid', 'timestamp', 'uuid'),
+    )
 
 class ThirdPartyType(Base):
     __tablename__ = 'third_party_types'
     
-    uuid = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    uuid = Column(BinaryUUID, primary_key=True, default=lambda: str(uuid.uuid4()))
     name = Column(String(255), nullable=False)
     latitude = Column(DECIMAL(9, 6), nullable=False)  # Change to DECIMAL
     longitude = Column(DECIMAL(9, 6), nullable=False)  # Change to DECIMAL
@@ -57,23 +91,79 @@ class ThirdPartyType(Base):
         UniqueConstraint('name', 'latitude', 'longitude', name='uq_third_party_type_name_lat_lon'),
     )
 
+def third_party_name(location_name, type_name):
+    """Display name of a third-party series, e.g. "Dublin Temperature".
+
+    Derived from ThirdPartyType rather than stored on every ThirdParty row.
+    """
+    return f"{location_name} {type_name}" if location_name else type_name
+
 class ThirdParty(Base):
     __tablename__ = 'third_parties'
     
-    uuid = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    thirdparty_id = Column(String(36), ForeignKey('third_party_types.uuid'), nullable=False)
-    name = Column(String(255), nullable=False)
+    uuid = Column(BinaryUUID, primary_key=True, default=lambda: str(uuid.uuid4()))
+    thirdparty_id = Column(BinaryUUID, ForeignKey('third_party_types.uuid'), nullable=False)
     value = Column(Float, nullable=False)
     timestamp = Column(DateTime, default=datetime.utcnow, nullable=False)
     
     third_party_type = relationship('ThirdPartyType', back_populates='third_parties')
     
-    __table_args__ = (Index('ix_third_party_timestamp', 'timestamp'),)
+    __table_args__ = (
+        Index('ix_third_party_timestamp', 'timestamp'),
+        # Latest value per ThirdPartyType (lib_database.snapshot)
+        Index('ix_third_party_thirdparty_timestamp', 'thirdparty_id', 'timestamp'),
+    )
+
+class DeviceMetricRollup(Base):
+    """Pre-aggregated device metrics per series and fixed-width time bucket (see lib_database.rollups)."""
+    __tablename__ = 'device_metric_rollups'
+
+    resolution = Column(Integer, primary_key=True)  # Bucket width in seconds: 60, 3600 or 86400
+    device_id = Column(BinaryUUID, ForeignKey('devices.uuid'), primary_key=True)
+    metric_id = Column(BinaryUUID, ForeignKey('metrics.uuid'), primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    min_value = Column(Float, nullable=False)
+    max_value = Column(Float, nullable=False)
+    sum_value = Column(Float, nullable=False)
+    sample_count = Column(Integer, nullable=False)
+    last_value = Column(Float, nullable=False)
+    last_timestamp = Column(DateTime, nullable=False)
+
+    __table_args__ = (Index('ix_device_metric_rollups_resolution_bucket', 'resolution', 'bucket_start'),)
+
+class ThirdPartyRollup(Base):
+    """Pre-aggregated third-party metrics per ThirdPartyType and fixed-width time bucket."""
+    __tablename__ = 'third_party_rollups'
+
+    resolution = Column(Integer, primary_key=True)  # Bucket width in seconds: 60, 3600 or 86400
+    thirdparty_id = Column(BinaryUUID, ForeignKey('third_party_types.uuid'), primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    min_value = Column(Float, nullable=False)
+    max_value = Column(Float, nullable=False)
+    sum_value = Column(Float, nullable=False)
+    sample_count = Column(Integer, nullable=False)
+    last_value = Column(Float, nullable=False)
+    last_timestamp = Column(DateTime, nullable=False)
+
+    __table_args__ = (Index('ix_third_party_rollups_resolution_bucket', 'resolution', 'bucket_start'),)
+
+def is_compact(connection, table_name="device_metrics"):
+    """True if `table_name` already has the compact (binary uuid) layout."""
+    column = next(column for column in inspect(connection).get_columns(table_name) if column["name"] == "uuid")
+    return not isinstance(column["type"], String)
+
+
+def check_schema(engine):
+    """Raises RuntimeError if the database still has the VARCHAR(36) uuid layout these models cannot read or write."""
+    with engine.connect() as connection:
+        if inspect(connection).has_table("device_metrics") and not is_compact(connection):
+            raise RuntimeError(
+                "The database uses the old VARCHAR(36) uuid schema: migrate it with "
+                "lib_database/migrate_compact_schema.py --copy, then --swap"
+            )
 
-# Database Configuration
-DATABASE_URL = os.getenv('DATABASE_URL')
-engine = create_engine(DATABASE_URL)
-Session = sessionmaker(bind=engine)
 
-# Create tables if they don't exist
-Base.metadata.create_all(engine)
+def create_tables(engine):
+    """Create tables if they don't exist. Run from setup scripts, never at import."""
+    check_schema(engine)
+    Base.metadata.create_all(engine)
@@ -0,0 +1,134 @@
+"""
+Fleet support for the collection agent: a stable device identity and sharded location fetching.
+
+Identity: `agent.device_name` in config.json (or SYSMONITOR_DEVICE_NAME) wins. Otherwise
+the name is derived from the host on first start as "<hostname>-<6 hex digits of the
+MAC address>", so cloned machines sharing a hostname stay apart, and persisted to
+`agent.identity_path`; renaming the host later does not split its history.
+
+Sharding: every agent asks the server which agents reported recently
+(GET /api/fleet/agents) and places them on a consistent hash ring. Each agent only
+fetches the weather/air-quality locations the ring assigns to it, so third-party calls
+stay at one per location per cycle however many agents run, and an agent joining or
+leaving moves only about 1/N of the locations. When the server cannot be reached the
+agent keeps its last view of the fleet, or fetches every location if it has none:
+a duplicate weather sample is better than a gap.
+"""
+import hashlib
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from bisect import bisect
+
+import requests
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_IDENTITY_PATH = "server/device_identity.json"
+# Points per agent on the hash ring; more points spread locations more evenly
+VIRTUAL_NODES = 64
+REQUEST_TIMEOUT = (3.05, 10)
+
+
+def device_name(settings):
+    """Returns this agent's device name from `settings` (the `agent` block of config.json)."""
+    configured = os.getenv("SYSMONITOR_DEVICE_NAME") or settings.get("device_name")
+    if configured:
+        return configured
+
+    path = os.path.join(REPO_ROOT, settings.get("identity_path", DEFAULT_IDENTITY_PATH))
+    try:
+        with open(path) as identity_file:
+            return json.load(identity_file)["device_name"]
+    except FileNotFoundError:
+        pass
+    except (ValueError, KeyError) as e:
+        logging.warning(f"Ignoring unreadable device identity {path}: {e}")
+
+    name = host_device_name()
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w") as identity_file:
+        json.dump({"device_name": name, "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}, identity_file)
+    os.replace(temporary_path, path)  # Never leave a half-written identity behind
+    logging.info(f"Registered this host as device {name} in {path}")
+    return name
+
+
+def host_device_name():
+    """Name derived from the hostname and a hash of the MAC address, stable for this machine."""
+    hostname = socket.gethostname().split(".")[0] or "host"
+    node = hashlib.sha1(uuid.getnode().to_bytes(6, "big")).hexdigest()[:6]
+    return f"{hostname}-{node}"
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hash ring: a key belongs to the first agent point at or after its hash."""
+
+    def __init__(self, members, virtual_nodes=VIRTUAL_NODES):
+        self.members = sorted(set(members))
+        points = sorted((_hash(f"{member}#{i}"), member) for member in self.members for i in range(virtual_nodes))
+        self._hashes = [point for point, _ in points]
+        self._owners = [member for _, member in points]
+
+    def owner(self, key):
+        if not self._hashes:
+            return None
+        return self._owners[bisect(self._hashes, _hash(key)) % len(self._hashes)]
+
+
+class LocationSharder:
+    """Chooses which locations this agent fetches, from the server's list of active agents."""
+
+    def __init__(self, device_name, agents_url, enabled=True, refresh_seconds=300, active_minutes=15):
+        self.device_name = device_name
+        self.agents_url = agents_url
+        self.enabled = enabled
+        self.refresh_seconds = refresh_seconds
+        self.active_minutes = active_minutes
+        self._ring = None
+        self._refreshed_at = None
+
+    def assigned(self, locations):
+        """The subset of `locations` ((name, lat, lon) tuples) this agent should fetch, in order."""
+        ring = self.ring()
+        if ring is None:
+            return list(locations)
+        return [location for location in locations if ring.owner(location[0]) == self.device_name]
+
+    def ring(self):
+        """The current ring, refreshed every `refresh_seconds`; None when sharding is off or unknown."""
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        if self._refreshed_at is None or now - self._refreshed_at >= self.refresh_seconds:
+            try:
+                response = requests.get(
+                    self.agents_url, params={"active_minutes": self.active_minutes}, timeout=REQUEST_TIMEOUT
+                )
+                response.raise_for_status()
+                agents = response.json()["agents"]
+            except (requests.RequestException, ValueError, KeyError) as e:
+                # Retried next cycle; until then keep the last view, or fetch everything
+                logging.warning(f"Could not refresh fleet membership from {self.agents_url}: {e}")
+            else:
+                # This agent may not have reported yet, but it is about to
+                self._ring = HashRing(set(agents) | {self.device_name})
+                self._refreshed_at = now
+                logging.info(f"Fleet membership: {len(self._ring.members)} agents")
+        return self._ring
+
+    def stats(self, locations):
+        """This agent's view of the fleet and which of `locations` it currently fetches."""
+        ring = self._ring if self.enabled else None
+        return {
+            "device_name": self.device_name,
+            "enabled": self.enabled,
+            "agents": ring.members if ring is not None else None,
+            "locations": [location[0] for location in locations if ring is None or ring.owner(location[0]) == self.device_name]
+        }
@@ -1,13 +1,37 @@
-import psutil
 import requests
 import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
 from lib_utils.blocktimer import BlockTimer  # Import BlockTimer
+from metrics.response_cache import ResponseCache, CacheEntry
+from metrics.host_sampler import HostSampler
+from metrics.registry import register_collector
 
 # OpenWeatherMap API URLs
 OPENWEATHERMAP_API_URL = "http://api.openweathermap.org/data/2.5/weather"
 OPENWEATHERMAP_AIR_API_URL = "http://api.openweathermap.org/data/2.5/air_pollution"
 API_KEY = "dc0b9ad7c4e6b96eb2d4b9f87f2fa4d1"  # Use your actual API key
 
+# (connect, read) timeout in seconds for every third-party call, so one hung request can't stall a cycle
+REQUEST_TIMEOUT = (3.05, 10)
+# Worker threads shared by all weather/air-quality fetches
+MAX_FETCH_WORKERS = 16
+# Concurrent in-flight requests allowed against any single host
+MAX_CONNECTIONS_PER_HOST = 8
+# Upstream data changes slowly: reuse a response for at most this long before revalidating it
+RESPONSE_CACHE_TTL = 300
+# ...and for at most this share of the weather interval, so a cycle run early after a
+# jittered one never re-sends the previous cycle's response as a new sample
+RESPONSE_CACHE_TTL_SHARE = 0.5
+# Coordinates are rounded to this many decimals (~1km) for cache keys, so nearby locations share a response
+CACHE_COORDINATE_DECIMALS = 2
+# Optional SQLite file that keeps cached responses across restarts
+RESPONSE_CACHE_PATH = os.getenv('WEATHER_CACHE_PATH')
+
 LOCATIONS = [
     ("Dublin", 53.349804, -6.260310),
     ("Cork", 51.898514, -8.475604),
@@ -21,25 +45,85 @@ LOCATIONS = [
     ("Drogheda", 53.718300, -6.349700)
 ]
 
-def get_cpu_usage():
-    """Returns the current CPU usage as a percentage."""
-    with BlockTimer("get_cpu_usage", logging.getLogger(__name__)):
-        return psutil.cpu_percent(interval=1)
+def get_host_metrics():
+    """Returns CPU, per-core, RAM, swap, disk I/O, network I/O and load average from one non-blocking pass."""
+    with BlockTimer("get_host_metrics", logging.getLogger(__name__)):
+        return host_sampler.sample()
+
+@register_collector("host", interval=5)
+def collect_host_metrics():
+    """Built-in collector: every host metric from one HostSampler pass, under its stored metric name."""
+    host_metrics = get_host_metrics()
+    metrics = {
+        "CPU Usage": host_metrics["cpu_percent"],
+        "RAM Usage": host_metrics["ram_percent"],
+        "Swap Usage": host_metrics["swap_percent"],
+        "Load Average (1m)": host_metrics["load_1"],
+        "Load Average (5m)": host_metrics["load_5"],
+        "Load Average (15m)": host_metrics["load_15"],
+        "Disk Read Rate": host_metrics.get("disk_read_bytes_per_sec"),
+        "Disk Write Rate": host_metrics.get("disk_write_bytes_per_sec"),
+        "Network Sent Rate": host_metrics.get("net_sent_bytes_per_sec"),
+        "Network Received Rate": host_metrics.get("net_recv_bytes_per_sec")
+    }
+    for core, percent in enumerate(host_metrics["cpu_per_core"]):
+        metrics[f"CPU Core {core} Usage"] = percent
+    return metrics
+
+def _create_session():
+    """Keep-alive session whose connection pool is large enough for every fetch worker."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_FETCH_WORKERS)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+_session = _create_session()
+_executor = ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS, thread_name_prefix="weather-fetch")
+_host_limits = {}
+_host_limits_lock = threading.Lock()
+response_cache = ResponseCache(ttl_seconds=RESPONSE_CACHE_TTL, disk_path=RESPONSE_CACHE_PATH)
+host_sampler = HostSampler()
+
+def set_collection_interval(seconds):
+    """Caps the response cache TTL below the weather interval, so each cycle sends a fresh observation."""
+    response_cache.ttl_seconds = min(RESPONSE_CACHE_TTL, seconds * RESPONSE_CACHE_TTL_SHARE)
+
+def _host_limit(url):
+    """Returns the semaphore that caps concurrent requests to the host of `url`."""
+    host = urlsplit(url).netloc
+    with _host_limits_lock:
+        if host not in _host_limits:
+            _host_limits[host] = threading.BoundedSemaphore(MAX_CONNECTIONS_PER_HOST)
+        return _host_limits[host]
 
-def get_ram_usage():
-    """Returns the current RAM usage as a percentage."""
-    with BlockTimer("get_ram_usage", logging.getLogger(__name__)):
-        ram = psutil.virtual_memory()
-        return ram.percent  # Returns percentage of RAM usage
+def _fetch(url, cached):
+    """GETs `url` on the shared session, revalidating `cached` with its ETag/Last-Modified if given."""
+    headers = {}
+    if cached is not None:
+        if cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+    with _host_limit(url):
+        response = _session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+    if response.status_code == 304 and cached is not None:
+        cached.fetched_at = time.time()
+        return cached
+    response.raise_for_status()
+    return CacheEntry(response.json(), time.time(), response.headers.get("ETag"), response.headers.get("Last-Modified"))
+
+def _get_json(url, kind, lat, lon):
+    """Returns the JSON body for `url`, served from the response cache when possible."""
+    key = (kind, round(float(lat), CACHE_COORDINATE_DECIMALS), round(float(lon), CACHE_COORDINATE_DECIMALS))
+    return response_cache.get(key, lambda cached: _fetch(url, cached))
 
 def get_weather_data(lat, lon):
     """Fetches weather data from OpenWeatherMap API."""
     url = f"{OPENWEATHERMAP_API_URL}?lat={lat}&lon={lon}&appid={API_KEY}&units=metric"
-    with BlockTimer(f"get_weather_data for ({lat}, {lon})", logging.getLogger(__name__)):
+    with BlockTimer("get_weather_data", logging.getLogger(__name__)):
         try:
-            response = requests.get(url)
-            response.raise_for_status()
-            return response.json()
+            return _get_json(url, "weather", lat, lon)
         except requests.RequestException as e:
             logging.error(f"Error fetching weather data for ({lat}, {lon}): {e}")
             return None
@@ -47,40 +131,48 @@ def get_weather_data(lat, lon):
 def get_air_quality_data(lat, lon):
     """Fetches air quality data from OpenWeatherMap API."""
     url = f"{OPENWEATHERMAP_AIR_API_URL}?lat={lat}&lon={lon}&appid={API_KEY}"
-    with BlockTimer(f"get_air_quality_data for ({lat}, {lon})", logging.getLogger(__name__)):
+    with BlockTimer("get_air_quality_data", logging.getLogger(__name__)):
         try:
-            response = requests.get(url)
-            response.raise_for_status()
-            return response.json()
+            return _get_json(url, "air_quality", lat, lon)
         except requests.RequestException as e:
             logging.error(f"Error fetching air quality data for ({lat}, {lon}): {e}")
             return None
 
-def get_weather_and_air_quality_data():
-    """Fetches and processes weather and air quality data for multiple locations."""
-    weather_and_air_quality_data = []
-    for location in LOCATIONS:
-        name, lat, lon = location
-        logging.info(f"Getting data for {name}")
-        with BlockTimer(f"get_weather_and_air_quality_data for {name}", logging.getLogger(__name__)):
-            weather_data = get_weather_data(lat, lon)
-            air_quality_data = get_air_quality_data(lat, lon)
-            
-            if weather_data and air_quality_data:
-                temp = weather_data.get("main", {}).get("temp", None)
-                humidity = weather_data.get("main", {}).get("humidity", None)
-                wind_speed = weather_data.get("wind", {}).get("speed", None)
-                pressure = weather_data.get("main", {}).get("pressure", None)
-                air_quality_index = air_quality_data.get("list", [{}])[0].get("main", {}).get("aqi", 1)
-                precipitation = weather_data.get("rain", {}).get("1h", 0)  # Precipitation in the last hour
-                uv_index = weather_data.get("current", {}).get("uvi", 0)  # UV index
-
-                # Append the collected data for the location
-                logging.info(f"Collected weather and air quality data for {name}: Temp={temp}°C, Humidity={humidity}%, Wind Speed={wind_speed}m/s, Pressure={pressure}hPa, Air Quality={air_quality_index}, Precipitation={precipitation}mm, UV Index={uv_index}")
-                weather_and_air_quality_data.append((name, temp, humidity, wind_speed, pressure, air_quality_index, precipitation, uv_index, lat, lon))
-            else:
-                logging.warning(f"Failed to collect data for {name}")
-                # Append default values when data is missing
-                weather_and_air_quality_data.append((name, None, None, None, None, 1, 0, 0, lat, lon))  # Default values for missing data
-    
-    return weather_and_air_quality_data
+def get_weather_and_air_quality_data(locations=None):
+    """Fetches and processes weather and air quality data for multiple locations.
+
+    Both calls for every location are issued concurrently on the shared pool, so a
+    cycle takes roughly as long as the slowest call rather than the sum of them all.
+    Results are returned in the same order as `locations`.
+    """
+    locations = LOCATIONS if locations is None else locations
+    with BlockTimer("get_weather_and_air_quality_data", logging.getLogger(__name__)):
+        pending = [
+            (location, _executor.submit(get_weather_data, location[1], location[2]), _executor.submit(get_air_quality_data, location[1], location[2]))
+            for location in locations
+        ]
+        results = [
+            _parse_location_data(location, weather_future.result(), air_quality_future.result())
+            for location, weather_future, air_quality_future in pending
+        ]
+    logging.info(f"Weather response cache: {response_cache.stats()}")
+    return results
+
+def _parse_location_data(location, weather_data, air_quality_data):
+    """Turns the two API responses for one location into the tuple sent to the server."""
+    name, lat, lon = location
+    if weather_data and air_quality_data:
+        temp = weather_data.get("main", {}).get("temp", None)
+        humidity = weather_data.get("main", {}).get("humidity", None)
+        wind_speed = weather_data.get("wind", {}).get("speed", None)
+        pressure = weather_data.get("main", {}).get("pressure", None)
+        air_quality_index = air_quality_data.get("list", [{}])[0].get("main", {}).get("aqi", 1)
+        precipitation = weather_data.get("rain", {}).get("1h", 0)  # Precipitation in the last hour
+        uv_index = weather_data.get("current", {}).get("uvi", 0)  # UV index
+
+        logging.info(f"Collected weather and air quality data for {name}: Temp={temp}°C, Humidity={humidity}%, Wind Speed={wind_speed}m/s, Pressure={pressure}hPa, Air Quality={air_quality_index}, Precipitation={precipitation}mm, UV Index={uv_index}")
+        return (name, temp, humidity, wind_speed, pressure, air_quality_index, precipitation, uv_index, lat, lon)
+
+    logging.warning(f"Failed to collect data for {name}")
+    # Default values when data is missing
+    return (name, None, None, None, None, 1, 0, 0, lat, lon)
@@ -0,0 +1,90 @@
+"""
+Non-blocking host metrics sampler.
+
+psutil.cpu_percent(interval=1) sleeps for a full second to measure CPU usage.
+HostSampler instead keeps the previous cumulative counters (CPU times, disk and
+network I/O) and reports the rate of change since the last call, so a sample costs
+a few syscalls and the caller's own cadence sets the measurement window - 5s, or
+100ms for sub-second sampling - without ever sleeping.
+"""
+import os
+import threading
+import time
+
+import psutil
+
+
+def _busy_and_total(cpu_times):
+    """Busy and total jiffies for one cpu_times tuple, using psutil's own definition of idle."""
+    total = sum(cpu_times)
+    # guest time is already counted in user/nice on Linux
+    total -= getattr(cpu_times, "guest", 0) + getattr(cpu_times, "guest_nice", 0)
+    idle = cpu_times.idle + getattr(cpu_times, "iowait", 0)
+    return total - idle, total
+
+
+def _percent(previous, current):
+    busy_before, total_before = previous
+    busy_now, total_now = current
+    elapsed = total_now - total_before
+    if elapsed <= 0:
+        return 0.0
+    return round(min(100.0, max(0.0, (busy_now - busy_before) / elapsed * 100)), 1)
+
+
+class HostSampler:
+    """Collects CPU, per-core, memory, swap, disk I/O, network I/O and load average in one pass."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._previous = self._read_counters()
+        # cpu_percent() measures from its own previous call, so it never shortens sample()'s window
+        self._previous_cpu = self._previous["cpu"]
+
+    def sample(self):
+        """Returns every host metric as a flat dict; rates are averaged since the previous call."""
+        with self._lock:
+            current = self._read_counters()
+            previous, self._previous = self._previous, current
+
+        elapsed = max(current["time"] - previous["time"], 1e-9)
+        per_core = [_percent(before, now) for before, now in zip(previous["per_core"], current["per_core"])]
+        memory = psutil.virtual_memory()
+        swap = psutil.swap_memory()
+        load_1, load_5, load_15 = os.getloadavg() if hasattr(os, "getloadavg") else psutil.getloadavg()
+
+        metrics = {
+            "cpu_percent": _percent(previous["cpu"], current["cpu"]),
+            "cpu_per_core": per_core,
+            "ram_percent": memory.percent,
+            "swap_percent": swap.percent,
+            "load_1": load_1,
+            "load_5": load_5,
+            "load_15": load_15
+        }
+        for name in ("disk_read_bytes", "disk_write_bytes", "net_sent_bytes", "net_recv_bytes"):
+            if current[name] is not None and previous[name] is not None:
+                metrics[f"{name}_per_sec"] = round((current[name] - previous[name]) / elapsed, 1)
+        return metrics
+
+    def cpu_percent(self):
+        """CPU usage since the previous cpu_percent() call, without blocking; sample() is unaffected."""
+        with self._lock:
+            current = _busy_and_total(psutil.cpu_times())
+            previous, self._previous_cpu = self._previous_cpu, current
+        return _percent(previous, current)
+
+    @staticmethod
+    def _read_counters():
+        per_core = [_busy_and_total(times) for times in psutil.cpu_times(percpu=True)]
+        disk = psutil.disk_io_counters()
+        network = psutil.net_io_counters()
+        return {
+            "time": time.monotonic(),
+            "cpu": _busy_and_total(psutil.cpu_times()),
+            "per_core": per_core,
+            "disk_read_bytes": disk.read_bytes if disk else None,
+            "disk_write_bytes": disk.write_bytes if disk else None,
+            "net_sent_bytes": network.bytes_sent if network else None,
+            "net_recv_bytes": network.bytes_recv if network else None
+        }
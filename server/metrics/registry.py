@@ -0,0 +1,53 @@
+"""
+Registry of device metric collectors.
+
+A collector is a function returning {metric_name: value}; registering it with an
+interval is all it takes to have its metrics sampled, spooled and stored. The server
+registers any metric name it has not seen before, so no schema change is needed:
+
+    @register_collector("host", interval=5)
+    def collect_host():
+        return {"CPU Usage": 12.5, "RAM Usage": 48.0}
+"""
+import logging
+from datetime import datetime
+
+from lib_utils.blocktimer import BlockTimer
+
+
+class Collector:
+    """A named source of device metrics sampled every `interval` seconds."""
+
+    def __init__(self, name, interval, collect):
+        self.name = name
+        self.interval = interval
+        self.collect = collect
+
+    def sample(self):
+        """Runs the collector and returns [{"name", "value", "timestamp"}], skipping missing values."""
+        timestamp = datetime.utcnow().isoformat()
+        with BlockTimer("Collector", logging.getLogger(__name__), labels={"collector": self.name}):
+            values = self.collect()
+        return [
+            {"name": metric_name, "value": value, "timestamp": timestamp}
+            for metric_name, value in values.items()
+            if value is not None
+        ]
+
+
+_collectors = {}
+
+
+def register_collector(name, interval):
+    """Decorator that registers `function` as the collector called `name`."""
+    def decorator(function):
+        if name in _collectors:
+            raise ValueError(f"Collector {name} is already registered")
+        _collectors[name] = Collector(name, interval, function)
+        return function
+    return decorator
+
+
+def get_collectors():
+    """Returns every registered collector."""
+    return list(_collectors.values())
@@ -0,0 +1,137 @@
+"""
+Cache for third-party API responses used by collect_metrics.
+
+- In-memory TTL + LRU entries, keyed by whatever the caller passes (collect_metrics
+  uses the API kind plus rounded coordinates, so nearby locations share an answer).
+- Optional SQLite file so the cache survives restarts.
+- Expired entries are revalidated with If-None-Match / If-Modified-Since; a 304 just
+  refreshes the entry's age.
+- Single flight: concurrent callers for the same key wait for one upstream request.
+- If the upstream call fails, a stale entry is served rather than nothing.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheEntry:
+    """One cached response body with the validators needed to revalidate it."""
+
+    __slots__ = ("value", "fetched_at", "etag", "last_modified")
+
+    def __init__(self, value, fetched_at, etag=None, last_modified=None):
+        self.value = value
+        self.fetched_at = fetched_at
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+class _Flight:
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResponseCache:
+    """Thread-safe TTL/LRU response cache with optional on-disk persistence."""
+
+    def __init__(self, ttl_seconds=600, max_entries=1024, disk_path=None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "revalidated": 0, "stale": 0, "shared": 0}
+        self._disk = None
+        if disk_path:
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False, isolation_level=None)
+            self._disk.execute("PRAGMA journal_mode=WAL")
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, fetched_at REAL NOT NULL, etag TEXT, last_modified TEXT)"
+            )
+
+    def get(self, key, fetch):
+        """Returns the cached value for `key`, calling `fetch(entry_or_None)` when it is missing or expired.
+
+        `fetch` must return a CacheEntry, or the entry it was given (with its
+        fetched_at refreshed) when the upstream answered 304 Not Modified.
+        """
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None and time.time() - entry.fetched_at < self.ttl_seconds:
+                self._counters["hits"] += 1
+                return entry.value
+            flight = self._in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._in_flight[key] = _Flight()
+                self._counters["misses" if entry is None else "revalidated"] += 1
+            else:
+                self._counters["shared"] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            fresh = fetch(entry)
+            self._store(key, fresh)
+            flight.value = fresh.value
+        except Exception as e:
+            if entry is None:
+                flight.error = e
+                raise
+            logging.warning(f"Serving stale response for {key}: {e}")
+            with self._lock:
+                self._counters["stale"] += 1
+            flight.value = entry.value
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            flight.done.set()
+        return flight.value
+
+    def stats(self):
+        """Returns hit/miss/revalidation/stale counters and the current entry count."""
+        with self._lock:
+            return dict(self._counters, entries=len(self._entries))
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            return entry
+        if self._disk is None:
+            return None
+        row = self._disk.execute(
+            "SELECT value, fetched_at, etag, last_modified FROM responses WHERE key = ?", (json.dumps(key),)
+        ).fetchone()
+        if row is None:
+            return None
+        entry = CacheEntry(json.loads(row[0]), row[1], row[2], row[3])
+        self._remember(key, entry)
+        return entry
+
+    def _store(self, key, entry):
+        with self._lock:
+            self._remember(key, entry)
+            if self._disk is not None:
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, fetched_at, etag, last_modified) VALUES (?, ?, ?, ?, ?)",
+                    (json.dumps(key), json.dumps(entry.value), entry.fetched_at, entry.etag, entry.last_modified)
+                )
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
@@ -0,0 +1,180 @@
+"""
+Fixed-rate scheduler for the agent's collection jobs.
+
+Each job runs at deadlines start, start + interval, start + 2 * interval, ... on the
+monotonic clock, so the time a run takes (blocking sampling, slow APIs, retries)
+never pushes later runs back and the period does not drift. Ticks missed because a
+run overran, or because the machine was suspended, are not queued up: they are
+coalesced into the next run and counted. Optional jitter starts each run up to
+`jitter * interval` after its deadline without moving the grid, so agents started
+together do not all call the APIs at the same moment.
+
+Intervals may be callables, read again at every tick, which is how config.json
+changes reach running jobs. Runs happen on a small thread pool; the scheduler
+thread only keeps time, and stop() wakes it immediately.
+
+How late each run started against its deadline is recorded as the
+"Scheduler lateness" BlockTimer histogram (so it appears on /metrics) and
+summarised by stats().
+"""
+import heapq
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+
+from lib_utils.blocktimer import LatencyHistogram, block_timings
+
+# Shortest interval a job may have, whatever config.json says
+MIN_INTERVAL_SECONDS = 0.01
+
+
+class Job:
+    """A function run every `interval` seconds (a number, or a callable returning one)."""
+
+    def __init__(self, name, function, interval, jitter=0.0):
+        self.name = name
+        self.function = function
+        self.interval = interval
+        self.jitter = jitter
+        self.deadline = None  # Next point on the job's fixed-rate grid
+        self.running = False
+        self.counters = {"runs": 0, "missed_ticks": 0, "overruns": 0, "errors": 0}
+        self.lateness = block_timings.histogram("Scheduler lateness", (("job", name),))
+        self.max_lateness = 0.0
+        self._last_interval = 60.0
+
+    def current_interval(self):
+        try:
+            interval = float(self.interval() if callable(self.interval) else self.interval)
+        except Exception as e:
+            # A bad config value must not kill the job: keep the grid moving at the last good interval
+            logging.error(f"Invalid interval for job {self.name}: {e}")
+            interval = self._last_interval
+        self._last_interval = max(interval, MIN_INTERVAL_SECONDS)
+        return self._last_interval
+
+
+class Scheduler:
+    """Runs jobs at fixed-rate deadlines until `stop_event` is set. Add jobs before start()."""
+
+    def __init__(self, stop_event=None, max_workers=4):
+        self.stop_event = stop_event or threading.Event()
+        self.max_workers = max_workers
+        self._jobs = []
+        self._queue = []  # (due, sequence, job); due includes the jitter of that run
+        self._sequence = count()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._thread = None
+
+    def add_job(self, name, function, interval, jitter=0.0):
+        """Schedules function() every `interval` seconds, the first run immediately."""
+        job = Job(name, function, interval, jitter)
+        self._jobs.append(job)
+        return job
+
+    def start(self):
+        if self.is_running():
+            return
+        now = time.monotonic()
+        self._queue = []
+        for job in self._jobs:
+            job.deadline = now
+            heapq.heappush(self._queue, (now, next(self._sequence), job))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="scheduler-job")
+        self._thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """Stops scheduling at once; runs already in progress finish in the background."""
+        self.stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def stats(self):
+        """Per job: interval, runs, coalesced ticks and how late runs started (milliseconds)."""
+        stats = {}
+        for job in self._jobs:
+            buckets, runs, _, total_ns = job.lateness.snapshot()
+            with self._lock:
+                counters = dict(job.counters)
+                max_lateness = job.max_lateness
+            stats[job.name] = dict(
+                counters,
+                interval_seconds=job.current_interval(),
+                lateness_ms={
+                    "mean": round(total_ns / runs / 1e6, 3) if runs else None,
+                    "p50": _milliseconds(LatencyHistogram.quantile(buckets, runs, 0.5)),
+                    "p99": _milliseconds(LatencyHistogram.quantile(buckets, runs, 0.99)),
+                    "max": round(max_lateness * 1e3, 3)
+                }
+            )
+        return stats
+
+    def _run(self):
+        if not self._queue:
+            return
+        while not self.stop_event.is_set():
+            due, _, job = self._queue[0]
+            delay = due - time.monotonic()
+            if delay > 0:
+                self.stop_event.wait(delay)
+                continue
+            heapq.heappop(self._queue)
+            self._dispatch(job, due)
+            heapq.heappush(self._queue, self._next_run(job))
+
+    def _dispatch(self, job, due):
+        with self._lock:
+            if job.running:
+                # Still busy with the previous tick: fold this one into it
+                job.counters["overruns"] += 1
+                return
+            job.running = True
+        try:
+            self._executor.submit(self._execute, job, due)
+        except RuntimeError:
+            # Executor shut down by stop() between the check and the submit
+            with self._lock:
+                job.running = False
+
+    def _execute(self, job, due):
+        lateness = max(0.0, time.monotonic() - due)
+        job.lateness.observe(round(lateness * 1e9))
+        try:
+            job.function()
+        except Exception as e:
+            logging.error(f"Scheduled job {job.name} failed: {e}", exc_info=True)
+            with self._lock:
+                job.counters["errors"] += 1
+        finally:
+            with self._lock:
+                job.running = False
+                job.counters["runs"] += 1
+                job.max_lateness = max(job.max_lateness, lateness)
+
+    def _next_run(self, job):
+        """The job's next grid point after now, skipping (and counting) ticks already in the past."""
+        interval = job.current_interval()
+        now = time.monotonic()
+        deadline = job.deadline + interval
+        if deadline <= now:
+            missed = int((now - deadline) // interval) + 1
+            deadline += missed * interval
+            with self._lock:
+                job.counters["missed_ticks"] += missed
+        job.deadline = deadline
+        due = deadline + (random.uniform(0, job.jitter * interval) if job.jitter else 0.0)
+        return due, next(self._sequence), job
+
+
+def _milliseconds(seconds):
+    return None if seconds is None else round(seconds * 1e3, 3)
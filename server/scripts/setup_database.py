@@ -5,18 +5,12 @@ import uuid
 # Add the project root directory to the system path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from models import Base, Device, Metric
-
-# Load database URL from environment variable
-DATABASE_URL = os.getenv('DATABASE_URL')
+from models import Device, Metric, create_tables
+from lib_database.engine import get_engine, create_session
 
 def setup_database():
-    engine = create_engine(DATABASE_URL)
-    Base.metadata.create_all(engine)
-    Session = sessionmaker(bind=engine)
-    session = Session()
+    create_tables(get_engine())
+    session = create_session()
 
     # Add the 'PC' device if it doesn't exist
     if not session.query(Device).filter(Device.name == 'PC').first():
@@ -24,6 +18,7 @@ def setup_database():
         session.add(device)
         print("Device 'PC' added to the database.")
 
+    # Other device metrics are registered automatically the first time a collector reports them
     # Add the 'CPU Usage' metric if it doesn't exist
     if not session.query(Metric).filter(Metric.name == 'CPU Usage').first():
         metric_type_cpu = Metric(uuid=str(uuid.uuid4()), name='CPU Usage')
@@ -2,34 +2,55 @@ import time
 import logging
 import os
 import sys
-import requests
-from tenacity import retry, stop_after_attempt, wait_fixed
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS  # Import CORS
 import threading
+import uuid
+from datetime import datetime
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from lib_utils.blocktimer import BlockTimer  # Import BlockTimer
-from metrics.collect_metrics import get_cpu_usage, get_ram_usage, get_weather_and_air_quality_data
+from lib_config.config import ConfigWatcher
+from lib_utils.blocktimer import BlockTimer, block_timings, configure_block_timers  # Import BlockTimer
+from metrics.collect_metrics import LOCATIONS, get_weather_and_air_quality_data, set_collection_interval
+from metrics.registry import get_collectors
+from fleet import LocationSharder, device_name as resolve_device_name
+from scheduler import Scheduler
+from spool import SampleSpool, SpoolSender
 
-# Replace with your server's endpoint URL
-SERVER_URL = "https://michellevaz.pythonanywhere.com/api/update_metrics"
+# Everything an agent needs to know comes from config.json, so one build serves the whole fleet.
+# Intervals are read again on every tick, so editing them needs no restart.
+config_watcher = ConfigWatcher()
+config = config_watcher.get()
+agent_settings = config.get("agent", {})
+fleet_settings = agent_settings.get("fleet", {})
+SERVER_URL = f"{config['server_url'].rstrip('/')}/api/update_metrics"
+BATCH_SERVER_URL = f"{SERVER_URL}/batch"
+FLEET_AGENTS_URL = f"{config['server_url'].rstrip('/')}/api/fleet/agents"
+configure_block_timers(config.get("instrumentation", {}))
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS
 
-device_metrics_thread = None
-weather_data_thread = None
+scheduler = None
+sender_thread = None
 stop_event = threading.Event()
+# Serialises start/stop, so two requests never start two schedulers or senders
+control_lock = threading.Lock()
+# How long a restart waits for the previous sender's final flush (one POST, 30s timeout)
+SENDER_JOIN_SECONDS = 35
+spool = SampleSpool()
+sharder = None  # Created with the device name on the first start
 
-@retry(stop=stop_after_attempt(3), wait=wait_fixed(2))
-def send_metrics_to_server(device_name, cpu_usage, ram_usage, weather_and_air_quality_data):
-    """Sends collected metrics to the server via HTTP POST request."""
-    payload = {
-        "device_name": device_name,  # Add the device_name to the payload
+def build_payload(device_name, cpu_usage, ram_usage, weather_and_air_quality_data, metrics=None):
+    """Builds the JSON sample accepted by /api/update_metrics and /api/update_metrics/batch."""
+    return {
+        "sample_id": str(uuid.uuid4()),  # Lets the server discard duplicates if a batch is re-sent
+        "timestamp": datetime.utcnow().isoformat(),  # Sample time, not the time the spool drains
+        "device_name": device_name,
         "cpu_usage": cpu_usage,
         "ram_usage": ram_usage,
+        "metrics": metrics or [],  # [{"name", "value", "timestamp"}] from registered collectors
         "weather_and_air_quality_data": [
             {
                 "name": name,
@@ -40,76 +61,116 @@ def send_metrics_to_server(device_name, cpu_usage, ram_usage, weather_and_air_qu
                 "air_quality_index": air_quality_index,
                 "precipitation": precipitation,
                 "uv_index": uv_index,
-                "latitude": lat,  # Include latitude
-                "longitude": lon  # Include longitude
+                "latitude": lat,
+                "longitude": lon
             }
             for name, temp, humidity, wind_speed, pressure, air_quality_index, precipitation, uv_index, lat, lon in weather_and_air_quality_data
         ]
     }
 
-    logging.info(f"Payload to be sent: {payload}")
-    try:
-        with BlockTimer("Sending metrics to server", logging.getLogger(__name__)):
-            response = requests.post(SERVER_URL, json=payload, timeout=120)  # Increase timeout to 120 seconds
-            response.raise_for_status()
-            logging.info("Metrics successfully sent to server.")
-            logging.info(f"Server response: {response.text}")  # Log the server response
-    except requests.RequestException as e:
-        logging.error(f"Error sending metrics to server: {e}")
-        logging.error(f"Response content: {e.response.content if e.response else 'No response'}")  # Log response content if available
-        raise
-
-def collect_device_metrics():
-    device_name = "MichelleLaptop"  
-    
-    while not stop_event.is_set():
-        with BlockTimer("Collecting device metrics", logging.getLogger(__name__)):
-            cpu_usage = get_cpu_usage()
-            ram_usage = get_ram_usage()
-            weather_and_air_quality_data = []  # No weather data for device metrics
-
-        send_metrics_to_server(device_name, cpu_usage, ram_usage, weather_and_air_quality_data)
-        stop_event.wait(5)  # Sleep for 5 seconds
-
-def collect_weather_data():
-    device_name = "MichelleLaptop"  
-    
-    while not stop_event.is_set():
-        with BlockTimer("Collecting weather data", logging.getLogger(__name__)):
-            weather_and_air_quality_data = get_weather_and_air_quality_data()
-            cpu_usage = None  # No CPU data for weather metrics
-            ram_usage = None  # No RAM data for weather metrics
-
-        send_metrics_to_server(device_name, cpu_usage, ram_usage, weather_and_air_quality_data)
-        stop_event.wait(600)  # Sleep for 10 minutes
+def collector_interval(collector):
+    # config.json can override the interval a collector registered with
+    return lambda: config_watcher.get().get("agent", {}).get("collector_intervals", {}).get(collector.name, collector.interval)
+
+def weather_interval():
+    # Seconds between weather/air-quality cycles, overridable like any collector's
+    return config_watcher.get().get("agent", {}).get("collector_intervals", {}).get("weather", 600)
+
+def job_jitter(name):
+    return config_watcher.get().get("agent", {}).get("jitter", {}).get(name, 0.0)
+
+def run_collector(collector, device_name):
+    metrics = collector.sample()
+    spool.append(build_payload(device_name, None, None, [], metrics))
+
+def collect_weather_data(device_name):
+    # Only the locations the fleet's hash ring assigns to this agent
+    locations = sharder.assigned(LOCATIONS)
+    if not locations:
+        return
+    # The interval can change at runtime; cached responses must not outlive a cycle
+    set_collection_interval(weather_interval())
+    with BlockTimer("Collecting weather data", logging.getLogger(__name__)):
+        weather_and_air_quality_data = get_weather_and_air_quality_data(locations)
+        cpu_usage = None  # No CPU data for weather metrics
+        ram_usage = None  # No RAM data for weather metrics
+
+    spool.append(build_payload(device_name, cpu_usage, ram_usage, weather_and_air_quality_data))
+
+def create_scheduler(device_name):
+    """One fixed-rate job per registered collector plus the weather job; sending stays on its own thread."""
+    new_scheduler = Scheduler(stop_event)
+    for collector in get_collectors():
+        new_scheduler.add_job(
+            collector.name, lambda collector=collector: run_collector(collector, device_name),
+            collector_interval(collector), jitter=job_jitter(collector.name)
+        )
+    new_scheduler.add_job("weather", lambda: collect_weather_data(device_name), weather_interval, jitter=job_jitter("weather"))
+    return new_scheduler
 
 @app.route('/start_data_collection', methods=['POST'])
 def start_data_collection():
-    global device_metrics_thread, weather_data_thread, stop_event
     try:
-        if (device_metrics_thread is None or not device_metrics_thread.is_alive()) and (weather_data_thread is None or not weather_data_thread.is_alive()):
-            stop_event.clear()
-            device_metrics_thread = threading.Thread(target=collect_device_metrics)
-            weather_data_thread = threading.Thread(target=collect_weather_data)
-            device_metrics_thread.start()
-            weather_data_thread.start()
-            return jsonify({"message": "Data collection started successfully."}), 200
-        else:
-            return jsonify({"message": "Data collection is already running."}), 200
+        with control_lock:
+            return _start_data_collection()
     except Exception as e:
         logging.error(f"Error starting data collection: {e}")
         return jsonify({"error": str(e)}), 500
 
+def _start_data_collection():
+    global scheduler, sender_thread, stop_event, sharder
+    if scheduler is None or not scheduler.is_running():
+        if sender_thread is not None and sender_thread.is_alive() and stop_event.is_set():
+            # The previous sender is making its last flush: two senders would post and delete the same rows
+            sender_thread.join(SENDER_JOIN_SECONDS)
+            if sender_thread.is_alive():
+                return jsonify({"error": "The previous sender is still flushing the spool; try again shortly."}), 409
+        stop_event.clear()
+        if sharder is None:
+            sharder = LocationSharder(
+                resolve_device_name(agent_settings), FLEET_AGENTS_URL,
+                enabled=fleet_settings.get("enabled", True),
+                refresh_seconds=fleet_settings.get("refresh_seconds", 300),
+                active_minutes=fleet_settings.get("active_minutes", 15)
+            )
+        scheduler = create_scheduler(sharder.device_name)
+        scheduler.start()
+        if sender_thread is None or not sender_thread.is_alive():
+            sender_thread = threading.Thread(target=SpoolSender(spool, BATCH_SERVER_URL, stop_event).run, name="spool-sender")
+            sender_thread.start()
+        return jsonify({"message": "Data collection started successfully."}), 200
+    else:
+        return jsonify({"message": "Data collection is already running."}), 200
+
 @app.route('/stop_data_collection', methods=['POST'])
 def stop_data_collection():
     global stop_event
     try:
-        stop_event.set()
+        with control_lock:
+            stop_event.set()  # Wakes the scheduler and the sender at once
+            if scheduler is not None:
+                scheduler.stop()
         return jsonify({"message": "Data collection stopped successfully."}), 200
     except Exception as e:
         logging.error(f"Error stopping data collection: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/fleet', methods=['GET'])
+def fleet_status():
+    if sharder is None:
+        return jsonify({"message": "Data collection has not been started."}), 200
+    return jsonify(sharder.stats(LOCATIONS)), 200
+
+@app.route('/scheduler', methods=['GET'])
+def scheduler_status():
+    if scheduler is None:
+        return jsonify({"message": "Data collection has not been started."}), 200
+    return jsonify(dict(running=scheduler.is_running(), jobs=scheduler.stats())), 200
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(block_timings.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
     app.run(host='0.0.0.0', port=65433)
\ No newline at end of file
@@ -0,0 +1,221 @@
+"""
+Durable local spool between the collectors and the ingest server.
+
+Collectors append samples to a SQLite (WAL) file and return straight away, so the
+sampling cadence never depends on network health. SpoolSender drains the spool in
+compressed batches to /api/update_metrics/batch, deleting rows only after the
+server has answered, and backs off exponentially while the server is unavailable.
+Only a validation error (400 or 422) drops a batch: any other failure, e.g. a 404
+from a wrong URL, a proxy's 401/403 or an HTML page instead of the server's
+answer, keeps the samples spooled until the server takes them.
+
+Batches start out as gzip-compressed JSON. Once the server's responses advertise
+binary frames (lib_utils.wire_format) or zstd, the sender switches to the most
+compact format both ends support, and steps back down if the server answers 415.
+
+Every sample carries a sample_id that the server turns into deterministic row keys,
+so a batch that is re-sent after a lost response is not stored twice.
+"""
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import requests
+
+from lib_utils.blocktimer import BlockTimer
+from lib_utils.wire_format import FRAME_CONTENT_TYPE, JSON_CONTENT_TYPE, available_encodings, compress, encode_samples
+
+DEFAULT_SPOOL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "spool.db")
+# The server validated the batch and will never accept it as-is
+REJECTED_STATUSES = (400, 422)
+
+
+class SampleSpool:
+    """Append-only, crash-safe FIFO of JSON samples stored in SQLite."""
+
+    def __init__(self, path=DEFAULT_SPOOL_PATH, max_rows=1_000_000):
+        self.path = path
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS samples ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, created_at REAL NOT NULL, payload TEXT NOT NULL)"
+        )
+        # Kept in memory so append() does not need a COUNT(*) per sample
+        self._rows = self._connection.execute("SELECT COUNT(*) FROM samples").fetchone()[0]
+
+    def append(self, payload):
+        """Stores one sample; drops the oldest rows if the spool is over `max_rows`."""
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO samples (created_at, payload) VALUES (?, ?)", (time.time(), json.dumps(payload))
+            )
+            self._rows += 1
+            overflow = self._rows - self.max_rows
+            if overflow > 0:
+                self._rows -= self._connection.execute(
+                    "DELETE FROM samples WHERE id IN (SELECT id FROM samples ORDER BY id LIMIT ?)", (overflow,)
+                ).rowcount
+                logging.warning(f"Spool full, dropped {overflow} oldest samples")
+
+    def peek(self, limit):
+        """Returns up to `limit` of the oldest (id, payload) pairs without removing them."""
+        with self._lock:
+            rows = self._connection.execute("SELECT id, payload FROM samples ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [(row_id, json.loads(payload)) for row_id, payload in rows]
+
+    def delete(self, ids):
+        """Removes acknowledged samples."""
+        if not ids:
+            return
+        with self._lock:
+            self._connection.execute("BEGIN")
+            deleted = self._connection.executemany("DELETE FROM samples WHERE id = ?", [(row_id,) for row_id in ids]).rowcount
+            self._connection.execute("COMMIT")
+            self._rows -= deleted
+
+    def __len__(self):
+        return self._rows
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class SpoolSender:
+    """Background thread that drains a SampleSpool to the batch ingest endpoint."""
+
+    def __init__(self, spool, url, stop_event, batch_size=500, timeout=30, min_backoff=1.0, max_backoff=60.0, idle_wait=1.0):
+        self.spool = spool
+        self.url = url
+        self.stop_event = stop_event
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.idle_wait = idle_wait
+        self._session = requests.Session()
+        self._backoff = 0.0
+        # Upgraded by _negotiate() from the server's Accept-Post / Accept-Encoding headers
+        self.content_type = JSON_CONTENT_TYPE
+        self.content_encoding = "gzip"
+        self._allow_upgrade = True
+
+    def run(self):
+        """Sends batches until stop_event is set, then makes one last attempt to flush."""
+        while not self.stop_event.is_set():
+            sent = self._send_guarded()
+            if sent is None:
+                self.stop_event.wait(self._next_backoff())
+            elif sent == 0:
+                self.stop_event.wait(self.idle_wait)
+            # A full batch means there is a backlog: keep sending without waiting
+        self._send_guarded()
+
+    def _send_guarded(self):
+        # Not fatal: the collectors keep filling the spool, so the sender must outlive any one error
+        try:
+            return self.send_once()
+        except Exception as e:
+            logging.error(f"Error draining the spool, backing off: {e}", exc_info=True)
+            return None
+
+    def send_once(self):
+        """Sends the oldest batch. Returns the number of samples acknowledged, or None on failure."""
+        batch = self.spool.peek(self.batch_size)
+        if not batch:
+            return 0
+
+        ids = [row_id for row_id, _ in batch]
+        content_type, body = self._encode([payload for _, payload in batch])
+        try:
+            with BlockTimer("Sending spooled batch to server", logging.getLogger(__name__)):
+                response = self._session.post(
+                    self.url,
+                    data=compress(body, self.content_encoding),
+                    headers={"Content-Type": content_type, "Content-Encoding": self.content_encoding},
+                    timeout=self.timeout
+                )
+        except requests.RequestException as e:
+            logging.error(f"Error sending spooled batch of {len(batch)} samples: {e}")
+            return None
+
+        if response.status_code == 415 and self._downgrade(response):
+            # Nothing was stored: send the same batch again in the simpler format
+            return 0
+        self._negotiate(response)
+
+        retry_indexes = set()
+        if response.status_code in REJECTED_STATUSES:
+            # The server will never accept this batch as-is; drop it rather than block the spool forever
+            logging.error(f"Server rejected spooled batch of {len(batch)} samples ({response.status_code}): {response.text}")
+        elif response.status_code >= 300:
+            # Overload, outage or misconfiguration (wrong URL, proxy auth, body too large): keep the batch
+            logging.warning(f"Server not accepting spooled batch ({response.status_code}), backing off")
+            return None
+        else:
+            try:
+                results = response.json().get("results", [])
+            except ValueError:
+                logging.warning(f"Spooled batch answered {response.status_code} without the server's JSON, backing off")
+                return None
+            for result in results:
+                if result.get("status") == "retry":
+                    retry_indexes.add(result["index"])
+                elif result.get("status") == "rejected":
+                    logging.warning(f"Server rejected spooled sample: {result.get('error')}")
+
+        acknowledged = [row_id for index, row_id in enumerate(ids) if index not in retry_indexes]
+        self.spool.delete(acknowledged)
+        logging.info(f"Sent {len(acknowledged)} spooled samples, {len(self.spool)} still queued")
+        if retry_indexes:
+            # Server is shedding load: keep the rest and back off
+            return None
+        self._backoff = 0.0
+        return len(acknowledged)
+
+    def _encode(self, payloads):
+        """(Content-Type, uncompressed body) for one batch."""
+        if self.content_type == FRAME_CONTENT_TYPE:
+            try:
+                return FRAME_CONTENT_TYPE, encode_samples(payloads)
+            except ValueError as e:
+                logging.warning(f"Sending batch as JSON, it cannot be framed: {e}")
+        return JSON_CONTENT_TYPE, json.dumps({"metrics": payloads}, separators=(",", ":")).encode("utf-8")
+
+    def _negotiate(self, response):
+        """Switches to the most compact format the server advertises that this agent can also write."""
+        if not self._allow_upgrade:
+            return
+        accepted_types = [value.strip() for value in response.headers.get("Accept-Post", "").split(",")]
+        accepted_encodings = [value.strip() for value in response.headers.get("Accept-Encoding", "").split(",")]
+        content_type = FRAME_CONTENT_TYPE if FRAME_CONTENT_TYPE in accepted_types else self.content_type
+        content_encoding = next((encoding for encoding in available_encodings() if encoding in accepted_encodings), self.content_encoding)
+        if (content_type, content_encoding) != (self.content_type, self.content_encoding):
+            logging.info(f"Server accepts {content_type} with {content_encoding}, switching")
+            self.content_type, self.content_encoding = content_type, content_encoding
+
+    def _downgrade(self, response):
+        """Steps down to a format an older or leaner server reads. Returns False once at plain gzip JSON."""
+        accepted = [value.strip() for value in response.headers.get("Accept-Encoding", "gzip").split(",")]
+        if self.content_encoding not in accepted:
+            self.content_encoding = "gzip"
+        elif self.content_type == FRAME_CONTENT_TYPE:
+            self.content_type = JSON_CONTENT_TYPE
+        else:
+            return False
+        # Some server behind the same URL advertised more than it reads: stop upgrading
+        self._allow_upgrade = False
+        logging.warning(f"Server answered 415, now sending {self.content_type} with {self.content_encoding}")
+        return True
+
+    def _next_backoff(self):
+        self._backoff = min(self.max_backoff, max(self.min_backoff, self._backoff * 2))
+        return self._backoff * random.uniform(0.5, 1.0)
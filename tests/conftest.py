@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# client.app builds its Application at import time: point it at a throwaway database first
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='sysmonitor-tests-'), 'tests.db')}")
+os.environ.setdefault("HOT_TIER_ENABLED", "0")
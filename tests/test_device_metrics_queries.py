@@ -0,0 +1,84 @@
+"""
+/api/device_metrics must run one query per page whatever the page size, so an N+1
+relationship load in the serializer fails here instead of in production.
+"""
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from dto import MetricsDTO
+from lib_database.engine import configure_engine
+from models import create_tables
+import lib_database.update_database as update_db
+
+SAMPLES = 600
+DEVICES = 10
+PAGE_SIZES = (5, 50, 500)
+
+
+class QueryCounter:
+    """Counts statements run on the calling thread only, ignoring background workers."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.thread_id = threading.get_ident()
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        if threading.get_ident() == self.thread_id:
+            self.count += 1
+
+    def measure(self, function):
+        self.count = 0
+        function()
+        return self.count
+
+    def close(self):
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+
+@pytest.fixture(scope="module")
+def client():
+    logging.disable(logging.WARNING)
+    engine = configure_engine(os.environ["DATABASE_URL"])
+    create_tables(engine)
+    start = datetime.utcnow() - timedelta(seconds=SAMPLES)
+    dtos = [
+        MetricsDTO(None, f"test-device-{i % DEVICES}", 12.5, 48.0, [], timestamp=(start + timedelta(seconds=i)).isoformat())
+        for i in range(SAMPLES)
+    ]
+    for offset in range(0, SAMPLES, update_db.MAX_BATCH_SIZE):
+        update_db.update_database_batch(dtos[offset:offset + update_db.MAX_BATCH_SIZE])
+
+    from client.app import appForWSGI
+    # Startup warms caches with queries of its own; keep them out of the first counted request
+    appForWSGI.startup()
+    yield appForWSGI.flask_app.test_client(), engine
+    appForWSGI.shutdown()
+    logging.disable(logging.NOTSET)
+
+
+@pytest.mark.parametrize("filters", ["", "&device=test-device-1", "&device=test-device-1&metric=CPU%20Usage"])
+def test_one_query_per_page(client, filters):
+    test_client, engine = client
+    counter = QueryCounter(engine)
+    try:
+        counts = []
+        for limit in PAGE_SIZES:
+            response = None
+
+            def request():
+                nonlocal response
+                response = test_client.get(f"/api/device_metrics?limit={limit}{filters}")
+
+            counts.append(counter.measure(request))
+            assert response.status_code == 200
+            assert response.get_json()["device_metrics"]
+    finally:
+        counter.close()
+    assert counts == [1] * len(PAGE_SIZES), f"{counts} queries for page sizes {PAGE_SIZES}"